@@ -1,4 +1,7 @@
 
+import time
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -13,6 +16,12 @@ SECRET_KEY = "mysecretkey" # In production, use environment variable!
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# Validated tokens and user rows are cached, so a protected request costs no JWT decode or DB query
+TOKEN_CACHE_TTL = 300   # Seconds; never past the token's own exp
+TOKEN_CACHE_SIZE = 4096
+USER_CACHE_TTL = 60     # Bounds how long a change made by another process (e.g. seed_admin.py) goes unseen
+USER_CACHE_SIZE = 256
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
@@ -34,6 +43,45 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+# --- Caches ---
+
+class TTLCache:
+    """LRU mapping whose entries expire at a per-entry deadline (time.time())."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+token_cache = TTLCache(TOKEN_CACHE_SIZE)   # token -> username
+user_cache = TTLCache(USER_CACHE_SIZE)     # username -> User (detached from its session)
+
+def invalidate_user(username):
+    """Call after a user row is created, changed or deleted."""
+    user_cache.pop(username)
+
 # --- Dependency ---
 
 async def get_current_user(token: str = Depends(oauth2_scheme), session: Session = Depends(get_session)):
@@ -42,16 +90,24 @@ async def get_current_user(token: str = Depends(oauth2_scheme), session: Session
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+    username = token_cache.get(token)
+    if username is None:
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            username: str = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+        except JWTError:
             raise credentials_exception
-    except JWTError:
-        raise credentials_exception
-    
-    statement = select(User).where(User.username == username)
-    user = session.exec(statement).first()
+        now = time.time()
+        token_cache.put(token, username, min(now + TOKEN_CACHE_TTL, payload.get("exp", now)))
+
+    user = user_cache.get(username)
     if user is None:
-        raise credentials_exception
+        statement = select(User).where(User.username == username)
+        user = session.exec(statement).first()
+        if user is None:
+            raise credentials_exception
+        session.expunge(user)
+        user_cache.put(username, user, time.time() + USER_CACHE_TTL)
     return user
@@ -0,0 +1,21 @@
+"""
+Builds the analytics rollups (and dashboard counters) from the existing violation log.
+The server does this by itself the first time it starts on an old database;
+use --rebuild to recompute the rollups from scratch, with the server stopped.
+
+Usage: python backfill_rollups.py [--rebuild]
+"""
+import argparse
+
+from database_config import create_db_and_tables
+from modules.stats import backfill_rollups, backfill_counters
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rebuild", action="store_true", help="drop and recompute existing rollups")
+    args = parser.parse_args()
+
+    create_db_and_tables()
+    backfill_counters()
+    count = backfill_rollups(rebuild=args.rebuild)
+    print(f"[INFO] Done ({count} rollup rows written)")
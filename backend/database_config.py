@@ -1,21 +1,87 @@
 
 from sqlmodel import SQLModel, Field, create_engine, Session, select
+from sqlalchemy import inspect, event, Index, UniqueConstraint
 from typing import Optional
 from datetime import datetime
 
 # Database File
 sqlite_file_name = "database.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
+# Same file opened read-only, for dashboard / analytics queries
+sqlite_read_url = f"sqlite:///file:{sqlite_file_name}?mode=ro&uri=true"
 
-engine = create_engine(sqlite_url, echo=False)
+BUSY_TIMEOUT_MS = 5000         # Wait this long for a lock instead of failing with "database is locked"
+MMAP_SIZE = 256 * 1024 * 1024  # Read pages through a memory map
+CACHE_SIZE_KB = 20000
+POOL_SIZE = 5
+MAX_OVERFLOW = 10
+
+def _make_engine(url, read_only=False):
+    db_engine = create_engine(
+        url, echo=False,
+        # Pooled connections are shared by the request, camera and writer threads
+        connect_args={"check_same_thread": False, "timeout": BUSY_TIMEOUT_MS / 1000},
+        pool_size=POOL_SIZE, max_overflow=MAX_OVERFLOW, pool_pre_ping=True,
+    )
+
+    @event.listens_for(db_engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not read_only:
+            # WAL: readers and the single writer no longer block each other
+            cursor.execute("PRAGMA journal_mode=WAL")
+        else:
+            cursor.execute("PRAGMA query_only=ON")
+        # Durable at checkpoints instead of at every commit (safe with WAL)
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        cursor.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        cursor.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    return db_engine
+
+engine = _make_engine(sqlite_url)
+read_engine = _make_engine(sqlite_read_url, read_only=True)
 
 def create_db_and_tables():
     SQLModel.metadata.create_all(engine)
+    migrate_db()
+
+def migrate_db():
+    """
+    Adds columns and indexes that were introduced after an existing
+    database file was created. create_all() only creates missing tables.
+    New columns must therefore be nullable or have a server default.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                col_type = column.type.compile(engine.dialect)
+                if column.server_default is not None:
+                    col_type += f" DEFAULT '{column.server_default.arg}'"
+                conn.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {col_type}')
+                print(f"[INFO] Migrated: added {table.name}.{column.name}")
+            # Indexes added to an existing table (or on its new columns)
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
 
 def get_session():
     with Session(engine) as session:
         yield session
 
+def get_read_session():
+    """Read-only session for dashboard queries; never takes the write lock."""
+    with Session(read_engine) as session:
+        yield session
+
 # --- Models ---
 
 class User(SQLModel, table=True):
@@ -26,12 +92,56 @@ class User(SQLModel, table=True):
     role: str = Field(default="user") # 'admin', 'user'
 
 class ViolationLog(SQLModel, table=True):
+    # Gallery pages are read newest first by (timestamp, id), see GET /gallery;
+    # the composites serve the same order under a status / name / camera filter
+    __table_args__ = (
+        Index("ix_violationlog_timestamp_id", "timestamp", "id"),
+        Index("ix_violationlog_status_timestamp", "status", "timestamp", "id"),
+        Index("ix_violationlog_person_timestamp", "person_name", "timestamp", "id"),
+        Index("ix_violationlog_camera_timestamp", "camera_id", "timestamp", "id"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     person_name: str
     image_path: Optional[str] = None
-    track_id: int
+    track_id: int = Field(index=True)
     status: str # 'VIOLATION', 'WARNING'
+    camera_id: Optional[str] = None # None for uploaded videos
+
+class SnapshotImage(SQLModel, table=True):
+    # One row per snapshot file, so listings never have to scan the image folders
+    id: Optional[int] = Field(default=None, primary_key=True)
+    path: str = Field(index=True, unique=True) # e.g. database/violations/2024/05/31/Name_20240531_101500_1a2b3c4d.jpg
+    directory: str = Field(index=True) # Folder it was saved under, e.g. database/violations
+    size_bytes: int
+    timestamp: datetime = Field(default_factory=datetime.utcnow, index=True)
+    person_name: str
+    track_id: Optional[int] = None
+    status: Optional[str] = None # 'VIOLATION', 'VERIFIED'
+    camera_id: Optional[str] = None
+
+class StatCounter(SQLModel, table=True):
+    # Running dashboard totals per UTC day and camera, kept up to date by the persistence writer
+    __table_args__ = (UniqueConstraint("day", "camera_id"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    day: str = Field(index=True) # 'YYYY-MM-DD'
+    camera_id: str = "" # '' for /detect and uploaded videos
+    detections: int = 0 # Newly tracked people
+    frames: int = Field(default=0, sa_column_kwargs={"server_default": "0"}) # Frames with people on stateless /detect
+    violations: int = 0
+    verified: int = 0
+
+class EventRollup(SQLModel, table=True):
+    # Event counts per UTC hour and day and camera for the analytics charts, kept up to date by the persistence writer
+    __table_args__ = (UniqueConstraint("period", "bucket", "camera_id"),)
+    id: Optional[int] = Field(default=None, primary_key=True)
+    period: str # 'hour', 'day'
+    bucket: str = Field(index=True) # 'YYYY-MM-DD HH' (hour) or 'YYYY-MM-DD' (day)
+    camera_id: str = "" # '' for /detect and uploaded videos
+    violations: int = 0
+    verified: int = 0
+    identified: int = 0 # Violations by a recognised person
+    unknown: int = 0 # Violations by an unknown person
 
 class VideoAnalysis(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -39,3 +149,13 @@ class VideoAnalysis(SQLModel, table=True):
     upload_timestamp: datetime = Field(default_factory=datetime.utcnow)
     status: str # 'PENDING', 'PROCESSING', 'COMPLETED'
     result_summary: Optional[str] = None # JSON string of stats
+    content_hash: Optional[str] = None # SHA-256 of the uploaded bytes
+    cache_key: Optional[str] = Field(default=None, index=True) # content hash + model/param versions
+    completed_timestamp: Optional[datetime] = None
+
+class VideoSegment(SQLModel, table=True):
+    # Checkpoint of a finished segment so a crashed job can resume
+    id: Optional[int] = Field(default=None, primary_key=True)
+    analysis_id: int = Field(index=True, foreign_key="videoanalysis.id")
+    segment_index: int
+    data: str # JSON payload, layout depends on the analysis mode
@@ -7,6 +7,7 @@ import numpy as np
 from ultralytics import YOLO
 from modules.face_ident import FaceIdentifier
 from modules.utils import save_violation
+from modules.nms import DETECT_IOU, split_by_class
 
 # ==========================================
 # FEATURE 1: Optimization - Threaded Camera
@@ -218,33 +219,14 @@ def main():
             results = model.predict(
                 small_frame, 
                 conf=0.5,  # Increased confidence threshold
-                iou=0.4,   # Lower IoU = more aggressive NMS
+                iou=DETECT_IOU,  # Person boxes overlapping > 30% are merged by the model's NMS
                 agnostic_nms=True,  # Class-agnostic NMS
                 verbose=False, 
                 task='detect',
                 max_det=10  # Limit max detections per image
             )
             
-            person_tracks_raw = []
-            id_card_boxes = []
-
-            if results and results[0].boxes:
-                for box in results[0].boxes:
-                    cls = int(box.cls[0])
-                    conf = float(box.conf[0])
-                    x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                    x1, y1, x2, y2 = x1/scale, y1/scale, x2/scale, y2/scale
-                    
-                    if cls == 1:  # Person
-                        person_tracks_raw.append([x1, y1, x2, y2])
-                    elif cls == 0:  # ID Card
-                        id_card_boxes.append([x1, y1, x2, y2])
-
-            # --- Deduplicate Person Boxes ---
-            from modules.utils import perform_nms
-            # Filter person boxes using strict NMS (IoU 0.3)
-            # This forces merging of any boxes that overlap by more than 30%
-            person_tracks_raw = perform_nms(person_tracks_raw, scores=None, iou_threshold=0.3)
+            person_tracks_raw, id_card_boxes = split_by_class(results[0] if results else None, scale)
 
             # --- Manual Tracking with Improved Tracker ---
             if not hasattr(main, 'person_tracker'):
@@ -0,0 +1,693 @@
+"""
+Shared live camera streams.
+
+A registry of cameras (device indices, files or stream URLs), each with its own
+capture thread and tracker state. One CameraScheduler pulls the freshest frame
+of every camera that is due (per its target FPS) and runs them through the
+detector as a batch; each camera then tracks, annotates and JPEG-encodes its
+frame once. Any number of /video_feed viewers subscribe to the latest encoded
+frame; a slow viewer simply skips frames instead of stalling the producer or
+the other viewers. /ws/detections clients get only the detection metadata
+(plus optional low-rate thumbnails) and draw the overlay themselves; a frame
+is only JPEG-encoded when someone actually watches the MJPEG stream.
+"""
+import os
+import json
+import time
+import queue
+import asyncio
+import threading
+
+from modules.live_feed import (
+    ThreadedCamera,
+    is_stream_url,
+    ComplianceTrackerV2,
+    MotionExtrapolator,
+    MotionDetector,
+    detect_batch,
+    draw_overlay,
+    detection_metadata,
+    encode_thumbnail,
+    encode_mjpeg_part,
+)
+from modules.metrics import metrics
+from modules.load_shedding import LatencyBudget, DEFAULT_BUDGET_MS, SHED_TRAILS, SHED_FACE_ID
+
+IDLE_STOP_SECONDS = 10  # Release the camera this long after the last viewer leaves
+DEFAULT_TARGET_FPS = 10  # Inference rate per camera
+DEFAULT_MAX_BATCH = 8    # Frames per detector call
+FAIRNESS_MODES = ("round_robin", "deadline")
+DEFAULT_FAIRNESS = "round_robin"
+CAMERA_CONFIG = "cameras.json"
+SCHEDULER_MAX_WAIT_S = 0.5  # Longest the scheduler sleeps without a new frame
+IDLE_AFTER_SECONDS = 30    # No person for this long: drop to the heartbeat rate
+HEARTBEAT_FPS = 0.5        # Inference rate of an idle camera (motion wakes it sooner)
+THUMBNAIL_FPS = 1  # Rate of the optional thumbnail channel on /ws/detections
+# "inference": the MJPEG feed shows the inferred frames only (display rate = inference rate)
+# "smooth": every captured frame is shown, with the overlay extrapolated between inferences
+DISPLAY_MODES = ("inference", "smooth")
+MAX_DISPLAY_FPS = 30
+RECONNECT_BASE_S = 1.0  # First retry delay of a dropped stream URL, doubled per failure
+RECONNECT_MAX_S = 30.0
+
+
+class FrameBroadcast:
+    """
+    Latest-value broadcast from one producer thread to many asyncio subscribers.
+    publish() never blocks; subscribers always get the newest value and skip
+    anything published while they were busy.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters = set()  # (loop, asyncio.Event) per subscriber
+        self.seq = 0
+        self.value = None
+        self.closed = False
+
+    def publish(self, value):
+        with self._lock:
+            self.seq += 1
+            self.value = value
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def close(self):
+        with self._lock:
+            self.closed = True
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            loop.call_soon_threadsafe(event.set)
+
+    def latest(self):
+        with self._lock:
+            return self.seq, self.value
+
+    async def subscribe(self):
+        """Async generator of published values (newest only)."""
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = (loop, event)
+        with self._lock:
+            self._waiters.add(waiter)
+            if self.value is not None:
+                event.set()
+        last_seq = 0
+        try:
+            while True:
+                await event.wait()
+                event.clear()
+                with self._lock:
+                    if self.closed:
+                        break
+                    seq, value = self.seq, self.value
+                if seq == last_seq or value is None:
+                    continue
+                if last_seq and seq - last_seq > 1:
+                    metrics.inc("broadcast_frames_skipped", seq - last_seq - 1)
+                last_seq = seq
+                yield value
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+
+class CameraStream:
+    """
+    One camera source: its capture thread, tracker state and subscribers.
+    Detection is done by the CameraScheduler, which hands results to submit().
+    In "smooth" display mode a separate display thread draws the MJPEG feed at
+    the camera's own rate.
+    """
+
+    def __init__(self, camera_id, source, face_ident, event_sink,
+                 target_fps=DEFAULT_TARGET_FPS, always_on=False, display_mode="inference", on_frame=None,
+                 latency_budget_ms=DEFAULT_BUDGET_MS, detection_sink=None):
+        if display_mode not in DISPLAY_MODES:
+            raise ValueError(f"display_mode must be one of {DISPLAY_MODES}")
+        self.camera_id = camera_id
+        self.source = source
+        self.face_ident = face_ident
+        self.event_sink = event_sink
+        self.detection_sink = detection_sink  # detection_sink(n, camera_id=...) counts newly seen people
+        self.target_fps = target_fps
+        self.always_on = always_on  # Keep capturing (and logging) without viewers
+        self.display_mode = display_mode
+        self.on_frame = on_frame  # Wakes the scheduler when a frame arrives
+        # Capture-to-publish latency; shedding keeps the live status real-time under load
+        self.budget = LatencyBudget(f"camera_{camera_id}", latency_budget_ms)
+
+        self.broadcast = FrameBroadcast()    # MJPEG parts
+        self.detections = FrameBroadcast()   # (metadata JSON, thumbnail JPEG or None)
+        self.subscribers = 0                 # MJPEG viewers
+        self.ws_subscribers = 0              # Metadata clients
+        self.thumbnail_subscribers = 0       # Metadata clients that also want thumbnails
+        self.last_subscriber_left = time.time()
+        self.camera = None          # Set while the capture is open
+        # "stopped", "starting", "running", "reconnecting" (stream URLs) or "error"
+        self.state = "stopped"
+        self.error = None           # Why the source failed, for "reconnecting" / "error"
+        self.next_due = 0.0         # Scheduler time of the next inference
+        self.frames_inferred = 0
+        # Presence: an empty scene is only checked at HEARTBEAT_FPS until motion shows up
+        self.idle = False
+        self.last_person_seen = time.monotonic()
+        self.motion = MotionDetector()
+        self._motion_seq = 0
+        self.results = queue.Queue(maxsize=1)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    # ------------------------------------------
+    # Lifecycle
+    # ------------------------------------------
+    def _ensure_running(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self.broadcast = FrameBroadcast()
+            self.detections = FrameBroadcast()
+            self.results = queue.Queue(maxsize=1)
+            self._thread = threading.Thread(target=self._run, name=f"camera-{self.camera_id}")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+        self.broadcast.close()
+        self.detections.close()
+
+    def _should_idle_out(self):
+        if self.always_on:
+            return False
+        with self._lock:
+            if self.subscribers + self.ws_subscribers == 0 and time.time() - self.last_subscriber_left > IDLE_STOP_SECONDS:
+                self._thread = None  # A new subscriber starts a fresh producer
+                return True
+            return False
+
+    def status(self):
+        return {
+            "camera_id": self.camera_id,
+            "source": self.source,
+            "target_fps": self.target_fps,
+            "always_on": self.always_on,
+            "display_mode": self.display_mode,
+            "running": self.camera is not None,
+            "state": self.state,
+            "error": self.error,
+            "idle": self.idle,
+            "viewers": self.subscribers,
+            "metadata_clients": self.ws_subscribers,
+            "frames_inferred": self.frames_inferred,
+            "latency": self.budget.status(),
+        }
+
+    # ------------------------------------------
+    # Scheduler side
+    # ------------------------------------------
+    def grab_latest(self):
+        """Newest captured frame not yet handed to the scheduler, or None."""
+        camera = self.camera
+        if camera is None:
+            return None
+        return camera.read_latest()
+
+    def record_presence(self, person_boxes, now):
+        """Updates the idle state after an inference; returns the delay until the next one."""
+        if person_boxes:
+            self.last_person_seen = now
+            self.idle = False
+        elif not self.idle and now - self.last_person_seen > IDLE_AFTER_SECONDS:
+            self.idle = True
+            self.motion.reset()
+            metrics.inc("camera_idle_entered")
+        return 1.0 / (HEARTBEAT_FPS if self.idle else self.target_fps)
+
+    def check_motion(self, now):
+        """For an idle camera: wakes it (due right now) if the newest frame shows motion."""
+        camera = self.camera
+        if not self.idle or camera is None:
+            return
+        seq, frame = camera.wait_for_frame(self._motion_seq, timeout=0)
+        if frame is None:
+            return
+        self._motion_seq = seq
+        if self.motion.update(frame):
+            self.idle = False
+            self.last_person_seen = now  # Full rate for at least IDLE_AFTER_SECONDS
+            self.next_due = now
+            metrics.inc("camera_motion_wakeups")
+
+    def submit(self, frame, person_boxes, id_card_boxes, captured_at):
+        """Passes one detected frame on; a result not yet picked up is replaced."""
+        item = (frame, person_boxes, id_card_boxes, captured_at)
+        try:
+            self.results.put_nowait(item)
+        except queue.Full:
+            try:
+                self.results.get_nowait()
+                metrics.inc("camera_results_dropped")
+            except queue.Empty:
+                pass
+            self.results.put_nowait(item)  # The scheduler is the only producer
+
+    def _log_event(self, person_name, image_path, track_id, status):
+        self.event_sink(person_name, image_path, track_id, status, camera_id=self.camera_id)
+
+    # ------------------------------------------
+    # Producer
+    # ------------------------------------------
+    def _run(self):
+        # SimpleTracker fallback import inside function to avoid circular imports if any
+        from modules.tracker_simple import SimpleTracker
+
+        broadcast = self.broadcast  # Replaced when a later producer starts
+        detections = self.detections
+        results = self.results
+        tracker = ComplianceTrackerV2(self.face_ident, self._log_event, self.camera_id)
+        # Initialize with stricter parameters to prevent duplicate detections
+        person_tracker = SimpleTracker(max_disappeared=30, distance_threshold=100)
+        self.state, self.error = "starting", None
+        failures = 0
+
+        try:
+            while not self._stop.is_set():
+                cap = ThreadedCamera(self.source, on_frame=self.on_frame)
+                if not cap.opened:
+                    cap.release()
+                    lost = "could not be opened"
+                else:
+                    failures = 0
+                    if not self._serve(cap, tracker, person_tracker, broadcast, detections, results):
+                        self.state = "stopped"  # Stopped or idled out
+                        break
+                    lost = "stopped delivering frames"
+
+                if not is_stream_url(self.source):
+                    if cap.opened and isinstance(self.source, str):
+                        self.state = "stopped"  # The video file has ended
+                    else:
+                        self.state, self.error = "error", f"Camera {lost}"
+                        print(f"[ERROR] Camera {self.camera_id} ({self.source}) {lost}")
+                    break
+                # Network streams drop and come back: retry with backoff while someone is watching
+                delay = min(RECONNECT_MAX_S, RECONNECT_BASE_S * 2 ** failures)
+                failures += 1
+                self.state, self.error = "reconnecting", f"Stream {lost}"
+                metrics.inc("camera_reconnects")
+                print(f"[WARN] Camera {self.camera_id} ({self.source}) {lost}; reconnecting in {delay:g}s")
+                if self._stop.wait(delay) or self._should_idle_out():
+                    self.state = "stopped"
+                    break
+        except Exception as e:
+            self.state, self.error = "error", str(e)
+            raise
+        finally:
+            # Ends the streams of any viewer still attached (e.g. after an error or a lost source)
+            broadcast.close()
+            detections.close()
+            print(f"[INFO] Camera {self.camera_id} stopped")
+
+    def _serve(self, cap, tracker, person_tracker, broadcast, detections, results):
+        """
+        Serves one open capture until the stream stops or idles out (returns False)
+        or the capture stops delivering frames (returns True).
+        """
+        seq = 0
+        last_thumbnail = 0.0
+        time.sleep(1.0) # Warmup
+        self.idle = False
+        self.last_person_seen = time.monotonic()
+        self.camera = cap  # From now on the scheduler serves this camera
+        self.state, self.error = "running", None
+        print(f"[INFO] Camera {self.camera_id} ({self.source}) started")
+
+        smooth = self.display_mode == "smooth"
+        extrapolator = MotionExtrapolator()
+        display_stop = threading.Event()
+        display_thread = None
+        if smooth:
+            display_thread = threading.Thread(
+                target=self._display_loop, args=(cap, extrapolator, broadcast, display_stop),
+                name=f"camera-{self.camera_id}-display"
+            )
+            display_thread.daemon = True
+            display_thread.start()
+
+        try:
+            while not self._stop.is_set():
+                if self._should_idle_out():
+                    break
+
+                try:
+                    frame, person_tracks_raw, id_card_boxes, captured_at = results.get(timeout=0.5)
+                except queue.Empty:
+                    if not cap.alive():
+                        return True
+                    continue
+
+                start = time.perf_counter()
+                person_tracks = person_tracker.update(person_tracks_raw)
+                if self.detection_sink:
+                    # A detection is a person (track) seen for the first time
+                    new_people = sum(1 for t in person_tracks if t[4] not in tracker.people_state)
+                    if new_people:
+                        self.detection_sink(new_people, camera_id=self.camera_id)
+                display_data = tracker.update(frame, person_tracks, id_card_boxes,
+                                              identify_faces=not self.budget.sheds(SHED_FACE_ID))
+                seq += 1
+
+                # Each output is only produced while someone consumes it
+                if self.ws_subscribers:
+                    thumbnail = None
+                    now = time.time()
+                    if self.thumbnail_subscribers and now - last_thumbnail >= 1.0 / THUMBNAIL_FPS:
+                        thumbnail = encode_thumbnail(frame)  # Before drawing: clients overlay their own boxes
+                        last_thumbnail = now
+                    message = json.dumps({
+                        "camera_id": self.camera_id,
+                        "seq": seq,
+                        "ts": round(now, 3),
+                        "detections": detection_metadata(display_data, tracker.people_state, frame.shape),
+                    })
+                    detections.publish((message, thumbnail))
+
+                if smooth:
+                    extrapolator.update(display_data, tracker.trails, captured_at)
+                elif self.subscribers:
+                    trails = {} if self.budget.sheds(SHED_TRAILS) else tracker.trails
+                    draw_overlay(frame, trails, display_data)
+                    # Encoded once, shared by every viewer
+                    broadcast.publish(encode_mjpeg_part(frame))
+                metrics.observe("camera_frame_ms", (time.perf_counter() - start) * 1000)
+                self.budget.observe((time.monotonic() - captured_at) * 1000)
+            return False
+        finally:
+            self.camera = None
+            if display_thread is not None:
+                display_stop.set()
+                display_thread.join()
+            cap.release()
+
+    def _display_loop(self, cap, extrapolator, broadcast, display_stop):
+        """Smooth mode: draws the latest (extrapolated) overlay on every captured frame."""
+        min_interval = 1.0 / MAX_DISPLAY_FPS
+        seq = 0
+        while not display_stop.is_set():
+            seq, frame = cap.wait_for_frame(seq, timeout=0.5)
+            if frame is None or not self.subscribers:
+                continue
+
+            start = time.perf_counter()
+            display_data, trails = extrapolator.predict(time.monotonic())
+            if self.budget.sheds(SHED_TRAILS):
+                trails = {}
+            frame = frame.copy()  # The captured frame is shared with the scheduler
+            draw_overlay(frame, trails, display_data)
+            broadcast.publish(encode_mjpeg_part(frame))
+            elapsed = time.perf_counter() - start
+            metrics.observe("camera_display_ms", elapsed * 1000)
+            if elapsed < min_interval:
+                time.sleep(min_interval - elapsed)
+
+    # ------------------------------------------
+    # Consumers
+    # ------------------------------------------
+    async def mjpeg_frames(self):
+        """Async generator of multipart JPEG parts for one viewer."""
+        with self._lock:
+            self.subscribers += 1
+        self._ensure_running()
+        try:
+            async for part in self.broadcast.subscribe():
+                yield part
+        finally:
+            with self._lock:
+                self.subscribers -= 1
+                if self.subscribers + self.ws_subscribers == 0:
+                    self.last_subscriber_left = time.time()
+
+    async def detection_messages(self, thumbnails=False):
+        """
+        Async generator of (metadata JSON, thumbnail JPEG or None) for one client.
+        Thumbnails are only included when asked for.
+        """
+        with self._lock:
+            self.ws_subscribers += 1
+            if thumbnails:
+                self.thumbnail_subscribers += 1
+        self._ensure_running()
+        try:
+            async for message, thumbnail in self.detections.subscribe():
+                yield message, (thumbnail if thumbnails else None)
+        finally:
+            with self._lock:
+                self.ws_subscribers -= 1
+                if thumbnails:
+                    self.thumbnail_subscribers -= 1
+                if self.subscribers + self.ws_subscribers == 0:
+                    self.last_subscriber_left = time.time()
+
+
+class CameraScheduler:
+    """
+    The one inference loop shared by all cameras.
+    Each tick it takes the freshest frame of every running camera whose next
+    inference is due, up to max_batch of them, and runs them through the
+    detector in a single call. When more cameras are due than fit in a batch:
+    - round_robin: the camera that goes first rotates every tick
+    - deadline: the cameras furthest behind their target FPS go first
+    Idle cameras (no person for IDLE_AFTER_SECONDS) are only inferred at
+    HEARTBEAT_FPS; a motion check on each of their new frames brings them back
+    to full rate. Between ticks the scheduler sleeps until a camera delivers a
+    frame or the next one is due, instead of polling.
+    """
+
+    def __init__(self, model, streams, max_batch=DEFAULT_MAX_BATCH, fairness=DEFAULT_FAIRNESS):
+        scheduler_settings(fairness, max_batch)  # Validates
+        self.model = model
+        self.streams = streams  # Callable returning the current CameraStreams
+        self.max_batch = max_batch
+        self.fairness = fairness
+        self._cursor = 0
+        self._thread = None
+        self._stop = threading.Event()
+        self._wakeup = threading.Event()
+
+    def wake(self):
+        """Called by the capture threads on every new frame."""
+        self._wakeup.set()
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="camera-scheduler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+
+    def _wait_time(self, now):
+        """Time until the next camera is due; cameras already due wait for their next frame."""
+        pending = [s.next_due - now for s in self.streams() if s.camera is not None and s.next_due > now]
+        return min(pending + [SCHEDULER_MAX_WAIT_S])
+
+    def _pick(self, now):
+        streams = sorted(self.streams(), key=lambda s: s.camera_id)
+        for stream in streams:
+            stream.check_motion(now)
+        due = [s for s in streams if s.camera is not None and now >= s.next_due]
+        if not due:
+            return []
+
+        if self.fairness == "deadline":
+            # Frames behind schedule, so cameras with different targets compare fairly
+            due.sort(key=lambda s: (now - s.next_due) * s.target_fps, reverse=True)
+        else:
+            self._cursor = (self._cursor + 1) % len(due)
+            due = due[self._cursor:] + due[:self._cursor]
+
+        batch = []
+        for stream in due:
+            if len(batch) >= self.max_batch:
+                break
+            frame = stream.grab_latest()
+            if frame is None:
+                continue
+            if stream.budget.should_drop():
+                stream.next_due = now + 1.0 / stream.target_fps
+                continue
+            batch.append((stream, frame))
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            # Cleared before looking, so a frame arriving meanwhile is not missed
+            self._wakeup.clear()
+            now = time.monotonic()
+            batch = self._pick(now)
+            if not batch:
+                self._wakeup.wait(self._wait_time(now))
+                continue
+
+            start = time.perf_counter()
+            try:
+                detections = detect_batch(self.model, [frame for _, frame in batch],
+                                          [stream.budget.detect_width() for stream, _ in batch])
+            except Exception as e:
+                print(f"[ERROR] Camera scheduler inference failed: {e}")
+                time.sleep(0.5)
+                continue
+            metrics.observe("scheduler_batch_size", len(batch))
+            metrics.observe("scheduler_batch_ms", (time.perf_counter() - start) * 1000)
+
+            for (stream, frame), (person_boxes, id_card_boxes) in zip(batch, detections):
+                stream.next_due = now + stream.record_presence(person_boxes, now)
+                stream.frames_inferred += 1
+                stream.submit(frame, person_boxes, id_card_boxes, now)
+
+
+def parse_source(source):
+    """Device indices may arrive as strings ("0"); files and URLs stay as they are."""
+    if isinstance(source, str) and source.isdigit():
+        return int(source)
+    return source
+
+
+def scheduler_settings(fairness=None, max_batch=None):
+    """
+    Validated CameraScheduler settings {"fairness", "max_batch"}. Unset ones come
+    from the CAMERA_FAIRNESS / CAMERA_MAX_BATCH environment variables, then the
+    defaults. Raises ValueError for an unknown mode or a batch size below 1.
+    """
+    if fairness is None:
+        fairness = os.environ.get("CAMERA_FAIRNESS", DEFAULT_FAIRNESS)
+    if max_batch is None:
+        max_batch = os.environ.get("CAMERA_MAX_BATCH", DEFAULT_MAX_BATCH)
+    if fairness not in FAIRNESS_MODES:
+        raise ValueError(f"fairness must be one of {FAIRNESS_MODES}")
+    try:
+        max_batch = int(max_batch)
+    except (TypeError, ValueError):
+        raise ValueError(f"max_batch must be an integer, got {max_batch!r}")
+    if max_batch < 1:
+        raise ValueError("max_batch must be at least 1")
+    return {"fairness": fairness, "max_batch": max_batch}
+
+
+def read_config(path=CAMERA_CONFIG):
+    """
+    Reads a camera config file; returns (scheduler settings, camera entries).
+    The file is either a list of cameras or
+    {"scheduler": {"fairness": "deadline", "max_batch": 8}, "cameras": [...]};
+    settings missing from the file fall back as in scheduler_settings().
+    """
+    with open(path) as f:
+        config = json.load(f)
+    if isinstance(config, list):
+        return scheduler_settings(), config
+    scheduler = config.get("scheduler", {})
+    return scheduler_settings(scheduler.get("fairness"), scheduler.get("max_batch")), config.get("cameras", [])
+
+
+class CameraHub:
+    """Registry of camera streams sharing one CameraScheduler."""
+
+    def __init__(self, model, face_ident, event_sink, detection_sink=None, max_batch=DEFAULT_MAX_BATCH,
+                 fairness=DEFAULT_FAIRNESS):
+        self.face_ident = face_ident
+        self.event_sink = event_sink
+        self.detection_sink = detection_sink
+        self.streams = {}
+        self._lock = threading.Lock()
+        self.scheduler = CameraScheduler(model, self.list, max_batch, fairness)
+
+        metrics.set_gauge("camera_viewers", lambda: sum(s.subscribers + s.ws_subscribers for s in self.list()))
+        metrics.set_gauge("active_cameras", self.active_count)
+        metrics.set_gauge("idle_cameras", lambda: sum(1 for s in self.list() if s.camera is not None and s.idle))
+
+    def add(self, camera_id, source, target_fps=DEFAULT_TARGET_FPS, always_on=False, display_mode="inference",
+            latency_budget_ms=DEFAULT_BUDGET_MS):
+        """Registers a camera. Raises ValueError if the id is taken."""
+        camera_id = str(camera_id)
+        if target_fps <= 0:
+            raise ValueError("target_fps must be positive")
+        with self._lock:
+            if camera_id in self.streams:
+                raise ValueError(f"Camera {camera_id} already registered")
+            stream = self.streams[camera_id] = CameraStream(
+                camera_id, parse_source(source), self.face_ident, self.event_sink,
+                target_fps=target_fps, always_on=always_on, display_mode=display_mode,
+                on_frame=self.scheduler.wake, latency_budget_ms=latency_budget_ms,
+                detection_sink=self.detection_sink
+            )
+        self.scheduler.start()
+        if always_on:
+            stream._ensure_running()
+        return stream
+
+    def remove(self, camera_id):
+        with self._lock:
+            stream = self.streams.pop(str(camera_id), None)
+        if stream is not None:
+            stream.stop()
+        return stream is not None
+
+    def get(self, camera_id="0"):
+        with self._lock:
+            return self.streams.get(str(camera_id))
+
+    def list(self):
+        with self._lock:
+            return list(self.streams.values())
+
+    def active_count(self):
+        return sum(1 for s in self.list() if s.camera is not None)
+
+    def scheduler_config(self):
+        return {"fairness": self.scheduler.fairness, "max_batch": self.scheduler.max_batch}
+
+    def configure(self, fairness=None, max_batch=None):
+        """Changes the scheduler settings; takes effect on the next tick. Raises ValueError if invalid."""
+        settings = scheduler_settings(
+            fairness if fairness is not None else self.scheduler.fairness,
+            max_batch if max_batch is not None else self.scheduler.max_batch
+        )
+        self.scheduler.fairness = settings["fairness"]
+        self.scheduler.max_batch = settings["max_batch"]
+        return settings
+
+    def load_config(self, path=CAMERA_CONFIG):
+        """
+        Applies the scheduler settings and registers the cameras of a JSON file (see read_config):
+        [{"id": "gate-1", "source": "rtsp://...", "target_fps": 8, "always_on": true,
+          "display_mode": "smooth", "latency_budget_ms": 250}, ...]
+        """
+        settings, cameras = read_config(path)
+        self.configure(**settings)
+        self.add_cameras(cameras)
+
+    def add_cameras(self, entries):
+        """Registers camera config entries (the list part of a config file)."""
+        for entry in entries:
+            self.add(entry["id"], entry["source"],
+                     target_fps=entry.get("target_fps", DEFAULT_TARGET_FPS),
+                     always_on=entry.get("always_on", False),
+                     display_mode=entry.get("display_mode", "inference"),
+                     latency_budget_ms=entry.get("latency_budget_ms", DEFAULT_BUDGET_MS))
+
+    def stop_all(self):
+        self.scheduler.stop()
+        for stream in self.list():
+            stream.stop()
@@ -0,0 +1,117 @@
+"""
+Response encodings for the high-rate APIs (/detect, /detect/batch,
+/verified_list and the analysis streams).
+
+The client picks the encoding with its Accept header:
+  application/json     (default) serialized with orjson when installed
+  application/msgpack  MessagePack (needs the msgpack package); detection
+                       lists are sent column-wise, with all boxes packed into
+                       one float32 little-endian array (4 values per box)
+Streams are NDJSON for JSON and back-to-back MessagePack objects otherwise.
+
+fields=bbox,name (query parameter) limits each detection / row to those keys,
+e.g. to leave out the colors the frontend computes itself.
+"""
+import json
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+from fastapi.responses import Response
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+NDJSON = "application/x-ndjson"
+MSGPACK_TYPES = (MSGPACK, "application/x-msgpack")
+PACKED_KEYS = ("detections",)  # Lists of {"bbox": [...], ...} sent column-wise in MessagePack
+DETECTION_FIELDS = ("bbox", "status", "color", "name")
+
+
+def negotiate(accept):
+    """MSGPACK if the Accept header asks for it (and msgpack is installed), else JSON."""
+    if accept and msgpack is not None:
+        for part in accept.split(","):
+            if part.split(";")[0].strip().lower() in MSGPACK_TYPES:
+                return MSGPACK
+    return JSON
+
+
+def parse_fields(fields, allowed):
+    """fields query value ('bbox,name') as a tuple, or None for all; raises ValueError for unknown names."""
+    if not fields:
+        return None
+    names = tuple(name.strip() for name in fields.split(",") if name.strip())
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)} (allowed: {', '.join(allowed)})")
+    return names
+
+
+def select_fields(rows, fields):
+    """Keeps only the given keys of each row dict; fields=None keeps everything."""
+    if fields is None:
+        return rows
+    return [{key: row[key] for key in fields if key in row} for row in rows]
+
+
+def pack_boxes(rows):
+    """Column-wise form of a detection list, with the bboxes as one packed float32 array."""
+    keys = list(rows[0]) if rows else ["bbox"]
+    columns = {key: [row.get(key) for row in rows] for key in keys if key != "bbox"}
+    if "bbox" in keys:
+        columns["bbox"] = np.asarray([row["bbox"] for row in rows], dtype="<f4").reshape(-1, 4).tobytes()
+    columns["count"] = len(rows)
+    return columns
+
+
+def _packed(obj):
+    if isinstance(obj, dict):
+        return {key: pack_boxes(value) if key in PACKED_KEYS and isinstance(value, list) else _packed(value)
+                for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [_packed(value) for value in obj]
+    return obj
+
+
+def _default(obj):
+    """Numpy scalars and arrays, which the detector output is full of."""
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Cannot serialize {type(obj).__name__}")
+
+
+def dumps(obj, media_type=JSON):
+    """obj encoded as bytes in the given media type."""
+    if media_type == MSGPACK:
+        return msgpack.packb(_packed(obj), default=_default, use_bin_type=True)
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(obj, default=_default, separators=(",", ":")).encode()
+
+
+def encoded_response(obj, media_type=JSON, status_code=200, headers=None):
+    return Response(dumps(obj, media_type), status_code=status_code, media_type=media_type, headers=headers)
+
+
+def stream_media_type(media_type):
+    return MSGPACK if media_type == MSGPACK else NDJSON
+
+
+def encode_stream(updates, media_type=JSON):
+    """Encodes each update of a stream: one NDJSON line, or one self-delimiting MessagePack object."""
+    for update in updates:
+        if media_type == MSGPACK:
+            yield dumps(update, MSGPACK)
+        else:
+            yield dumps(update) + b"\n"
@@ -78,8 +78,18 @@ class FaceIdentifier:
 
     def identify(self, frame, person_bbox, threshold=0.35):
         """
-        Identifies the person within the bbox.
-        Lowered threshold to 0.35 for better matching (was 0.4)
+        Identifies the person within the bbox. Returns the name only;
+        see identify_with_embedding() for the matching logic (threshold 0.35).
+        """
+        if len(self.known_face_embeddings) == 0:
+            return "Unknown"
+        name, _ = self.identify_with_embedding(frame, person_bbox, threshold)
+        return name
+
+    def identify_with_embedding(self, frame, person_bbox, threshold=0.35):
+        """
+        Same as identify(), but also returns the face embedding that was matched
+        (or None if no face was found) so callers can compare people across runs.
         """
         # Crop the person from the frame
         x1, y1, x2, y2 = map(int, person_bbox)
@@ -88,8 +98,8 @@ class FaceIdentifier:
         x2, y2 = min(w, x2), min(h, y2)
 
         person_roi = frame[y1:y2, x1:x2]
-        if person_roi.size == 0 or len(self.known_face_embeddings) == 0:
-            return "Unknown"
+        if person_roi.size == 0:
+            return "Unknown", None
 
         # Use full frame for better detection context, but focus on person region
         # InsightFace works better with full image context
@@ -99,7 +109,7 @@ class FaceIdentifier:
             # Fallback: try ROI if full frame detection fails
             faces = self.app.get(person_roi)
             if not faces:
-                return "Unknown"
+                return "Unknown", None
             # For ROI, just take the largest face
             target_face = max(faces, key=lambda x: (x.bbox[2]-x.bbox[0]) * (x.bbox[3]-x.bbox[1]))
         else:
@@ -114,12 +124,15 @@ class FaceIdentifier:
                     valid_faces.append(face)
             
             if not valid_faces:
-                return "Unknown"
+                return "Unknown", None
             
             # Take the largest valid face
             target_face = max(valid_faces, key=lambda x: (x.bbox[2]-x.bbox[0]) * (x.bbox[3]-x.bbox[1]))
         target_embedding = target_face.embedding
 
+        if len(self.known_face_embeddings) == 0:
+            return "Unknown", target_embedding
+
         # Compare with DB - Compute Cosine Similarity
         sims = cosine_similarity([target_embedding], self.known_face_embeddings)[0]
         
@@ -134,7 +147,7 @@ class FaceIdentifier:
 
         if best_score > threshold:
             print(f"[MATCH] Identified: {self.known_face_names[best_idx]} (score: {best_score:.3f}, threshold: {threshold})")
-            return self.known_face_names[best_idx]
+            return self.known_face_names[best_idx], target_embedding
         
         print(f"[NO MATCH] Best: {self.known_face_names[best_idx]} ({best_score:.3f}) < threshold ({threshold})")
-        return "Unknown"
+        return "Unknown", target_embedding
@@ -0,0 +1,106 @@
+"""
+Micro-batching for request-driven inference (/detect, /detect/batch).
+
+Requests hand their frames to the InferenceScheduler and await a future. One
+worker thread collects the frames of concurrent requests into a batch, until
+max_batch frames are waiting or the oldest has waited max_wait_ms, runs them
+through the detector in one call and resolves each request's future with its
+own slice of the result. The event loop never runs inference itself.
+
+Batch sizes and queue waits are reported as the detect_batch_size and
+detect_queue_wait_ms histograms.
+"""
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import Future
+
+from modules.metrics import metrics
+from modules.live_feed import detect_batch
+
+DEFAULT_MAX_BATCH = 8
+DEFAULT_MAX_WAIT_MS = 5
+
+_STOP = object()
+
+
+class InferenceScheduler:
+    def __init__(self, model, max_batch=DEFAULT_MAX_BATCH, max_wait_ms=DEFAULT_MAX_WAIT_MS):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.q = queue.Queue()
+        self._thread = None
+
+        metrics.set_gauge("detect_queue_depth", self.q.qsize)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="inference-scheduler", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Finishes the frames already queued, then stops."""
+        if self._thread is not None:
+            self.q.put(_STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def submit(self, frame, detect_w=640):
+        """Queues one frame; the Future resolves to its (person_boxes, id_card_boxes)."""
+        future = Future()
+        self.q.put((frame, detect_w, future, time.perf_counter()))
+        return future
+
+    async def detect(self, frame, detect_w=640):
+        """submit() for coroutines: awaits the frame's detections without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(frame, detect_w))
+
+    # ------------------------------------------
+    # Worker Thread
+    # ------------------------------------------
+    def _collect(self):
+        """Waits for the first frame, then gathers more until the batch is full or max_wait has passed."""
+        first = self.q.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        deadline = first[3] + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self.q.get(timeout=remaining) if remaining > 0 else self.q.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                self.q.put(_STOP)  # Stop after this batch
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                break
+            # Requests that went away (client disconnected) are skipped
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            started = time.perf_counter()
+            for _, _, _, enqueued in batch:
+                metrics.observe("detect_queue_wait_ms", (started - enqueued) * 1000)
+            metrics.observe("detect_batch_size", len(batch))
+
+            try:
+                detections = detect_batch(self.model, [item[0] for item in batch], [item[1] for item in batch])
+            except Exception as e:
+                for _, _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for (_, _, future, _), result in zip(batch, detections):
+                future.set_result(result)
+            metrics.observe("detect_inference_ms", (time.perf_counter() - started) * 1000)
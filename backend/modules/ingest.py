@@ -0,0 +1,126 @@
+"""
+Frame ingest for the /detect endpoints: splitting batch payloads and decoding
+JPEGs on a shared thread pool (cv2.imdecode releases the GIL, so frames of one
+batch decode in parallel).
+
+The detector only sees detect_w pixels, so JPEGs are decoded at the smallest
+of libjpeg's reduced scales (1/2, 1/4, 1/8) that is still at least that wide,
+which skips most of the IDCT work on 4K frames. The original resolution is
+only decoded when a snapshot is saved (DecodedFrame.full()).
+"""
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+DECODE_WORKERS = 4
+MAX_BATCH_FRAMES = 16
+MAX_FRAME_BYTES = 16 * 1024 * 1024
+REDUCED_MODES = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+LENGTH_PREFIX = struct.Struct(">I")  # Each frame of a binary batch: 4-byte big-endian length, then the JPEG
+
+_decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="frame-decode")
+
+
+class PayloadError(ValueError):
+    """A batch body that cannot be split into frames."""
+
+
+def split_length_prefixed(body, max_frames=MAX_BATCH_FRAMES):
+    """Splits a length-prefixed binary batch into the encoded frames."""
+    frames = []
+    offset = 0
+    while offset < len(body):
+        if offset + LENGTH_PREFIX.size > len(body):
+            raise PayloadError("Truncated length prefix")
+        (length,) = LENGTH_PREFIX.unpack_from(body, offset)
+        offset += LENGTH_PREFIX.size
+        if length == 0 or length > MAX_FRAME_BYTES or offset + length > len(body):
+            raise PayloadError(f"Invalid frame length {length} at frame {len(frames)}")
+        frames.append(body[offset:offset + length])
+        offset += length
+        if len(frames) > max_frames:
+            raise PayloadError(f"At most {max_frames} frames per batch")
+    if not frames:
+        raise PayloadError("Empty batch")
+    return frames
+
+
+class DecodedFrame:
+    """
+    A frame decoded at 1/scale of its original size. Boxes found on image map
+    back to the original with to_full(); full() decodes the original on demand.
+    """
+
+    def __init__(self, data, image, scale=1):
+        self.data = data
+        self.image = image
+        self.scale = scale
+        self._full = image if scale == 1 else None
+
+    def full(self):
+        if self._full is None:
+            self._full = decode_frame(self.data)
+        return self._full
+
+    def to_full(self, box):
+        return [v * self.scale for v in box]
+
+
+def jpeg_size(data):
+    """(width, height) from a JPEG's frame header, or None if data is not a JPEG."""
+    if data[:2] != b"\xff\xd8":
+        return None
+    offset = 2
+    while offset + 4 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        if marker == 0xFF:  # Fill byte
+            offset += 1
+            continue
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:  # No length field
+            offset += 2
+            continue
+        (length,) = struct.unpack_from(">H", data, offset + 2)
+        # SOF0..SOF15, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            if offset + 9 > len(data):
+                return None
+            height, width = struct.unpack_from(">HH", data, offset + 5)
+            return width, height
+        offset += 2 + length
+    return None
+
+
+def decode_frame(data):
+    """Decoded BGR frame, or None if data is not an image."""
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+
+def decode_reduced(data, min_width=None):
+    """
+    DecodedFrame at the smallest reduced scale that is still min_width wide
+    (full size without min_width, or for anything but a JPEG); None if data is not an image.
+    """
+    size = jpeg_size(data) if min_width else None
+    if size is not None:
+        buf = np.frombuffer(data, np.uint8)
+        for scale, mode in REDUCED_MODES:
+            if size[0] // scale < min_width:
+                continue
+            image = cv2.imdecode(buf, mode)
+            # The header size is before EXIF rotation; a rotated frame may come out too narrow
+            if image is not None and image.shape[1] >= min_width:
+                return DecodedFrame(data, image, scale)
+            break
+    image = decode_frame(data)
+    return DecodedFrame(data, image) if image is not None else None
+
+
+def decode_frames(payloads, min_width=None):
+    """Decodes the encoded frames in parallel; one DecodedFrame (or None) per payload, in order."""
+    if len(payloads) == 1:
+        return [decode_reduced(payloads[0], min_width)]
+    return list(_decode_pool.map(lambda data: decode_reduced(data, min_width), payloads))
@@ -3,21 +3,39 @@ import threading
 import queue
 import numpy as np
 import time
-from modules.utils import save_snapshot
+from modules.snapshots import snapshot_writer
+from modules.model_onnx import inference_lock
+from modules.nms import DETECT_IOU, split_by_class
 
 # ==========================================
 # Threaded Camera
 # ==========================================
+def is_stream_url(src):
+    """True for network sources (rtsp://, http://, ...), which can drop and come back."""
+    return isinstance(src, str) and "://" in src
+
+
 class ThreadedCamera:
-    def __init__(self, src=0):
+    def __init__(self, src=0, on_frame=None):
         self.capture = cv2.VideoCapture(src)
+        # cv2.VideoCapture does not raise for a source it cannot open
+        self.opened = self.capture.isOpened()
+        self.on_frame = on_frame  # Called from the reader thread after every new frame
         self.q = queue.Queue(maxsize=1) 
+        # Newest frame for display; unlike q, reading it does not consume it
+        self.latest = None
+        self.seq = 0
+        self._new_frame = threading.Condition()
+        # Files would otherwise be read at decode speed; play them at their own FPS
+        fps = self.capture.get(cv2.CAP_PROP_FPS) if self.opened and isinstance(src, str) and not is_stream_url(src) else 0
+        self.frame_interval = 1.0 / fps if fps and fps > 0 else 0.0
         self.t = threading.Thread(target=self._reader)
         self.t.daemon = True
         self.stopped = False
         self.t.start()
 
     def _reader(self):
+        next_at = time.monotonic()
         while not self.stopped:
             ret, frame = self.capture.read()
             if not ret:
@@ -28,6 +46,23 @@ class ThreadedCamera:
                 except queue.Empty:
                     pass
             self.q.put(frame)
+            with self._new_frame:
+                self.latest = frame
+                self.seq += 1
+                self._new_frame.notify_all()
+            if self.on_frame is not None:
+                self.on_frame()
+            if self.frame_interval:
+                next_at += self.frame_interval
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_at = time.monotonic()  # Fell behind: no burst to catch up
+
+    def alive(self):
+        """False once the reader has stopped getting frames (end of file, device or stream lost)."""
+        return self.opened and self.t.is_alive()
 
     def read(self):
         try:
@@ -35,6 +70,25 @@ class ThreadedCamera:
         except queue.Empty:
             return None
 
+    def read_latest(self):
+        """Newest frame not handed out yet, or None. Never blocks."""
+        try:
+            return self.q.get_nowait()
+        except queue.Empty:
+            return None
+
+    def wait_for_frame(self, last_seq, timeout=1.0):
+        """
+        Waits for a frame newer than last_seq; returns (seq, frame), frame None on timeout.
+        Any number of readers may wait; none of them takes the frame away from read().
+        """
+        with self._new_frame:
+            if self.seq == last_seq:
+                self._new_frame.wait(timeout)
+            if self.seq == last_seq:
+                return last_seq, None
+            return self.seq, self.latest
+
     def release(self):
         self.stopped = True
         self.t.join()
@@ -44,15 +98,20 @@ class ThreadedCamera:
 # Compliance Tracker V2 (Ported from main.py)
 # ==========================================
 class ComplianceTrackerV2:
-    def __init__(self, face_identifier, session_maker):
+    def __init__(self, face_identifier, event_sink, camera_id=None):
         self.face_identifier = face_identifier
-        self.session_maker = session_maker # Function to get DB session
+        self.event_sink = event_sink # Queues ViolationLog events (see modules/persistence.py)
+        self.camera_id = camera_id # Recorded in the snapshot index
         self.people_state = {} 
         self.BASE_THRESHOLD = 25
         self.FAST_MOVER_THRESHOLD = 10 
         self.trails = {} 
 
-    def update(self, frame, person_tracks, id_card_boxes):
+    def update(self, frame, person_tracks, id_card_boxes, identify_faces=True):
+        """
+        identify_faces=False defers face identification (load shedding):
+        verified logging waits for a later frame, violations are logged under the name known so far.
+        """
         results_to_display = []
         
         active_ids = {t[4] for t in person_tracks}
@@ -106,12 +165,13 @@ class ComplianceTrackerV2:
                 
                 # Verified Logging Logic
                 if not state['logged_verified']:
-                    if state['name'] == 'Unknown':
+                    if state['name'] == 'Unknown' and identify_faces:
                          state['name'] = self.face_identifier.identify(frame, person_box)
                     
                     if state['name'] != 'Unknown':
                         # Save verified snapshot
-                        image_path = save_snapshot(frame, state['name'], person_box, "database/verified")
+                        image_path = snapshot_writer.submit(frame, state['name'], person_box, "database/verified",
+                                                            track_id=track_id, status="VERIFIED", camera_id=self.camera_id)
                         self.log_to_db(state['name'], image_path, track_id, "VERIFIED")
                         state['logged_verified'] = True
 
@@ -120,10 +180,11 @@ class ComplianceTrackerV2:
                 
                 if state['no_id_frames'] >= threshold:
                     if not state['logged']:
-                        if state['name'] == 'Unknown':
+                        if state['name'] == 'Unknown' and identify_faces:
                              state['name'] = self.face_identifier.identify(frame, person_box)
                         
-                        image_path = save_snapshot(frame, state['name'], person_box, "database/violations")
+                        image_path = snapshot_writer.submit(frame, state['name'], person_box, "database/violations",
+                                                            track_id=track_id, status="VIOLATION", camera_id=self.camera_id)
                         self.log_to_db(state['name'], image_path, track_id, "VIOLATION")
                         state['logged'] = True
                     
@@ -153,107 +214,181 @@ class ComplianceTrackerV2:
         return px1 < icx < px2 and py1 < icy < py2
 
     def log_to_db(self, name, image_path, track_id, status_type):
-        from database_config import ViolationLog, Session
-        # Create a new session for this operation
-        # Note: In threaded context, we need to be careful with sessions.
-        session = next(self.session_maker())
-        try:
-            log = ViolationLog(
-                person_name=name,
-                image_path=image_path,
-                track_id=track_id,
-                status=status_type
-            )
-            session.add(log)
-            session.commit()
-        except Exception as e:
-            print(f"DB Error: {e}")
-        finally:
-            session.close()
-
-# Generator for streaming
-def generate_frames(model, face_ident, session_maker):
-    tracker = ComplianceTrackerV2(face_ident, session_maker)
-    
-    # SimpleTracker fallback import inside function to avoid circular imports if any
-    from modules.tracker_simple import SimpleTracker
-    # Initialize with stricter parameters to prevent duplicate detections
-    person_tracker = SimpleTracker(max_disappeared=30, distance_threshold=100)
-    
-    cap = ThreadedCamera(0) # Open webcam 0 on server
-    time.sleep(1.0) # Warmup
-
-    try:
-        while True:
-            frame = cap.read()
-            if frame is None:
-                continue
-
-            # --- Detection ---
-            # Resize for speed
-            orig_h, orig_w = frame.shape[:2]
-            detect_w = 640
-            scale = detect_w / orig_w
-            detect_h = int(orig_h * scale)
-            
-            small_frame = cv2.resize(frame, (detect_w, detect_h))
-            
-            # Predict with stricter parameters to reduce duplicate detections
-            results = model.predict(
-                small_frame, 
-                conf=0.5,  # Increased confidence threshold
-                iou=0.4,   # Lower IoU = more aggressive NMS
-                agnostic_nms=True, 
-                verbose=False, 
-                task='detect',
-                max_det=10  # Limit max detections
-            )
-            
-            person_tracks_raw = []
-            id_card_boxes = []
-
-            if results and results[0].boxes:
-                for box in results[0].boxes:
-                    cls = int(box.cls[0])
-                    x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                    # Rescale back to original
-                    x1, y1, x2, y2 = x1/scale, y1/scale, x2/scale, y2/scale
-                    
-                    if cls == 1: 
-                        person_tracks_raw.append([x1, y1, x2, y2])
-                    elif cls == 0: 
-                        id_card_boxes.append([x1, y1, x2, y2])
+        # Queued and written in batches by the persistence thread, never blocks the frame loop
+        self.event_sink(name, image_path, track_id, status_type)
 
-            # Deduplicate
-            from modules.utils import perform_nms
-            person_tracks_raw = perform_nms(person_tracks_raw, scores=None, iou_threshold=0.3)
+# ==========================================
+# Motion Trigger
+# ==========================================
+class MotionDetector:
+    """
+    Cheap scene-change check on a tiny grayscale copy of the frame, used to
+    wake an idle camera without running the detector.
+    """
+
+    def __init__(self, size=(64, 36), threshold=4.0):
+        self.size = size
+        self.threshold = threshold  # Mean absolute pixel change (0-255)
+        self.reference = None
 
-            # Update specialized trackers
-            person_tracks = person_tracker.update(person_tracks_raw)
-            display_data = tracker.update(frame, person_tracks, id_card_boxes)
+    def reset(self):
+        self.reference = None
 
-            # --- Draw Viz on Frame ---
-            for id, points in tracker.trails.items():
-                if len(points) > 1:
-                    for i in range(1, len(points)):
-                        cv2.line(frame, points[i-1], points[i], (0, 165, 255), 2)
+    def update(self, frame):
+        """Returns True if the frame differs enough from the previous one."""
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        reference, self.reference = self.reference, small
+        if reference is None:
+            return False
+        return float(cv2.absdiff(small, reference).mean()) > self.threshold
 
+# ==========================================
+# Overlay Extrapolation
+# ==========================================
+class MotionExtrapolator:
+    """
+    Latest tracker output plus a velocity per track, so the overlay can be drawn
+    on every displayed frame while inference runs at a lower rate.
+    Written by the tracking thread, read by the display thread.
+    """
+
+    def __init__(self, max_horizon=0.5, smoothing=0.6):
+        self.max_horizon = max_horizon  # Seconds a box may be moved ahead before it freezes
+        self.smoothing = smoothing      # Weight of the newest velocity measurement
+        self.tracks = {}                # {track_id: (item, t, (vx, vy))}
+        self.trails = {}
+        self._lock = threading.Lock()
+
+    def update(self, display_data, trails, t):
+        with self._lock:
+            tracks = {}
             for item in display_data:
-                x1, y1, x2, y2 = map(int, item['bbox'])
-                color = item['color']
-                cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                
-                label = f"{item['status']}"
-                (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)
-                cv2.rectangle(frame, (x1, y1 - 20), (x1 + tw, y1), color, -1)
-                cv2.putText(frame, label, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
-
-            # Encode
-            ret, buffer = cv2.imencode('.jpg', frame)
-            frame_bytes = buffer.tobytes()
-            
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-                   
-    finally:
-        cap.release()
+                track_id = item['track_id']
+                vx, vy = 0.0, 0.0
+                prev = self.tracks.get(track_id)
+                if prev is not None and t > prev[1]:
+                    prev_item, prev_t, (pvx, pvy) = prev
+                    px1, py1, px2, py2 = prev_item['bbox']
+                    x1, y1, x2, y2 = item['bbox']
+                    dt = t - prev_t
+                    mvx = ((x1 + x2) - (px1 + px2)) / 2 / dt
+                    mvy = ((y1 + y2) - (py1 + py2)) / 2 / dt
+                    vx = self.smoothing * mvx + (1 - self.smoothing) * pvx
+                    vy = self.smoothing * mvy + (1 - self.smoothing) * pvy
+                tracks[track_id] = (dict(item), t, (vx, vy))
+            self.tracks = tracks
+            self.trails = {k: list(v) for k, v in trails.items()}
+
+    def predict(self, t):
+        """Returns (display_data, trails) with every box moved to where it should be at time t."""
+        with self._lock:
+            display_data = []
+            for item, item_t, (vx, vy) in self.tracks.values():
+                dt = min(max(t - item_t, 0.0), self.max_horizon)
+                x1, y1, x2, y2 = item['bbox']
+                moved = dict(item)
+                moved['bbox'] = [x1 + vx * dt, y1 + vy * dt, x2 + vx * dt, y2 + vy * dt]
+                display_data.append(moved)
+            return display_data, self.trails
+
+# ==========================================
+# Frame Processing Helpers
+# ==========================================
+def detect_objects(model, frame, detect_w=640):
+    """
+    Runs the detector on a downscaled copy of the frame.
+    Returns (person_boxes, id_card_boxes) in original frame coordinates.
+    """
+    return detect_batch(model, [frame], detect_w)[0]
+
+def detect_batch(model, frames, detect_w=640):
+    """
+    Runs the detector once over a list of frames (e.g. one per camera).
+    detect_w is one width for all frames or a list with one per frame.
+    Returns one (person_boxes, id_card_boxes) pair per frame, in that frame's coordinates.
+    """
+    if not isinstance(detect_w, (list, tuple)):
+        detect_w = [detect_w] * len(frames)
+
+    # Resize for speed
+    small_frames = []
+    scales = []
+    for frame, width in zip(frames, detect_w):
+        orig_h, orig_w = frame.shape[:2]
+        scale = width / orig_w
+        detect_h = int(orig_h * scale)
+        small_frames.append(cv2.resize(frame, (width, detect_h)))
+        scales.append(scale)
+
+    # Predict with stricter parameters to reduce duplicate detections
+    with inference_lock:
+        results = model.predict(
+            small_frames, 
+            conf=0.5,  # Increased confidence threshold
+            iou=DETECT_IOU,  # The only NMS pass, so no separate dedup afterwards
+            agnostic_nms=True, 
+            verbose=False, 
+            task='detect',
+            max_det=10  # Limit max detections
+        )
+
+    detections = []
+    for i, scale in enumerate(scales):
+        result = results[i] if results and i < len(results) else None
+        # Rescale back to original
+        detections.append(split_by_class(result, scale))
+    return detections
+
+def draw_overlay(frame, trails, display_data):
+    """Draws trails, boxes and status labels onto the frame (in place)."""
+    for id, points in trails.items():
+        if len(points) > 1:
+            for i in range(1, len(points)):
+                cv2.line(frame, points[i-1], points[i], (0, 165, 255), 2)
+
+    for item in display_data:
+        x1, y1, x2, y2 = map(int, item['bbox'])
+        color = item['color']
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+
+        label = f"{item['status']}"
+        (tw, th), _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)
+        cv2.rectangle(frame, (x1, y1 - 20), (x1 + tw, y1), color, -1)
+        cv2.putText(frame, label, (x1, y1 - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
+    return frame
+
+def detection_metadata(display_data, people_state, frame_shape):
+    """
+    Compact per-frame detections for clients that draw their own overlay.
+    Boxes are normalized to 0..1 so they fit any display size.
+    """
+    h, w = frame_shape[:2]
+    detections = []
+    for item in display_data:
+        x1, y1, x2, y2 = item['bbox']
+        track_id = int(item['track_id'])
+        state = people_state.get(track_id, {})
+        detections.append({
+            "track_id": track_id,
+            "bbox": [round(float(x1) / w, 4), round(float(y1) / h, 4),
+                     round(float(x2) / w, 4), round(float(y2) / h, 4)],
+            "status": item['status'].split(':')[0].split(' ')[0],  # VIOLATION / COMPLIANT / CHECKING
+            "label": item['status'],
+            "name": state.get('name', 'Unknown'),
+        })
+    return detections
+
+def encode_thumbnail(frame, width=320, quality=60):
+    """Small JPEG of the raw frame (no overlay)."""
+    h, w = frame.shape[:2]
+    thumb = cv2.resize(frame, (width, int(h * width / w)), interpolation=cv2.INTER_AREA)
+    ret, buffer = cv2.imencode('.jpg', thumb, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return buffer.tobytes()
+
+def encode_mjpeg_part(frame):
+    """JPEG-encodes a frame as one multipart/x-mixed-replace part."""
+    ret, buffer = cv2.imencode('.jpg', frame)
+    frame_bytes = buffer.tobytes()
+    return (b'--frame\r\n'
+            b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
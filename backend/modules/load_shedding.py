@@ -0,0 +1,101 @@
+"""
+Latency-budgeted load shedding.
+
+Each frame path (a camera, /detect) owns a LatencyBudget. When the smoothed
+per-frame latency stays above the budget, the shed level goes up one step at
+a time; when it stays well below, it comes back down:
+
+    1  skip trail drawing
+    2  defer face identification (violations are logged without a name)
+    3  lower the detection resolution
+    4  drop every other frame
+
+Every shed decision is counted in metrics as <name>_shed_<action>.
+"""
+import threading
+
+from modules.metrics import metrics
+
+SHED_TRAILS = 1
+SHED_FACE_ID = 2
+SHED_RESOLUTION = 3
+SHED_FRAMES = 4
+SHED_ACTIONS = {SHED_TRAILS: "trails", SHED_FACE_ID: "face_id", SHED_RESOLUTION: "resolution", SHED_FRAMES: "frames"}
+
+DEFAULT_BUDGET_MS = 250
+REDUCED_DETECT_WIDTH = 416  # Detection width at SHED_RESOLUTION (normally 640)
+
+
+class LatencyBudget:
+    def __init__(self, name, budget_ms=DEFAULT_BUDGET_MS, escalate_after=5, recover_after=30,
+                 recover_ratio=0.7, smoothing=0.2):
+        self.name = name
+        self.budget_ms = budget_ms
+        self.escalate_after = escalate_after  # Frames over budget before shedding one more step
+        self.recover_after = recover_after    # Frames well under budget before restoring one step
+        self.recover_ratio = recover_ratio    # "Well under" = below budget * recover_ratio
+        self.smoothing = smoothing
+        self.level = 0
+        self.latency_ms = None  # Smoothed
+        self._over = 0
+        self._under = 0
+        self._frame = 0
+        self._lock = threading.Lock()
+
+        metrics.set_gauge(f"{name}_shed_level", lambda: self.level)
+
+    def observe(self, latency_ms):
+        """Records one frame's end-to-end latency and adjusts the shed level."""
+        metrics.observe(f"{self.name}_latency_ms", latency_ms)
+        with self._lock:
+            if self.latency_ms is None:
+                self.latency_ms = latency_ms
+            else:
+                self.latency_ms += self.smoothing * (latency_ms - self.latency_ms)
+
+            if self.latency_ms > self.budget_ms:
+                self._over += 1
+                self._under = 0
+                if self._over >= self.escalate_after and self.level < SHED_FRAMES:
+                    self.level += 1
+                    self._over = 0
+                    metrics.inc(f"{self.name}_shed_level_up")
+            elif self.latency_ms < self.budget_ms * self.recover_ratio:
+                self._under += 1
+                self._over = 0
+                if self._under >= self.recover_after and self.level > 0:
+                    self.level -= 1
+                    self._under = 0
+                    metrics.inc(f"{self.name}_shed_level_down")
+            else:
+                self._over = 0
+                self._under = 0
+
+    def sheds(self, step):
+        """True if `step` is currently shed; the decision is counted in metrics."""
+        if self.level < step:
+            return False
+        metrics.inc(f"{self.name}_shed_{SHED_ACTIONS[step]}")
+        return True
+
+    def should_drop(self):
+        """At SHED_FRAMES, every other frame is dropped."""
+        if self.level < SHED_FRAMES:
+            return False
+        with self._lock:
+            self._frame += 1
+            drop = self._frame % 2 == 0
+        if drop:
+            metrics.inc(f"{self.name}_shed_frames")
+        return drop
+
+    def detect_width(self, default=640):
+        return REDUCED_DETECT_WIDTH if self.sheds(SHED_RESOLUTION) else default
+
+    def status(self):
+        return {
+            "budget_ms": self.budget_ms,
+            "latency_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "shed_level": self.level,
+            "shedding": [SHED_ACTIONS[s] for s in sorted(SHED_ACTIONS) if s <= self.level],
+        }
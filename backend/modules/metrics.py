@@ -0,0 +1,77 @@
+"""
+In-process metrics registry.
+
+Counters, gauges and histograms shared by the pipeline services and exposed
+through the /metrics endpoint.
+"""
+import threading
+from collections import deque
+
+import numpy as np
+
+HISTOGRAM_WINDOW = 2048  # Recent samples kept per histogram for percentiles
+
+
+class Histogram:
+    def __init__(self, window=HISTOGRAM_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self):
+        if not self.samples:
+            return {"count": self.count, "sum": round(self.total, 3)}
+        values = np.asarray(self.samples, dtype=np.float64)
+        p50, p90, p99 = np.percentile(values, [50, 90, 99])
+        return {
+            "count": self.count,
+            "sum": round(self.total, 3),
+            "mean": round(float(values.mean()), 3),
+            "p50": round(float(p50), 3),
+            "p90": round(float(p90), 3),
+            "p99": round(float(p99), 3),
+            "max": round(float(values.max()), 3),
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}      # name -> value or zero-arg callable
+        self.histograms = {}
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """value may be a number or a callable evaluated on every snapshot."""
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self):
+        with self._lock:
+            gauges = dict(self.gauges)
+            data = {
+                "counters": dict(self.counters),
+                "histograms": {name: h.summary() for name, h in self.histograms.items()},
+            }
+        data["gauges"] = {name: (value() if callable(value) else value) for name, value in gauges.items()}
+        return data
+
+
+# Process-wide registry
+metrics = Metrics()
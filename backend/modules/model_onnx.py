@@ -1,8 +1,16 @@
 
+import threading
+
 import onnxruntime as ort
 import cv2
 import numpy as np
 
+from modules.nms import suppress
+
+# The detector is one shared object (not safe for concurrent predict calls);
+# /detect, the camera streams and the video pipelines all take this lock.
+inference_lock = threading.Lock()
+
 class MockTensor:
     def __init__(self, data):
         self.data = np.array(data)
@@ -23,6 +31,30 @@ class MockTensor:
     def __repr__(self):
         return str(self.data)
 
+class Boxes:
+    """
+    Array-backed stand-in for ultralytics Boxes: xyxy / conf / cls hold every
+    detection at once, and iterating yields one single-row Boxes per detection.
+    """
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = MockTensor(np.asarray(xyxy, dtype=np.float32).reshape(-1, 4))
+        self.conf = MockTensor(np.asarray(conf, dtype=np.float32).reshape(-1))
+        self.cls = MockTensor(np.asarray(cls, dtype=np.float32).reshape(-1))
+        self.id = None
+    def __len__(self):
+        return len(self.conf)
+    def __iter__(self):
+        for i in range(len(self)):
+            yield Boxes(self.xyxy.data[i:i + 1], self.conf.data[i:i + 1], self.cls.data[i:i + 1])
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty((0, 4)), np.empty(0), np.empty(0))
+
+class Result:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
 class YOLOv8ONNX:
     def __init__(self, model_path):
         self.session = ort.InferenceSession(model_path, providers=['CPUExecutionProvider'])
@@ -30,7 +62,21 @@ class YOLOv8ONNX:
         self.names = {0: 'id_card', 1: 'person'}
         print(f"[INFO] YOLOv8ONNX wrapper loaded {model_path}")
 
-    def predict(self, frame, conf=0.4, verbose=False, task='detect', **kwargs):
+    def predict(self, frame, conf=0.4, iou=0.7, agnostic_nms=False, max_det=300, nms_mode=None,
+                verbose=False, task='detect', **kwargs):
+        """
+        Same arguments as ultralytics predict (iou / agnostic_nms / max_det drive NMS).
+        nms_mode picks a modules.nms mode directly, e.g. "soft".
+        """
+        if isinstance(frame, (list, tuple)):
+            # The exported graph has a fixed batch of 1; one result per frame, like ultralytics
+            results = []
+            for f in frame:
+                result = self.predict(f, conf=conf, iou=iou, agnostic_nms=agnostic_nms, max_det=max_det,
+                                      nms_mode=nms_mode, verbose=verbose, task=task, **kwargs)
+                results.append(result[0] if result else Result(Boxes.empty()))
+            return results
+
         h, w = frame.shape[:2]
         input_img = cv2.resize(frame, (640, 640))
         input_img = input_img.transpose(2, 0, 1)
@@ -42,34 +88,41 @@ class YOLOv8ONNX:
 
         if output.shape[1] == 25200:
             output = output[0]
-            mask = output[:, 4] > conf
-            output = output[mask]
-            
-            boxes = []
-            if len(output) > 0:
-                for det in output:
-                    cx, cy, dw, dh, obj_conf = det[:5]
-                    cls_confs = det[5:]
-                    cls_id = np.argmax(cls_confs)
-                    cls_conf = cls_confs[cls_id] * obj_conf
-                    
-                    if cls_conf > conf:
-                        x1 = (cx - dw/2) * (w / 640)
-                        y1 = (cy - dh/2) * (h / 640)
-                        x2 = (cx + dw/2) * (w / 640)
-                        y2 = (cy + dh/2) * (h / 640)
-                        
-                        box = type('Box', (), {
-                            'xyxy': MockTensor([np.array([x1, y1, x2, y2])]),
-                            'cls': MockTensor([np.array([cls_id])]),
-                            'conf': MockTensor([np.array([cls_conf])]),
-                            'id': None
-                        })
-                        boxes.append(box)
-            
-            return [type('Result', (), {'boxes': boxes})]
+            output = output[output[:, 4] > conf]
+
+            # Decode every candidate at once: best class, its score, and xyxy in frame pixels
+            cls_ids = np.argmax(output[:, 5:], axis=1)
+            scores = output[np.arange(len(output)), 5 + cls_ids] * output[:, 4]
+            keep = scores > conf
+            output, cls_ids, scores = output[keep], cls_ids[keep], scores[keep]
+
+            cx, cy, dw, dh = output[:, 0], output[:, 1], output[:, 2], output[:, 3]
+            xyxy = np.stack([cx - dw / 2, cy - dh / 2, cx + dw / 2, cy + dh / 2], axis=1)
+            xyxy *= np.array([w / 640, h / 640, w / 640, h / 640], dtype=np.float32)
+
+            mode = nms_mode or ("agnostic" if agnostic_nms else "class_aware")
+            keep, scores = suppress(xyxy, scores, cls_ids, iou_threshold=iou, mode=mode, max_det=max_det)
+            return [Result(Boxes(xyxy[keep], scores, cls_ids[keep]))]
             
         return []
 
     def __call__(self, frame, **kwargs):
         return self.predict(frame, **kwargs)
+
+
+def load_detector(model_path="idcard.onnx"):
+    """
+    Loads the ID card / person detector.
+    Tries standard YOLOv8 first and falls back to the raw ONNX wrapper when the
+    exported model is missing its 'task' metadata.
+    """
+    try:
+        from ultralytics import YOLO
+        model = YOLO(model_path, task="detect")
+        # Test it
+        _ = model(np.zeros((640, 640, 3), dtype=np.uint8))
+        print("[INFO] Standard YOLOv8 ONNX loaded.")
+    except Exception:
+        print("[WARNING] Standard YOLOv8 failed. Using fallback ONNX wrapper.")
+        model = YOLOv8ONNX(model_path)
+    return model
@@ -0,0 +1,140 @@
+"""
+Vectorized non-maximum suppression on detector output arrays.
+
+All functions take float boxes as an (N, 4) xyxy array plus (N,) scores, keep
+full float precision and return indices into the input, so callers can slice
+their own score / class arrays without rebuilding lists.
+"""
+import numpy as np
+
+NMS_MODES = ("class_aware", "agnostic", "soft")
+
+ID_CARD_CLASS = 0
+PERSON_CLASS = 1
+# Passed as the detector's iou: person boxes overlapping more than 30% are the
+# same person. The detector's own NMS is the only pass, so nothing re-filters after it.
+DETECT_IOU = 0.3
+
+
+def box_iou(box, boxes):
+    """IoU of one xyxy box against an (N, 4) array."""
+    x1 = np.maximum(box[0], boxes[:, 0])
+    y1 = np.maximum(box[1], boxes[:, 1])
+    x2 = np.minimum(box[2], boxes[:, 2])
+    y2 = np.minimum(box[3], boxes[:, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    return inter / np.maximum(area + areas - inter, 1e-9)
+
+
+def _separate_classes(boxes, classes):
+    """
+    Shifts each class into its own coordinate range, so boxes of different
+    classes never overlap. The step is the full coordinate span (not just the
+    max), which keeps classes apart when boxes start below 0 at the frame edge.
+    """
+    span = float(boxes.max() - boxes.min()) + 1.0
+    return boxes + np.asarray(classes, dtype=np.float32).reshape(-1, 1) * span
+
+
+def nms(boxes, scores, iou_threshold=0.45, classes=None, max_det=None):
+    """
+    Greedy NMS. With classes, boxes only suppress boxes of the same class
+    (done in one pass by shifting each class into its own coordinate range).
+    Returns the kept indices, highest score first.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    if classes is not None:
+        boxes = _separate_classes(boxes, classes)
+
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        if max_det is not None and len(keep) >= max_det:
+            break
+        rest = order[1:]
+        order = rest[box_iou(boxes[i], boxes[rest]) <= iou_threshold]
+    return np.asarray(keep, dtype=np.int64)
+
+
+def soft_nms(boxes, scores, iou_threshold=0.45, sigma=0.5, score_threshold=0.001, method="gaussian",
+             classes=None, max_det=None):
+    """
+    Soft-NMS: overlapping boxes get their score decayed instead of being removed.
+    method "gaussian" decays by exp(-iou^2 / sigma); "linear" by (1 - iou) above iou_threshold.
+    Returns (kept indices, their decayed scores), highest score first.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1).copy()
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+    if classes is not None:
+        boxes = _separate_classes(boxes, classes)
+
+    remaining = np.arange(len(boxes))
+    keep, kept_scores = [], []
+    while remaining.size:
+        best = np.argmax(scores[remaining])
+        i = remaining[best]
+        if scores[i] < score_threshold:
+            break
+        keep.append(i)
+        kept_scores.append(scores[i])
+        if max_det is not None and len(keep) >= max_det:
+            break
+        remaining = np.delete(remaining, best)
+        iou = box_iou(boxes[i], boxes[remaining])
+        if method == "linear":
+            decay = np.where(iou > iou_threshold, 1.0 - iou, 1.0)
+        else:
+            decay = np.exp(-(iou * iou) / sigma)
+        scores[remaining] *= decay
+    return np.asarray(keep, dtype=np.int64), np.asarray(kept_scores, dtype=np.float32)
+
+
+def suppress(boxes, scores, classes=None, iou_threshold=0.45, mode="class_aware", max_det=None):
+    """
+    One entry point for the three modes; returns (kept indices, scores).
+    class_aware needs classes; agnostic ignores them; soft is class-aware when classes are given.
+    """
+    if mode not in NMS_MODES:
+        raise ValueError(f"mode must be one of {NMS_MODES}")
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+    if mode == "soft":
+        return soft_nms(boxes, scores, iou_threshold, classes=classes, max_det=max_det)
+    keep = nms(boxes, scores, iou_threshold, classes=classes if mode == "class_aware" else None, max_det=max_det)
+    return keep, scores[keep]
+
+
+def result_arrays(result):
+    """
+    (xyxy, scores, classes) arrays from one detector result, either an
+    ultralytics Results or the YOLOv8ONNX wrapper's; empty arrays for no boxes.
+    """
+    boxes = getattr(result, "boxes", None) if result is not None else None
+    if boxes is None or len(boxes) == 0:
+        return np.empty((0, 4), dtype=np.float32), np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+    return (
+        np.asarray(boxes.xyxy.cpu().numpy(), dtype=np.float32).reshape(-1, 4),
+        np.asarray(boxes.conf.cpu().numpy(), dtype=np.float32).reshape(-1),
+        np.asarray(boxes.cls.cpu().numpy()).reshape(-1).astype(np.int64),
+    )
+
+
+def split_by_class(result, scale=1.0):
+    """
+    (person boxes, id card boxes) from one detector result as float xyxy lists,
+    scaled back to the original frame when the detector saw it resized by `scale`.
+    """
+    xyxy, _, classes = result_arrays(result)
+    if scale != 1.0:
+        xyxy = xyxy / scale
+    return xyxy[classes == PERSON_CLASS].tolist(), xyxy[classes == ID_CARD_CLASS].tolist()
@@ -0,0 +1,191 @@
+"""
+Batched, asynchronous persistence for ViolationLog events and SnapshotImage
+index rows.
+
+Frame loops only enqueue events; a background thread writes them in batched
+transactions every BATCH_SIZE events or FLUSH_INTERVAL_MS, whichever comes
+first. This keeps SQLite latency out of the detection loops. Each transaction
+also adds the batch's StatCounter increments (see modules/stats.py).
+"""
+import time
+import queue
+import threading
+from datetime import datetime
+
+from sqlmodel import Session
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database_config import engine, ViolationLog, SnapshotImage
+from modules.metrics import metrics
+from modules.stats import event_increments, apply_increments, rollup_increments, apply_rollups, counter_key, COUNTER_FIELDS
+
+BATCH_SIZE = 50
+FLUSH_INTERVAL_MS = 200
+MAX_QUEUE = 10000
+BACKPRESSURE_TIMEOUT = 30.0  # Max wait for queue space on paths that must not drop rows
+
+
+class PersistenceService:
+    def __init__(self, db_engine=engine, batch_size=BATCH_SIZE,
+                 flush_interval_ms=FLUSH_INTERVAL_MS, max_queue=MAX_QUEUE):
+        self.engine = db_engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.q = queue.Queue(maxsize=max_queue)
+        self.stopped = threading.Event()
+        self.t = None
+        self._counts = {}  # {(day, camera_id): {counter: n}} waiting for the next flush
+        self._counts_lock = threading.Lock()
+
+        metrics.set_gauge("persistence_queue_depth", self.queue_depth)
+
+    def start(self):
+        if self.t is not None and self.t.is_alive():
+            return
+        self.stopped.clear()
+        self.t = threading.Thread(target=self._writer, name="persistence-writer")
+        self.t.daemon = True
+        self.t.start()
+
+    def stop(self, timeout=10.0):
+        """Stops the writer after flushing everything still queued."""
+        self.stopped.set()
+        if self.t is not None:
+            self.t.join(timeout)
+
+    def queue_depth(self):
+        return self.q.qsize()
+
+    def log_event(self, person_name, image_path, track_id, status, timestamp=None, timeout=None, camera_id=None):
+        """
+        Queues one ViolationLog row and returns whether it was accepted.
+        Without a timeout it never blocks (live camera loops); with one it waits
+        up to that long for queue space, so offline jobs slow down instead of
+        losing rows.
+        """
+        event = {
+            "person_name": person_name,
+            "image_path": image_path,
+            "track_id": track_id,
+            "status": status,
+            "camera_id": camera_id,
+            # Stamp now, not at flush time
+            "timestamp": timestamp or datetime.utcnow(),
+        }
+        return self._put(ViolationLog, event, timeout, f"{status} event for {person_name}")
+
+    def index_image(self, path, directory, size_bytes, person_name, track_id=None, status=None,
+                    camera_id=None, timestamp=None, timeout=None):
+        """Queues the SnapshotImage index row of a written snapshot; same queueing rules as log_event."""
+        row = {
+            "path": path,
+            "directory": directory,
+            "size_bytes": size_bytes,
+            "person_name": person_name,
+            "track_id": track_id,
+            "status": status,
+            "camera_id": camera_id,
+            "timestamp": timestamp or datetime.utcnow(),
+        }
+        return self._put(SnapshotImage, row, timeout, f"index row for {path}")
+
+    def count_detections(self, n=1, camera_id=None):
+        """Adds n newly tracked people to today's detection counter; written with the next batch, never blocks."""
+        self._count("detections", n, camera_id)
+
+    def count_frames(self, n=1, camera_id=None):
+        """
+        Adds n frames with people in them to today's frame counter. For stateless
+        /detect calls, which have no tracks and so cannot count people.
+        """
+        self._count("frames", n, camera_id)
+
+    def _count(self, field, n, camera_id):
+        key = counter_key(datetime.utcnow(), camera_id)
+        with self._counts_lock:
+            counts = self._counts.setdefault(key, {})
+            counts[field] = counts.get(field, 0) + n
+
+    def _put(self, model, fields, timeout, what):
+        try:
+            if timeout is None:
+                self.q.put_nowait((model, fields))
+            else:
+                self.q.put((model, fields), timeout=timeout)
+            metrics.inc("persistence_enqueued")
+            return True
+        except queue.Full:
+            metrics.inc("persistence_dropped")
+            print(f"[WARNING] Persistence queue full, dropped {what}")
+            return False
+
+    # ------------------------------------------
+    # Writer Thread
+    # ------------------------------------------
+    def _writer(self):
+        while True:
+            batch = self._collect()
+            if batch or self._counts:
+                self._flush(batch)
+            elif self.stopped.is_set() and self.q.empty():
+                break
+
+    def _collect(self):
+        """Waits for the first event, then gathers more until the batch is full or the interval ends."""
+        batch = []
+        try:
+            batch.append(self.q.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return batch
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.q.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        with self._counts_lock:
+            counts, self._counts = self._counts, {}
+        try:
+            with Session(self.engine) as session:
+                self.write_batch(session, batch, counts)
+                session.commit()
+            metrics.inc("persistence_written", len(batch))
+        except Exception as e:
+            metrics.inc("persistence_failed", len(batch))
+            print(f"DB Error: {e}")
+        metrics.observe("persistence_batch_size", len(batch))
+        metrics.observe("persistence_flush_ms", (time.perf_counter() - start) * 1000)
+
+    def write_batch(self, session, batch, counts=None):
+        """
+        Adds one batch of rows, and the counter and rollup increments they make, to the session;
+        committed as a single transaction. counts is {(day, camera_id): {counter: n}}.
+        """
+        session.add_all([model(**fields) for model, fields in batch if model is not SnapshotImage])
+        images = [fields for model, fields in batch if model is SnapshotImage]
+        if images:
+            # An image indexed twice (a resumed job, a backfill) must not fail the whole batch
+            session.execute(sqlite_insert(SnapshotImage).values(images).on_conflict_do_nothing(index_elements=["path"]))
+
+        events = [fields for model, fields in batch if model is ViolationLog]
+        increments = event_increments(events)
+        for key, fields in (counts or {}).items():
+            row = increments.setdefault(key, dict.fromkeys(COUNTER_FIELDS, 0))
+            for field, n in fields.items():
+                row[field] += n
+        if increments:
+            apply_increments(session, increments)
+        if events:
+            apply_rollups(session, rollup_increments(events))
+
+
+# Process-wide sink, started by the server
+persistence = PersistenceService()
@@ -0,0 +1,218 @@
+"""
+Content-hash result cache for video analysis.
+
+Uploads are hashed while they are written to disk. The cache key combines the
+content hash with the model / face-database fingerprints and the analysis
+parameters, so a re-upload of the same recording returns the stored result.
+Finished segments are checkpointed so a crashed job can resume.
+A stored result whose snapshots the retention service has since deleted is
+treated as expired and analyzed again.
+"""
+import os
+import json
+import uuid
+import hashlib
+import threading
+from datetime import datetime
+
+from sqlmodel import Session, select
+
+from database_config import engine, VideoAnalysis, VideoSegment
+
+# Bump when the analysis logic changes in a way that alters results
+ANALYSIS_PARAMS_VERSION = 1
+UPLOAD_DIR = "uploads"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+_fingerprints = {}
+_active_keys = set()
+_active_lock = threading.Lock()
+_active_changed = threading.Condition(_active_lock)
+
+
+# ==========================================
+# Hashing
+# ==========================================
+def new_upload_path(filename, upload_dir=UPLOAD_DIR):
+    """Unique on-disk name, so concurrent uploads of 'video.mp4' don't collide."""
+    if not os.path.exists(upload_dir):
+        os.makedirs(upload_dir)
+    safe_name = os.path.basename(filename or "video")
+    return f"{upload_dir}/{uuid.uuid4().hex}_{safe_name}"
+
+
+def store_upload(src, filename, upload_dir=UPLOAD_DIR):
+    """
+    Copies a file-like object to a unique temp file, hashing it on the way.
+    Returns (path, sha256 hex digest).
+    """
+    path = new_upload_path(filename, upload_dir)
+    digest = hashlib.sha256()
+    with open(path, "wb") as buffer:
+        while True:
+            chunk = src.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+            buffer.write(chunk)
+    return path, digest.hexdigest()
+
+
+def file_fingerprint(path):
+    """SHA-256 of a file (model weights, face DB), cached by path + mtime."""
+    if not os.path.exists(path):
+        return "missing"
+    mtime = os.path.getmtime(path)
+    cached = _fingerprints.get(path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    _fingerprints[path] = (mtime, digest.hexdigest())
+    return _fingerprints[path][1]
+
+
+def make_cache_key(content_hash, params, model_path="idcard.onnx", encodings_path="database/encodings.pkl"):
+    """Cache key = content + detector + known faces + analysis parameters."""
+    payload = json.dumps({
+        "content": content_hash,
+        "model": file_fingerprint(model_path),
+        "faces": file_fingerprint(encodings_path),
+        "params_version": ANALYSIS_PARAMS_VERSION,
+        "params": params,
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+# ==========================================
+# Job Records
+# ==========================================
+class CachedJob:
+    """
+    Handle for one cached analysis job.
+    Every method uses its own short-lived session, so it can be called from
+    pipeline / streaming threads.
+    """
+
+    def __init__(self, analysis_id, cache_key, result=None, segments=None):
+        self.analysis_id = analysis_id
+        self.cache_key = cache_key
+        self.result = result              # Stored final result on a cache hit
+        self.segments = segments or {}    # {segment_index: data} already completed
+
+    @property
+    def hit(self):
+        return self.result is not None
+
+    def save_segment(self, segment_index, data):
+        with Session(engine) as session:
+            statement = select(VideoSegment).where(
+                VideoSegment.analysis_id == self.analysis_id,
+                VideoSegment.segment_index == segment_index
+            )
+            row = session.exec(statement).first()
+            if row is None:
+                row = VideoSegment(analysis_id=self.analysis_id, segment_index=segment_index, data="")
+            row.data = json.dumps(data)
+            session.add(row)
+            session.commit()
+        self.segments[segment_index] = data
+
+    def complete(self, result):
+        with Session(engine) as session:
+            analysis = session.get(VideoAnalysis, self.analysis_id)
+            analysis.status = "COMPLETED"
+            analysis.result_summary = json.dumps(result)
+            analysis.completed_timestamp = datetime.utcnow()
+            session.add(analysis)
+            # Checkpoints are only needed until the job finishes
+            for segment in session.exec(select(VideoSegment).where(VideoSegment.analysis_id == self.analysis_id)):
+                session.delete(segment)
+            session.commit()
+        self.result = result
+
+    def abandon(self):
+        """Marks the job as not cacheable (e.g. some of its rows were lost); the next run starts over."""
+        with Session(engine) as session:
+            analysis = session.get(VideoAnalysis, self.analysis_id)
+            analysis.status = "FAILED"
+            session.add(analysis)
+            for segment in session.exec(select(VideoSegment).where(VideoSegment.analysis_id == self.analysis_id)):
+                session.delete(segment)
+            session.commit()
+
+    def release(self):
+        with _active_changed:
+            _active_keys.discard(self.cache_key)
+            _active_changed.notify_all()
+
+
+def images_exist(result):
+    """Whether every snapshot a stored result points to is still on disk."""
+    for record in (result.get("violations") or []) + (result.get("verified") or []):
+        path = record.get("image_path")
+        if path and not os.path.exists(path):
+            return False
+    return True
+
+
+def open_job(cache_key, filename, content_hash):
+    """
+    Returns a CachedJob for the key:
+    - hit: a completed result exists (job.result is set)
+    - resume: an unfinished job exists, job.segments holds its checkpoints
+    - new: a fresh PROCESSING row was created
+    Returns None if the same content is being analyzed right now.
+    """
+    with _active_lock:
+        if cache_key in _active_keys:
+            return None
+
+        with Session(engine) as session:
+            statement = select(VideoAnalysis).where(VideoAnalysis.cache_key == cache_key).order_by(VideoAnalysis.id.desc())
+            analysis = session.exec(statement).first()
+
+            if analysis is not None and analysis.status == "COMPLETED" and analysis.result_summary:
+                result = json.loads(analysis.result_summary)
+                if images_exist(result):
+                    return CachedJob(analysis.id, cache_key, result=result)
+                # Retention removed its snapshots; analyze again
+                analysis.status = "EXPIRED"
+                session.add(analysis)
+                session.commit()
+
+            segments = {}
+            if analysis is None or analysis.status in ("FAILED", "EXPIRED"):
+                analysis = VideoAnalysis(
+                    filename=filename,
+                    status="PROCESSING",
+                    content_hash=content_hash,
+                    cache_key=cache_key
+                )
+                session.add(analysis)
+                session.commit()
+                session.refresh(analysis)
+            else:
+                # Previous run never finished (crash / disconnect)
+                statement = select(VideoSegment).where(VideoSegment.analysis_id == analysis.id)
+                for segment in session.exec(statement):
+                    segments[segment.segment_index] = json.loads(segment.data)
+
+            _active_keys.add(cache_key)
+            return CachedJob(analysis.id, cache_key, segments=segments)
+
+
+def wait_for_job(cache_key, filename, content_hash, timeout):
+    """
+    For a key open_job() returned None for: waits up to timeout for the running
+    job to end, then opens it again (normally a hit). None if it is still running.
+    """
+    with _active_changed:
+        if cache_key in _active_keys:
+            _active_changed.wait(timeout)
+            if cache_key in _active_keys:
+                return None
+    return open_job(cache_key, filename, content_hash)
@@ -0,0 +1,264 @@
+"""
+Retention and archival of violation logs and snapshots.
+
+A background thread sweeps rows older than their status' retention period
+(RETENTION_DAYS) in small batches. Each batch:
+  1. appends the rows to a gzip'd JSON-lines file per month under ARCHIVE_DIR
+     (still readable through read_archive() / GET /archive),
+  2. deletes the rows and their SnapshotImage rows in one short transaction,
+  3. deletes (or moves) the images and thumbnails.
+The archive is written before the delete, so a crash can at worst archive a
+row twice, never lose it. Snapshots that have no log row (e.g. from /detect)
+are expired through their index row the same way.
+
+The StatCounter / EventRollup tables are kept, so dashboards keep their history.
+Freed pages are returned to the OS by an incremental vacuum during QUIET_HOURS.
+The file is switched to incremental auto-vacuum once, by enable_incremental_vacuum()
+at startup, before any writer holds a connection.
+"""
+import os
+import gzip
+import json
+import time
+import shutil
+import threading
+from datetime import datetime, timedelta
+
+from sqlmodel import Session, select
+from sqlalchemy.exc import OperationalError
+
+from database_config import engine, ViolationLog, SnapshotImage
+from modules.metrics import metrics
+from modules.utils import thumbnail_path
+
+RETENTION_DAYS = {"VIOLATION": 90, "VERIFIED": 7}
+DEFAULT_RETENTION_DAYS = 90  # Any other status
+ARCHIVE_DIR = "database/archive"
+SWEEP_INTERVAL = 3600         # Seconds between sweeps
+BATCH_SIZE = 500              # Rows per transaction; keeps the write lock short
+QUIET_HOURS = (2, 5)          # Local hours [start, end) in which vacuuming is allowed
+VACUUM_PAGES = 10000          # Pages freed per incremental vacuum step
+
+
+def enable_incremental_vacuum(db_engine=engine):
+    """
+    Switches the database file to incremental auto-vacuum (a one-off full VACUUM).
+    Call before the persistence and snapshot writers start: the rebuild needs
+    the file to itself. Returns whether the file is in incremental mode.
+    """
+    try:
+        with db_engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:  # 2 = INCREMENTAL
+                return True
+            print("[INFO] Switching the database to incremental auto-vacuum (one-off VACUUM)...")
+            conn.exec_driver_sql("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.exec_driver_sql("VACUUM")
+            return True
+    except OperationalError as e:
+        # E.g. another process has the file open; retried on the next start
+        print(f"[WARNING] Could not switch to incremental auto-vacuum: {e}")
+        return False
+
+
+def archive_path(month, archive_dir=ARCHIVE_DIR):
+    return f"{archive_dir}/violationlog-{month}.jsonl.gz"
+
+
+def read_archive(month, status=None, person_name=None, archive_dir=ARCHIVE_DIR):
+    """Yields the archived rows of one month ('YYYY-MM'), optionally filtered."""
+    path = archive_path(month, archive_dir)
+    if not os.path.exists(path):
+        return
+    # Appended batches are separate gzip members; gzip reads them as one stream
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            row = json.loads(line)
+            if status and row["status"] != status:
+                continue
+            if person_name and row["person_name"] != person_name:
+                continue
+            yield row
+
+
+def list_archives(archive_dir=ARCHIVE_DIR):
+    """[{'month', 'size_bytes'}] of the archive files, oldest first."""
+    if not os.path.isdir(archive_dir):
+        return []
+    months = []
+    for filename in sorted(os.listdir(archive_dir)):
+        if filename.startswith("violationlog-") and filename.endswith(".jsonl.gz"):
+            months.append({
+                "month": filename[len("violationlog-"):-len(".jsonl.gz")],
+                "size_bytes": os.path.getsize(f"{archive_dir}/{filename}"),
+            })
+    return months
+
+
+class RetentionService:
+    def __init__(self, db_engine=engine, retention_days=None, archive_dir=ARCHIVE_DIR, image_archive_dir=None,
+                 sweep_interval=SWEEP_INTERVAL, batch_size=BATCH_SIZE, quiet_hours=QUIET_HOURS):
+        self.engine = db_engine
+        self.retention_days = dict(RETENTION_DAYS, **(retention_days or {}))
+        self.archive_dir = archive_dir
+        self.image_archive_dir = image_archive_dir  # Move expired images here instead of deleting them
+        self.sweep_interval = sweep_interval
+        self.batch_size = batch_size
+        self.quiet_hours = quiet_hours
+        self.stopped = threading.Event()
+        self.t = None
+        self.last_vacuum_day = None
+
+    def start(self):
+        if self.t is not None and self.t.is_alive():
+            return
+        self.stopped.clear()
+        self.t = threading.Thread(target=self._run, name="retention", daemon=True)
+        self.t.start()
+
+    def stop(self, timeout=10.0):
+        self.stopped.set()
+        if self.t is not None:
+            self.t.join(timeout)
+
+    def _run(self):
+        while not self.stopped.is_set():
+            try:
+                self.sweep()
+                if self._is_quiet_hour() and self.last_vacuum_day != datetime.now().date():
+                    self.vacuum()
+                    self.last_vacuum_day = datetime.now().date()
+            except Exception as e:
+                metrics.inc("retention_failed")
+                print(f"[ERROR] Retention sweep failed: {e}")
+            self.stopped.wait(self.sweep_interval)
+
+    def _is_quiet_hour(self):
+        start, end = self.quiet_hours
+        return start <= datetime.now().hour < end
+
+    def _cutoff(self, status, now):
+        return now - timedelta(days=self.retention_days.get(status, DEFAULT_RETENTION_DAYS))
+
+    # ------------------------------------------
+    # Sweep
+    # ------------------------------------------
+    def sweep(self, now=None):
+        """Expires everything past its retention; returns (rows archived, images removed)."""
+        now = now or datetime.utcnow()
+        rows = images = 0
+        with Session(self.engine) as session:
+            statuses = session.exec(select(ViolationLog.status).distinct()).all()
+            statuses += [s for s in session.exec(select(SnapshotImage.status).distinct()).all() if s not in statuses]
+
+        for status in statuses:
+            cutoff = self._cutoff(status, now)
+            while not self.stopped.is_set():
+                archived, removed = self._expire_logs(status, cutoff)
+                rows += archived
+                images += removed
+                if archived < self.batch_size:
+                    break
+            while not self.stopped.is_set():
+                removed = self._expire_images(status, cutoff)
+                images += removed
+                if removed < self.batch_size:
+                    break
+        if rows or images:
+            print(f"[INFO] Retention: archived {rows} rows, removed {images} images")
+        return rows, images
+
+    def _expire_logs(self, status, cutoff):
+        with Session(self.engine) as session:
+            logs = session.exec(
+                select(ViolationLog)
+                .where(ViolationLog.status == status, ViolationLog.timestamp < cutoff)
+                .order_by(ViolationLog.timestamp)
+                .limit(self.batch_size)
+            ).all()
+            if not logs:
+                return 0, 0
+
+            self._archive(logs)
+            paths = [log.image_path.replace("\\", "/") for log in logs if log.image_path]
+            self._unindex(session, paths)
+            session.execute(ViolationLog.__table__.delete().where(ViolationLog.id.in_([log.id for log in logs])))
+            session.commit()
+
+        metrics.inc("retention_rows_archived", len(logs))
+        return len(logs), self._remove_files(paths)
+
+    def _expire_images(self, status, cutoff):
+        """Snapshots whose log row is gone or never existed."""
+        with Session(self.engine) as session:
+            statement = select(SnapshotImage.path).where(SnapshotImage.timestamp < cutoff)
+            statement = statement.where(SnapshotImage.status == status if status is not None else SnapshotImage.status.is_(None))
+            paths = session.exec(statement.limit(self.batch_size)).all()
+            self._unindex(session, paths)
+            session.commit()
+        self._remove_files(paths)
+        return len(paths)
+
+    def _archive(self, logs):
+        by_month = {}
+        for log in logs:
+            row = log.model_dump() if hasattr(log, "model_dump") else log.dict()
+            row["timestamp"] = log.timestamp.isoformat()
+            by_month.setdefault(log.timestamp.strftime("%Y-%m"), []).append(row)
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        for month, rows in by_month.items():
+            # Append mode adds a gzip member per batch; durable before the rows are deleted
+            with gzip.open(archive_path(month, self.archive_dir), "at", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row) + "\n")
+
+    def _unindex(self, session, paths):
+        if paths:
+            session.execute(SnapshotImage.__table__.delete().where(SnapshotImage.path.in_(paths)))
+
+    def _remove_files(self, paths):
+        """Deletes (or moves) the images and their thumbnails; returns the images removed."""
+        removed = 0
+        for path in paths:
+            for file_path in (path, thumbnail_path(path)):
+                try:
+                    if self.image_archive_dir:
+                        target = os.path.join(self.image_archive_dir, os.path.relpath(file_path, "database"))
+                        os.makedirs(os.path.dirname(target), exist_ok=True)
+                        shutil.move(file_path, target)
+                    else:
+                        os.remove(file_path)
+                    if file_path == path:
+                        removed += 1
+                except OSError:
+                    pass  # Already gone (or never written)
+        metrics.inc("retention_images_removed", removed)
+        return removed
+
+    # ------------------------------------------
+    # Vacuum
+    # ------------------------------------------
+    def vacuum(self):
+        """
+        Returns up to VACUUM_PAGES freed pages to the OS. Only incremental steps,
+        which hold the write lock briefly; without incremental mode (see
+        enable_incremental_vacuum) it does nothing. Returns whether it ran.
+        """
+        start = time.perf_counter()
+        try:
+            with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != 2:  # 2 = INCREMENTAL
+                    return False
+                conn.exec_driver_sql(f"PRAGMA incremental_vacuum({VACUUM_PAGES})")
+                conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        except OperationalError as e:
+            # Busy writers; tried again the next quiet hour
+            metrics.inc("retention_vacuum_failed")
+            print(f"[WARNING] Incremental vacuum skipped: {e}")
+            return False
+        metrics.observe("retention_vacuum_ms", (time.perf_counter() - start) * 1000)
+        return True
+
+
+# Process-wide service, started by the server
+retention = RetentionService()
@@ -0,0 +1,195 @@
+"""
+Background snapshot writer.
+
+Detection loops hand over only what the privacy blur needs (see
+utils.snapshot_parts) and get the image path back immediately; worker
+threads do the blur, JPEG encoding, thumbnail and disk writes. A full queue
+drops the snapshot (live paths) or waits up to a timeout (offline jobs),
+mirroring PersistenceService.log_event.
+
+Every written image gets a SnapshotImage index row (path, size, time, track,
+status), so galleries and analytics query the database instead of listing
+the date-sharded folders.
+"""
+import os
+import re
+import time
+import queue
+import threading
+from datetime import datetime, timezone
+
+import cv2
+from sqlmodel import Session, select
+
+from database_config import engine, SnapshotImage
+
+from modules.metrics import metrics
+from modules.persistence import persistence
+from modules.utils import snapshot_parts, compose_snapshot, snapshot_path, thumbnail_path
+
+SNAPSHOT_WORKERS = 2
+MAX_QUEUE = 64
+THUMBNAIL_WIDTH = 240
+JPEG_QUALITY = 90
+
+VIOLATIONS_DIR = "database/violations"
+VERIFIED_DIR = "database/verified"
+
+_STOP = object()
+
+
+class SnapshotWriter:
+    def __init__(self, workers=SNAPSHOT_WORKERS, max_queue=MAX_QUEUE, index_sink=None):
+        self.workers = workers
+        self.index_sink = index_sink  # Queues SnapshotImage rows (see modules/persistence.py)
+        self.q = queue.Queue(maxsize=max_queue)
+        self.threads = []
+
+        metrics.set_gauge("snapshot_queue_depth", self.queue_depth)
+
+    @property
+    def running(self):
+        return any(t.is_alive() for t in self.threads)
+
+    def start(self):
+        if self.running:
+            return
+        self.threads = [
+            threading.Thread(target=self._worker, name=f"snapshot-writer-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for t in self.threads:
+            t.start()
+
+    def stop(self, timeout=10.0):
+        """Writes everything still queued, then stops the workers."""
+        for _ in self.threads:
+            self.q.put(_STOP)
+        for t in self.threads:
+            t.join(timeout)
+        self.threads = []
+
+    def queue_depth(self):
+        return self.q.qsize()
+
+    def submit(self, frame, person_name, bbox, output_dir, keep_regions=None, tag=None, timeout=None,
+               track_id=None, status=None, camera_id=None):
+        """
+        Queues a snapshot of frame (blurred except bbox / keep_regions) and returns its path.
+        The pixels needed are copied right away, so the caller may keep drawing on frame.
+        track_id / status / camera_id go into the image's index row.
+        """
+        return self.submit_parts(snapshot_parts(frame, bbox, keep_regions), person_name, output_dir, tag, timeout,
+                                 track_id=track_id, status=status, camera_id=camera_id)
+
+    def submit_parts(self, parts, person_name, output_dir, tag=None, timeout=None,
+                     track_id=None, status=None, camera_id=None):
+        """
+        Same as submit() for parts already taken with utils.snapshot_parts().
+        Without a timeout a full queue drops the snapshot at once; with one it waits
+        up to that long. Returns the path, or None if the snapshot was dropped.
+        """
+        path = snapshot_path(person_name, output_dir, tag)
+        index = {"directory": output_dir, "person_name": person_name,
+                 "track_id": track_id, "status": status, "camera_id": camera_id}
+        job = (parts, path, index)
+
+        if not self.running:
+            # No workers (scripts, tests): write inline
+            self._write(job)
+            return path
+
+        try:
+            if timeout is None:
+                self.q.put_nowait(job)
+            else:
+                self.q.put(job, timeout=timeout)
+            metrics.inc("snapshots_enqueued")
+            return path
+        except queue.Full:
+            metrics.inc("snapshots_dropped")
+            print(f"[WARNING] Snapshot queue full, dropped snapshot of {person_name}")
+            return None
+
+    def index(self, path, directory, person_name, track_id=None, status=None, camera_id=None):
+        """Adds the index row of an image already on disk (e.g. written by a worker process)."""
+        if self.index_sink is None:
+            return
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        self.index_sink(path, directory, size, person_name, track_id=track_id, status=status, camera_id=camera_id)
+
+    # ------------------------------------------
+    # Worker Threads
+    # ------------------------------------------
+    def _worker(self):
+        while True:
+            job = self.q.get()
+            if job is _STOP:
+                break
+            try:
+                self._write(job)
+            except Exception as e:
+                metrics.inc("snapshots_failed")
+                print(f"[ERROR] Snapshot write failed: {e}")
+
+    def _write(self, job):
+        parts, path, index = job
+        start = time.perf_counter()
+        image = compose_snapshot(parts)
+
+        thumb_path = thumbnail_path(path)
+        # exist_ok: several workers may create them at the same time
+        os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+        cv2.imwrite(path, image, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+
+        h, w = image.shape[:2]
+        thumb = cv2.resize(image, (THUMBNAIL_WIDTH, max(1, int(h * THUMBNAIL_WIDTH / w))), interpolation=cv2.INTER_AREA)
+        cv2.imwrite(thumb_path, thumb, [cv2.IMWRITE_JPEG_QUALITY, 75])
+        self.index(path, **index)
+
+        metrics.inc("snapshots_written")
+        metrics.observe("snapshot_write_ms", (time.perf_counter() - start) * 1000)
+
+
+# Process-wide writer, started by the server
+snapshot_writer = SnapshotWriter(index_sink=persistence.index_image)
+
+
+_NAME_RE = re.compile(r"^(.*)_(\d{8}_\d{6})(?:_.*)?\.(?:jpg|jpeg|png)$")
+
+
+def backfill_index(directories, db_engine=engine):
+    """
+    One-off: indexes the images written before the index existed (flat folders,
+    {name}_{YYYYmmdd_HHMMSS}.jpg). Does nothing once the index has rows.
+    """
+    with Session(db_engine) as session:
+        if session.exec(select(SnapshotImage.id).limit(1)).first() is not None:
+            return 0
+        batch = []
+        for directory, status in directories:
+            for root, dirs, files in os.walk(directory):
+                dirs[:] = [d for d in dirs if d != "thumbs"]
+                for filename in files:
+                    match = _NAME_RE.match(filename)
+                    if not match:
+                        continue
+                    path = f"{root}/{filename}".replace(os.sep, "/")
+                    # File names carry local time; the index is UTC like ViolationLog
+                    local = datetime.strptime(match.group(2), "%Y%m%d_%H%M%S")
+                    batch.append((SnapshotImage, {
+                        "path": path,
+                        "directory": directory,
+                        "size_bytes": os.path.getsize(path),
+                        "person_name": match.group(1),
+                        "status": status,
+                        "timestamp": local.astimezone(timezone.utc).replace(tzinfo=None),
+                    }))
+        if batch:
+            persistence.write_batch(session, batch)
+            session.commit()
+            print(f"[INFO] Indexed {len(batch)} existing snapshots")
+        return len(batch)
@@ -0,0 +1,189 @@
+"""
+Persistent dashboard counters.
+
+StatCounter holds one row per (day, camera) with running totals of
+detections (newly tracked people), frames (frames with people from stateless
+/detect calls, which have no tracks), violations and verified events. The persistence writer adds each
+batch's increments in the same transaction as the rows they count, so /stats
+only sums this small table (cached for STATS_TTL) instead of loading the log.
+
+EventRollup does the same per hour and per day for the analytics charts
+(violations, verified, identified vs unknown), so any date range is read
+from at most 24 rows per day and camera.
+"""
+import time
+import threading
+
+from sqlmodel import Session, select, func
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from database_config import engine, StatCounter, EventRollup, ViolationLog
+
+STATS_TTL = 2.0  # Seconds a computed /stats answer is served before re-reading
+COUNTER_FIELDS = ("detections", "frames", "violations", "verified")
+STATUS_COUNTERS = {"VIOLATION": "violations", "VERIFIED": "verified"}
+ROLLUP_FIELDS = ("violations", "verified", "identified", "unknown")
+ROLLUP_PERIODS = {"hour": "%Y-%m-%d %H", "day": "%Y-%m-%d"}  # Bucket format per period
+
+
+def counter_key(timestamp, camera_id):
+    """StatCounter key; '' stands for /detect and uploaded videos (no camera)."""
+    return timestamp.strftime("%Y-%m-%d"), camera_id or ""
+
+
+def event_increments(events, increments=None):
+    """Adds the counters a list of ViolationLog field dicts contributes to increments."""
+    increments = {} if increments is None else increments
+    for event in events:
+        field = STATUS_COUNTERS.get(event["status"])
+        if field is None:
+            continue
+        row = increments.setdefault(counter_key(event["timestamp"], event.get("camera_id")), dict.fromkeys(COUNTER_FIELDS, 0))
+        row[field] += 1
+    return increments
+
+
+def rollup_increments(events, increments=None):
+    """Like event_increments, for EventRollup: {(period, bucket, camera_id): {field: n}}."""
+    increments = {} if increments is None else increments
+    for event in events:
+        field = STATUS_COUNTERS.get(event["status"])
+        if field is None:
+            continue
+        for period, fmt in ROLLUP_PERIODS.items():
+            key = (period, event["timestamp"].strftime(fmt), event.get("camera_id") or "")
+            row = increments.setdefault(key, dict.fromkeys(ROLLUP_FIELDS, 0))
+            row[field] += 1
+            if field == "violations":
+                row["unknown" if event["person_name"] == "Unknown" else "identified"] += 1
+    return increments
+
+
+def _upsert_counts(session, model, key_columns, fields, increments):
+    """Adds {key tuple: {field: n}} onto the rows of model, creating missing ones."""
+    for key, counts in increments.items():
+        statement = sqlite_insert(model).values(**dict(zip(key_columns, key)), **counts)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(key_columns),
+            set_={field: getattr(model, field) + statement.excluded[field] for field in fields},
+        )
+        session.execute(statement)
+
+
+def apply_increments(session, increments):
+    """Upserts {(day, camera_id): {field: n}} into StatCounter within the session's transaction."""
+    _upsert_counts(session, StatCounter, ("day", "camera_id"), COUNTER_FIELDS, increments)
+
+
+def apply_rollups(session, increments):
+    """Upserts {(period, bucket, camera_id): {field: n}} into EventRollup within the session's transaction."""
+    _upsert_counts(session, EventRollup, ("period", "bucket", "camera_id"), ROLLUP_FIELDS, increments)
+
+
+def backfill_counters(db_engine=engine):
+    """
+    One-off: builds the counters from an existing ViolationLog table.
+    Does nothing once StatCounter has rows.
+    """
+    with Session(db_engine) as session:
+        if session.exec(select(StatCounter.id).limit(1)).first() is not None:
+            return
+        day = func.date(ViolationLog.timestamp)
+        rows = session.exec(
+            select(day, ViolationLog.camera_id, ViolationLog.status, func.count())
+            .group_by(day, ViolationLog.camera_id, ViolationLog.status)
+        ).all()
+        increments = {}
+        for d, camera_id, status, n in rows:
+            field = STATUS_COUNTERS.get(status)
+            if d is None or field is None:
+                continue
+            row = increments.setdefault((d, camera_id or ""), dict.fromkeys(COUNTER_FIELDS, 0))
+            row[field] += n
+        if increments:
+            apply_increments(session, increments)
+            session.commit()
+            print(f"[INFO] Built stat counters for {len(increments)} day/camera pairs")
+
+
+def backfill_rollups(db_engine=engine, rebuild=False):
+    """
+    Builds EventRollup from the ViolationLog table. Without rebuild it does nothing
+    once rollups exist; with rebuild it recomputes them from scratch (run it while
+    the server is stopped, or events written meanwhile are counted twice).
+    """
+    with Session(db_engine) as session:
+        if rebuild:
+            session.execute(EventRollup.__table__.delete())
+        elif session.exec(select(EventRollup.id).limit(1)).first() is not None:
+            return 0
+
+        # Grouped in SQL by hour; the day rollups are summed from those
+        hour = func.strftime(ROLLUP_PERIODS["hour"], ViolationLog.timestamp)
+        unknown = ViolationLog.person_name == "Unknown"
+        rows = session.exec(
+            select(hour, ViolationLog.camera_id, ViolationLog.status, unknown, func.count())
+            .group_by(hour, ViolationLog.camera_id, ViolationLog.status, unknown)
+        ).all()
+        increments = {}
+        for bucket, camera_id, status, is_unknown, n in rows:
+            field = STATUS_COUNTERS.get(status)
+            if bucket is None or field is None:
+                continue
+            for key in (("hour", bucket, camera_id or ""), ("day", bucket[:10], camera_id or "")):
+                row = increments.setdefault(key, dict.fromkeys(ROLLUP_FIELDS, 0))
+                row[field] += n
+                if field == "violations":
+                    row["unknown" if is_unknown else "identified"] += n
+        apply_rollups(session, increments)
+        session.commit()
+        print(f"[INFO] Built {len(increments)} analytics rollups")
+        return len(increments)
+
+
+def read_rollups(session, period, start=None, end=None, camera_id=None, group=None):
+    """
+    Sums EventRollup rows of one period whose bucket lies in [start, end).
+    group is an SQL expression over EventRollup.bucket to group by (default: the bucket);
+    returns [(group value, {field: n})].
+    """
+    group = EventRollup.bucket if group is None else group
+    statement = select(group, *[func.sum(getattr(EventRollup, f)) for f in ROLLUP_FIELDS]).where(EventRollup.period == period)
+    if start is not None:
+        statement = statement.where(EventRollup.bucket >= start)
+    if end is not None:
+        statement = statement.where(EventRollup.bucket < end)
+    if camera_id is not None:
+        statement = statement.where(EventRollup.camera_id == camera_id)
+    statement = statement.group_by(group)
+    return [(row[0], dict(zip(ROLLUP_FIELDS, row[1:]))) for row in session.exec(statement).all()]
+
+
+def read_totals(session, camera_id=None, since=None):
+    """Sums the counters, optionally for one camera ('' = no camera) and from a day ('YYYY-MM-DD') on."""
+    statement = select(*[func.coalesce(func.sum(getattr(StatCounter, f)), 0) for f in COUNTER_FIELDS])
+    if camera_id is not None:
+        statement = statement.where(StatCounter.camera_id == camera_id)
+    if since is not None:
+        statement = statement.where(StatCounter.day >= since)
+    return dict(zip(COUNTER_FIELDS, session.exec(statement).one()))
+
+
+class StatsCache:
+    """Holds one computed value per key for ttl seconds; concurrent pollers share the same answer."""
+
+    def __init__(self, ttl=STATS_TTL):
+        self.ttl = ttl
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._values.get(key)
+            if cached is not None and now - cached[0] < self.ttl:
+                return cached[1]
+        value = compute()
+        with self._lock:
+            self._values[key] = (now, value)
+        return value
@@ -1,18 +1,23 @@
 import numpy as np
-from .utils import save_violation
+from .snapshots import snapshot_writer
 
 class ComplianceTracker:
-    def __init__(self, face_identifier):
+    def __init__(self, face_identifier, save_snapshots=True):
         self.face_identifier = face_identifier
+        # False for the video analyzers, which write (and index) their own snapshot per violation
+        self.save_snapshots = save_snapshots
         
         # State: {track_id: {'no_id_frames': 0, 'logged': False, 'name': None}}
         self.people_state = {} 
         self.VIOLATION_THRESHOLD = 25
 
-    def update(self, frame, person_tracks, id_card_boxes):
+    def update(self, frame, person_tracks, id_card_boxes, identify_faces=True, source=None):
         """
         person_tracks: List of [x1, y1, x2, y2, track_id, conf, cls] (from YOLO track)
         id_card_boxes: List of [x1, y1, x2, y2]
+        identify_faces: False skips face identification (load shedding); the violation is logged as Unknown
+        source: ingest.DecodedFrame that frame was decoded from at reduced size; violations
+                are identified and saved from its full-resolution frame
         """
         # Create a set of current track_ids for cleanup
         current_track_ids = set()
@@ -61,13 +66,19 @@ class ComplianceTracker:
                 color = (0, 0, 255) # Red
                 
                 # Identify Person
-                name = self.face_identifier.identify(frame, person_box)
+                full_frame, full_box = frame, person_box
+                if source is not None:
+                    full_frame, full_box = source.full(), source.to_full(person_box)
+                name = self.face_identifier.identify(full_frame, full_box) if identify_faces else 'Unknown'
                 state['name'] = name
                 
                 # Capture and Save (Blur Logic)
                 # The user wants to: "blur the other than the person who doesn't wear the id card"
-                # My `save_violation` does exactly this: blurs background/others, keeps subject clear.
-                save_violation(frame, name, person_box)
+                # The snapshot does exactly this: blurs background/others, keeps subject clear.
+                # Written in the background by the snapshot writer
+                if self.save_snapshots:
+                    snapshot_writer.submit(full_frame, name, full_box, "database/violations",
+                                           track_id=track_id, status="VIOLATION")
                 
                 state['logged'] = True
             
@@ -0,0 +1,336 @@
+"""
+Chunked, resumable video uploads.
+
+A client initialises an upload, PUTs fixed-size chunks (each with its SHA-256)
+in any order and finalises it. Chunks are appended to data.part as soon as
+they extend the contiguous prefix, so the analysis can start reading frames
+while the rest of the file is still arriving. State is kept in a manifest on
+disk, so an upload interrupted by a network drop (or a server restart) can be
+resumed by asking which chunks are already there.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+
+import cv2
+
+UPLOAD_ROOT = "uploads/chunked"
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024   # 8 MB
+MAX_CHUNK_SIZE = 64 * 1024 * 1024
+MIN_START_BYTES = 2 * 1024 * 1024      # Bytes needed before the decoder is opened
+
+
+class ChunkError(Exception):
+    """Raised for a chunk that fails validation (bad index, size or checksum)."""
+
+
+class ChunkedUpload:
+    def __init__(self, upload_id, filename, chunk_size, total_size=None, upload_root=UPLOAD_ROOT):
+        self.upload_id = upload_id
+        self.filename = filename
+        self.chunk_size = chunk_size
+        self.total_size = total_size
+        self.dir = f"{upload_root}/{upload_id}"
+        self.data_path = f"{self.dir}/data.part"
+        self.manifest_path = f"{self.dir}/manifest.json"
+
+        self.received = {}          # {index: sha256} of every accepted chunk
+        self.next_index = 0         # First chunk not yet appended to data.part
+        self.contiguous_bytes = 0   # Size of data.part
+        self.finalized = False
+        self.content_hash = None
+        self.readers = 0            # Analyses currently reading data.part
+        self.analyzed_live = False  # A live analysis has run to the end (in memory only)
+
+        self._digest = hashlib.sha256()  # Running hash over data.part
+        self._digest_valid = True
+        self._lock = threading.Lock()
+        self._grown = threading.Condition(self._lock)
+
+    # ------------------------------------------
+    # Persistence
+    # ------------------------------------------
+    def _save_manifest(self):
+        manifest = {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "chunk_size": self.chunk_size,
+            "total_size": self.total_size,
+            "received": self.received,
+            "next_index": self.next_index,
+            "contiguous_bytes": self.contiguous_bytes,
+            "finalized": self.finalized,
+            "content_hash": self.content_hash,
+        }
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    @classmethod
+    def load(cls, manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        upload = cls(manifest["upload_id"], manifest["filename"], manifest["chunk_size"],
+                     manifest["total_size"], upload_root=os.path.dirname(os.path.dirname(manifest_path)))
+        upload.received = {int(k): v for k, v in manifest["received"].items()}
+        upload.next_index = manifest["next_index"]
+        upload.contiguous_bytes = manifest["contiguous_bytes"]
+        upload.finalized = manifest["finalized"]
+        upload.content_hash = manifest["content_hash"]
+
+        # A crash between appending and saving the manifest leaves extra bytes
+        # behind and chunk files already consumed; drop both, the client resends
+        if os.path.getsize(upload.data_path) > upload.contiguous_bytes:
+            os.truncate(upload.data_path, upload.contiguous_bytes)
+        for index in [i for i in upload.received if i >= upload.next_index]:
+            if not os.path.exists(upload._chunk_path(index)):
+                del upload.received[index]
+
+        # The running hash state is lost on restart; recomputed on finalize
+        upload._digest_valid = upload.contiguous_bytes == 0
+        return upload
+
+    # ------------------------------------------
+    # Chunks
+    # ------------------------------------------
+    @property
+    def expected_chunks(self):
+        if self.total_size is None:
+            return None
+        return max(1, -(-self.total_size // self.chunk_size))
+
+    def _chunk_path(self, index):
+        return f"{self.dir}/chunk_{index:06d}"
+
+    def write_chunk(self, index, data, checksum):
+        """
+        Stores one chunk (blocking; call from a worker thread).
+        checksum is the hex SHA-256 of data and is required.
+        Re-sending an already accepted chunk is a no-op, which makes retries safe.
+        """
+        if not checksum:
+            raise ChunkError(f"Missing checksum for chunk {index}")
+        if len(data) > self.chunk_size:
+            raise ChunkError(f"Chunk larger than chunk_size ({self.chunk_size})")
+
+        digest = hashlib.sha256(data).hexdigest()
+        if checksum.lower() != digest:
+            raise ChunkError(f"Checksum mismatch for chunk {index}")
+
+        with self._lock:
+            # Under the lock: finalize() sets finalized / total_size while holding it
+            if self.finalized:
+                raise ChunkError("Upload already finalized")
+            if index < 0 or (self.expected_chunks is not None and index >= self.expected_chunks):
+                raise ChunkError(f"Chunk index {index} out of range")
+            if self.expected_chunks is not None and index < self.expected_chunks - 1 and len(data) != self.chunk_size:
+                raise ChunkError(f"Only the last chunk may be shorter than chunk_size ({self.chunk_size})")
+            if index in self.received:
+                return
+            # Out-of-order chunks wait in their own file until the gap is filled
+            with open(self._chunk_path(index), "wb") as f:
+                f.write(data)
+            self.received[index] = digest
+            self._append_contiguous()
+            self._save_manifest()
+            self._grown.notify_all()
+
+    def _append_contiguous(self):
+        with open(self.data_path, "ab") as out:
+            while self.next_index in self.received:
+                path = self._chunk_path(self.next_index)
+                with open(path, "rb") as f:
+                    data = f.read()
+                out.write(data)
+                if self._digest_valid:
+                    self._digest.update(data)
+                os.remove(path)
+                self.contiguous_bytes += len(data)
+                self.next_index += 1
+
+    @property
+    def complete(self):
+        if self.total_size is not None:
+            return self.contiguous_bytes >= self.total_size
+        return self.finalized
+
+    def missing_chunks(self):
+        if self.expected_chunks is None:
+            return []
+        return [i for i in range(self.expected_chunks) if i not in self.received]
+
+    def finalize(self):
+        """Checks that every chunk is there and fixes the content hash. Blocking."""
+        with self._lock:
+            if self.finalized:
+                return self.content_hash
+            missing = self.missing_chunks()
+            if missing:
+                raise ChunkError(f"Missing chunks: {missing[:20]}")
+            if self.next_index != len(self.received):
+                raise ChunkError("Upload has gaps; resend the missing chunks")
+
+            if not self._digest_valid:
+                self._digest = hashlib.sha256()
+                with open(self.data_path, "rb") as f:
+                    for block in iter(lambda: f.read(DEFAULT_CHUNK_SIZE), b""):
+                        self._digest.update(block)
+            self.content_hash = self._digest.hexdigest()
+            if self.total_size is None:
+                self.total_size = self.contiguous_bytes
+            self.finalized = True
+            self._save_manifest()
+            self._grown.notify_all()
+            return self.content_hash
+
+    def add_reader(self):
+        with self._lock:
+            self.readers += 1
+
+    def remove_reader(self):
+        with self._lock:
+            self.readers -= 1
+
+    def has_readers(self):
+        with self._lock:
+            return self.readers > 0
+
+    def wait_for_growth(self, known_bytes, timeout=1.0):
+        """Blocks until data.part is larger than known_bytes or the upload is complete."""
+        with self._lock:
+            if self.contiguous_bytes <= known_bytes and not self.complete:
+                self._grown.wait(timeout)
+            return self.contiguous_bytes
+
+    def status(self):
+        return {
+            "upload_id": self.upload_id,
+            "filename": self.filename,
+            "chunk_size": self.chunk_size,
+            "total_size": self.total_size,
+            "received_chunks": sorted(self.received),
+            "missing_chunks": self.missing_chunks(),
+            "contiguous_bytes": self.contiguous_bytes,
+            "finalized": self.finalized,
+            "content_hash": self.content_hash,
+        }
+
+
+class UploadStore:
+    """Registry of in-flight uploads, backed by manifests under UPLOAD_ROOT."""
+
+    def __init__(self, upload_root=UPLOAD_ROOT):
+        self.upload_root = upload_root
+        self.uploads = {}
+        self._lock = threading.Lock()
+
+    def create(self, filename, total_size=None, chunk_size=None):
+        chunk_size = min(chunk_size or DEFAULT_CHUNK_SIZE, MAX_CHUNK_SIZE)
+        upload = ChunkedUpload(uuid.uuid4().hex, os.path.basename(filename or "video"),
+                               chunk_size, total_size, upload_root=self.upload_root)
+        os.makedirs(upload.dir)
+        open(upload.data_path, "wb").close()
+        upload._save_manifest()
+        with self._lock:
+            self.uploads[upload.upload_id] = upload
+        return upload
+
+    def get(self, upload_id):
+        with self._lock:
+            upload = self.uploads.get(upload_id)
+            if upload is not None:
+                return upload
+            # Not in memory (server restarted): reload from its manifest
+            manifest_path = f"{self.upload_root}/{os.path.basename(upload_id)}/manifest.json"
+            if not os.path.exists(manifest_path):
+                return None
+            upload = ChunkedUpload.load(manifest_path)
+            self.uploads[upload_id] = upload
+            return upload
+
+    def discard(self, upload_id):
+        with self._lock:
+            upload = self.uploads.pop(upload_id, None)
+        if upload is not None:
+            shutil.rmtree(upload.dir, ignore_errors=True)
+
+
+# ==========================================
+# Reading frames from a growing file
+# ==========================================
+class GrowingVideoCapture:
+    """
+    cv2.VideoCapture look-alike over an upload that is still arriving.
+    When the decoder runs out of data before the upload is complete it waits
+    for more chunks, reopens the file and seeks back to where it stopped.
+    Needs a streamable container (moov-first MP4, MKV, TS, AVI).
+    """
+
+    def __init__(self, upload, stall_timeout=300):
+        self.upload = upload
+        self.stall_timeout = stall_timeout
+        self.cap = None
+        self.position = 0
+        self.opened_bytes = 0
+        self._open(wait=True)
+
+    def _open(self, wait=False):
+        deadline = time.time() + self.stall_timeout
+        while True:
+            size = self.upload.contiguous_bytes
+            if size >= MIN_START_BYTES or self.upload.complete:
+                break
+            if not wait or time.time() > deadline:
+                break
+            self.upload.wait_for_growth(size)
+
+        if self.cap is not None:
+            self.cap.release()
+        self.opened_bytes = self.upload.contiguous_bytes
+        self.cap = cv2.VideoCapture(self.upload.data_path)
+        if self.position:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.position)
+
+    def _advance(self, step):
+        deadline = time.time() + self.stall_timeout
+        while True:
+            result = step()
+            ok = result[0] if isinstance(result, tuple) else result
+            if ok:
+                self.position += 1
+                return result
+            if self.upload.complete and self.opened_bytes >= self.upload.contiguous_bytes:
+                return result  # Real end of file
+            if time.time() > deadline:
+                print(f"[WARNING] Upload {self.upload.upload_id} stalled, stopping analysis")
+                return result
+            self.upload.wait_for_growth(self.opened_bytes)
+            if self.upload.contiguous_bytes > self.opened_bytes:
+                self._open()
+
+    # self.cap is replaced on reopen, so look it up on every attempt
+    def grab(self):
+        return self._advance(lambda: self.cap.grab())
+
+    def read(self):
+        return self._advance(lambda: self.cap.read())
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            self.position = int(value)
+        return self.cap.set(prop, value)
+
+    def isOpened(self):
+        return self.cap is not None and self.cap.isOpened()
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
@@ -1,97 +1,160 @@
 import cv2
 import numpy as np
 import os
+import uuid
 from datetime import datetime
 
+from modules.nms import nms
+
 def perform_nms(boxes, scores, iou_threshold=0.3):
     """
     Apply Non-Maximum Suppression to filter overlapping boxes.
+    Detector output should go through modules.nms directly; this is for plain lists.
     
     Args:
         boxes: List of [x1, y1, x2, y2]
-        scores: List of confidence scores (optional, can be all 1.0)
+        scores: List of confidence scores (optional; without them earlier boxes win)
         iou_threshold: Intersection over Union threshold (0.3 means remove if overlap > 30%)
         
     Returns:
-        List of selected boxes [x1, y1, x2, y2]
+        List of selected boxes [x1, y1, x2, y2], highest score first
     """
     if len(boxes) == 0:
         return []
-    
-    # Ensure boxes are float for calculation but return original format
-    boxes_np = np.array(boxes).astype(float)
-    
-    # If no scores provided, prioritize by area (larger boxes first) or just order
-    if not scores or len(scores) != len(boxes):
-        # Calculate areas as proxy for score? Or just use index
+    if scores is None or len(scores) != len(boxes):
         scores = np.ones(len(boxes))
-    
-    scores_np = np.array(scores)
-    
-    # Use OpenCV's NMS
-    # cv2.dnn.NMSBoxes expects (x, y, w, h)
-    boxes_xywh = []
-    for x1, y1, x2, y2 in boxes_np:
-        boxes_xywh.append([int(x1), int(y1), int(x2 - x1), int(y2 - y1)])
-        
-    indices = cv2.dnn.NMSBoxes(boxes_xywh, scores_np, score_threshold=0.0, nms_threshold=iou_threshold)
-    
-    selected_boxes = []
-    if len(indices) > 0:
-        for i in indices.flatten():
-            selected_boxes.append(boxes[i])
-            
-    return selected_boxes
-
-def blur_background(frame, focus_bbox):
+    return [boxes[i] for i in nms(boxes, scores, iou_threshold)]
+
+BLUR_MODES = ("fast", "full")
+FAST_BLUR_WIDTH = 320  # Fast mode blurs a copy this wide, then upsamples it
+FEATHER_PX = 24        # Width of the soft edge around kept regions (fast mode)
+
+def _pad_box(box, w, h, ratio=0.2):
+    x1, y1, x2, y2 = map(int, box)
+    # Add padding (e.g., 20% of width/height)
+    pad_w = int((x2 - x1) * ratio)
+    pad_h = int((y2 - y1) * ratio)
+    return max(0, x1 - pad_w), max(0, y1 - pad_h), min(w, x2 + pad_w), min(h, y2 + pad_h)
+
+def _upsample_blurred(small, scale, size):
+    h, w = size
+    ksize = max(3, int(99 * scale) | 1)
+    small = cv2.GaussianBlur(small, (ksize, ksize), 30 * scale)
+    return cv2.resize(small, (w, h), interpolation=cv2.INTER_LINEAR)
+
+def snapshot_parts(frame, focus_bbox, keep_regions=None):
+    """
+    Everything the fast blur needs from a frame: a low-resolution copy for the
+    blurred background and the full-resolution pixels around the kept regions.
+    Much smaller than the frame, and independent of it once returned, so it can
+    be queued while the caller keeps drawing on the frame.
+    """
+    h, w = frame.shape[:2]
+    scale = min(1.0, FAST_BLUR_WIDTH / w)
+    sw, sh = max(1, int(w * scale)), max(1, int(h * scale))
+    small = cv2.resize(frame, (sw, sh), interpolation=cv2.INTER_AREA)
+
+    boxes = ([focus_bbox] if focus_bbox is not None else []) + list(keep_regions or [])
+    boxes = [_pad_box(box, w, h) for box in boxes]
+
+    # Feathered mask, built at the low resolution
+    feather = max(1, int(FEATHER_PX * scale))
+    mask_small = np.zeros((sh, sw), dtype=np.uint8)
+    for x1, y1, x2, y2 in boxes:
+        cv2.rectangle(mask_small, (int(x1 * scale) - feather, int(y1 * scale) - feather),
+                      (int(x2 * scale) + feather, int(y2 * scale) + feather), 255, -1)
+    if boxes:
+        mask_small = cv2.GaussianBlur(mask_small, (2 * feather + 1, 2 * feather + 1), 0)
+
+    roi = None
+    rx, ry, rw, rh = cv2.boundingRect(mask_small)
+    if rw and rh:
+        x1, y1 = int(rx / scale), int(ry / scale)
+        x2, y2 = min(w, int((rx + rw) / scale)), min(h, int((ry + rh) / scale))
+        roi = (x1, y1, x2, y2, frame[y1:y2, x1:x2].copy(), mask_small[ry:ry + rh, rx:rx + rw])
+
+    return {"size": (h, w), "scale": scale, "small": small, "boxes": boxes, "roi": roi}
+
+def compose_snapshot(parts):
+    """Rebuilds the privacy-blurred frame from snapshot_parts()."""
+    blurred_frame = _upsample_blurred(parts["small"], parts["scale"], parts["size"])
+    if parts["roi"] is None:
+        return blurred_frame
+
+    # The mask is upsampled only where it is non-zero
+    x1, y1, x2, y2, sharp, mask_small = parts["roi"]
+    mask = cv2.resize(mask_small, (x2 - x1, y2 - y1), interpolation=cv2.INTER_LINEAR)
+    # The padded boxes themselves stay fully sharp
+    for bx1, by1, bx2, by2 in parts["boxes"]:
+        mask[max(0, by1 - y1):max(0, by2 - y1), max(0, bx1 - x1):max(0, bx2 - x1)] = 255
+
+    weights = mask.astype(np.uint16)[..., None]
+    soft = blurred_frame[y1:y2, x1:x2].astype(np.uint16)
+    blurred_frame[y1:y2, x1:x2] = ((sharp.astype(np.uint16) * weights + soft * (255 - weights) + 127) // 255).astype(np.uint8)
+    return blurred_frame
+
+def blur_background(frame, focus_bbox, keep_regions=None, mode="fast"):
     """
     Blurs the entire frame except for the region defined by focus_bbox (x1, y1, x2, y2).
+    keep_regions: more boxes to keep sharp; everyone else stays blurred.
+    mode "fast" blurs at low resolution and blends the sharp regions in with a
+    feathered mask; "full" is the full-resolution blur with hard edges.
     """
-    if focus_bbox is None:
+    if mode not in BLUR_MODES:
+        raise ValueError(f"mode must be one of {BLUR_MODES}")
+    if mode == "fast":
+        return compose_snapshot(snapshot_parts(frame, focus_bbox, keep_regions))
+
+    if focus_bbox is None and not keep_regions:
         return cv2.GaussianBlur(frame, (21, 21), 0)
 
-    x1, y1, x2, y2 = map(int, focus_bbox)
     h, w = frame.shape[:2]
-
-    # Add padding (e.g., 20% of width/height)
-    pad_w = int((x2 - x1) * 0.2)
-    pad_h = int((y2 - y1) * 0.2)
-
-    x1 = max(0, x1 - pad_w)
-    y1 = max(0, y1 - pad_h)
-    x2 = min(w, x2 + pad_w)
-    y2 = min(h, y2 + pad_h)
-    
+    boxes = ([focus_bbox] if focus_bbox is not None else []) + list(keep_regions or [])
     # Global blur
     blurred_frame = cv2.GaussianBlur(frame, (99, 99), 30)
-    
     # Copy the clear person (with padding) from original frame
-    blurred_frame[y1:y2, x1:x2] = frame[y1:y2, x1:x2]
-    
+    for x1, y1, x2, y2 in (_pad_box(box, w, h) for box in boxes):
+        blurred_frame[y1:y2, x1:x2] = frame[y1:y2, x1:x2]
     return blurred_frame
 
-def save_snapshot(frame, person_name, bbox, output_dir):
+def snapshot_path(person_name, output_dir, tag=None):
     """
-    Saves the processed frame (blurred background) to the specified directory.
-    Returns the filepath.
+    Where save_snapshot() / SnapshotWriter put the image of person_name:
+    output_dir/YYYY/MM/DD/{name}_{YYYYmmdd_HHMMSS}[_{tag}]_{unique}.jpg
+    One folder per day keeps directories small; the random suffix keeps two
+    snapshots of the same name in the same second apart.
     """
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    now = datetime.now()
+    timestamp = now.strftime("%Y%m%d_%H%M%S")
     # Sanitize filename
     safe_name = "".join([c for c in person_name if c.isalpha() or c.isdigit() or c==' ']).strip().replace(" ", "_")
-    filename = f"{safe_name}_{timestamp}.jpg"
-    
+    unique = uuid.uuid4().hex[:8]
+    filename = f"{safe_name}_{timestamp}_{tag}_{unique}.jpg" if tag else f"{safe_name}_{timestamp}_{unique}.jpg"
     # Use forward slashes for web compatibility
-    filepath = f"{output_dir}/{filename}"
+    return f"{output_dir}/{now:%Y/%m/%d}/{filename}"
+
+def thumbnail_path(image_path):
+    """Thumbnails sit in a thumbs/ folder next to the image, under the same name."""
+    directory, filename = os.path.split(image_path)
+    return f"{directory}/thumbs/{filename}"
+
+def save_snapshot(frame, person_name, bbox, output_dir, tag=None, keep_regions=None):
+    """
+    Saves the processed frame (blurred background) to the specified directory.
+    tag is appended to the filename to keep concurrent writers apart.
+    keep_regions are extra boxes left unblurred.
+    Returns the filepath.
+    """
+    filepath = snapshot_path(person_name, output_dir, tag)
+    # exist_ok: several camera threads may create it at the same time
+    os.makedirs(os.path.dirname(filepath), exist_ok=True)
 
     # Process frame: blur everything except the person
-    processed_frame = blur_background(frame, bbox)
+    processed_frame = blur_background(frame, bbox, keep_regions)
     
     cv2.imwrite(filepath, processed_frame)
     # print(f"[LOG] Snapshot saved: {filepath}")
     return filepath
 
-def save_violation(frame, person_name, bbox, violations_dir="database/violations"):
-    return save_snapshot(frame, person_name, bbox, violations_dir)
+def save_violation(frame, person_name, bbox, violations_dir="database/violations", tag=None):
+    return save_snapshot(frame, person_name, bbox, violations_dir, tag)
@@ -0,0 +1,425 @@
+"""
+Parallel chunked video analysis.
+
+The video is split into time ranges and every range is analyzed in its own
+worker process with its own detector, face identifier and trackers. Tracks that
+cross a chunk boundary are stitched back together (bbox continuity + face
+embedding) so that each person is reported once.
+"""
+import os
+import time
+import queue
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+FRAME_STEP = 8               # Same sampling as the sequential analyzer
+MIN_CHUNK_SECONDS = 20       # Don't split videos into tiny ranges
+BOUNDARY_WINDOW = 3          # Sampled frames near a boundary that count as "crossing"
+STITCH_IOU = 0.3             # Bbox continuity needed when faces can't be compared
+STITCH_FACE_SIM = 0.5        # Cosine similarity that is enough on its own
+STITCH_FACE_SIM_WEAK = 0.25  # Cosine similarity accepted together with bbox continuity
+PROGRESS_EVERY = 4           # Report progress every N sampled frames
+
+# Per-process state, filled by _init_worker
+_worker = {}
+
+
+# ==========================================
+# Chunk Planning
+# ==========================================
+def plan_chunks(total_frames, fps, num_workers, frame_step=FRAME_STEP):
+    """
+    Splits [0, total_frames) into contiguous ranges, one per worker.
+    Range starts are aligned to frame_step so the sampled frames are exactly
+    the ones the sequential analyzer would look at.
+    """
+    if total_frames <= 0:
+        return [(0, 0)]
+
+    min_chunk = max(frame_step, int(MIN_CHUNK_SECONDS * fps)) if fps > 0 else frame_step
+    num_chunks = max(1, min(num_workers, total_frames // min_chunk))
+
+    size = total_frames // num_chunks
+    size -= size % frame_step
+    size = max(size, frame_step)
+
+    chunks = []
+    start = 0
+    for i in range(num_chunks):
+        end = total_frames if i == num_chunks - 1 else min(total_frames, start + size)
+        chunks.append((start, end))
+        start = end
+    return chunks
+
+
+# ==========================================
+# Worker Side
+# ==========================================
+def _init_worker(model_path, progress_queue):
+    # One process per core, keep each one single-threaded
+    cv2.setNumThreads(1)
+
+    from modules.model_onnx import load_detector
+    from modules.face_ident import FaceIdentifier
+
+    _worker['model'] = load_detector(model_path)
+    _worker['face_ident'] = FaceIdentifier()
+    _worker['progress'] = progress_queue
+
+
+def _report(chunk_index, frames_done):
+    try:
+        _worker['progress'].put_nowait((chunk_index, frames_done))
+    except Exception:
+        pass
+
+
+def analyze_chunk(video_path, chunk_index, start_frame, end_frame, fps, frame_step=FRAME_STEP, conf=0.4):
+    """
+    Analyzes frames [start_frame, end_frame) of the video.
+    Returns per-track records that the parent process stitches together.
+    """
+    from modules.tracker import ComplianceTracker
+    from modules.tracker_simple import SimpleTracker
+    from modules.utils import save_violation
+    from modules.nms import split_by_class
+
+    model = _worker['model']
+    face_ident = _worker['face_ident']
+    person_tracker = SimpleTracker()
+    # The violation snapshot is written below; the tracker must not write a second one
+    tracker = ComplianceTracker(face_ident, save_snapshots=False)
+
+    # Frames close to either boundary: tracks seen here may continue in a neighbour chunk
+    window = BOUNDARY_WINDOW * frame_step
+    head_limit = start_frame + window
+    tail_limit = end_frame - window
+
+    tracks = {}
+    cap = cv2.VideoCapture(video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame)
+    frame_idx = start_frame
+    sampled = 0
+
+    try:
+        while frame_idx < end_frame:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            current_idx = frame_idx
+            frame_idx += 1
+
+            # Same sampling as the sequential loop (every frame_step-th frame)
+            if (current_idx + 1) % frame_step != 0:
+                continue
+            sampled += 1
+            if sampled % PROGRESS_EVERY == 0:
+                _report(chunk_index, current_idx + 1 - start_frame)
+
+            results = model.predict(frame, conf=conf, verbose=False, task='detect')
+            if not results or not results[0].boxes:
+                continue
+
+            person_tracks_raw, id_card_boxes = split_by_class(results[0])
+
+            person_tracks = person_tracker.update(person_tracks_raw)
+            display_data = tracker.update(frame, person_tracks, id_card_boxes)
+            seconds = current_idx / fps if fps > 0 else 0
+
+            for item in display_data:
+                track_id = item['id']
+                bbox = [float(v) for v in item['bbox']]
+                record = tracks.get(track_id)
+                if record is None:
+                    record = tracks[track_id] = {
+                        'chunk': chunk_index,
+                        'track_id': track_id,
+                        'first_frame': current_idx,
+                        'first_bbox': bbox,
+                        'name': 'Unknown',
+                        'embedding': None,
+                        'violation': None,
+                    }
+                record['last_frame'] = current_idx
+                record['last_bbox'] = bbox
+
+                name = item.get('name') or record['name']
+
+                # Faces are only needed for tracks that may continue in a neighbour chunk
+                near_boundary = current_idx < head_limit or current_idx >= tail_limit
+                if near_boundary and record['embedding'] is None:
+                    name, embedding = face_ident.identify_with_embedding(frame, bbox)
+                    if embedding is not None:
+                        record['embedding'] = np.asarray(embedding, dtype=np.float32).tolist()
+                if name and name != 'Unknown':
+                    record['name'] = name
+
+                if "VIOLATION" in item['status'] and record['violation'] is None:
+                    if record['name'] == 'Unknown':
+                        record['name'] = face_ident.identify(frame, bbox)
+                    image_path = save_violation(frame, record['name'], bbox, tag=f"c{chunk_index}_t{track_id}")
+                    record['violation'] = {
+                        "frame_number": current_idx + 1,
+                        "timestamp": round(seconds, 2),
+                        "image_path": image_path,
+                    }
+    finally:
+        cap.release()
+
+    _report(chunk_index, end_frame - start_frame)
+    return {
+        'chunk_index': chunk_index,
+        'start_frame': start_frame,
+        'end_frame': end_frame,
+        'frames_processed': frame_idx - start_frame,
+        'tracks': list(tracks.values()),
+    }
+
+
+# ==========================================
+# Track Stitching
+# ==========================================
+def _iou(box_a, box_b):
+    xa, ya = max(box_a[0], box_b[0]), max(box_a[1], box_b[1])
+    xb, yb = min(box_a[2], box_b[2]), min(box_a[3], box_b[3])
+    inter = max(0, xb - xa) * max(0, yb - ya)
+    area_a = (box_a[2] - box_a[0]) * (box_a[3] - box_a[1])
+    area_b = (box_b[2] - box_b[0]) * (box_b[3] - box_b[1])
+    return inter / float(area_a + area_b - inter + 1e-6)
+
+
+def _cosine(emb_a, emb_b):
+    if emb_a is None or emb_b is None:
+        return None
+    a = np.asarray(emb_a, dtype=np.float32)
+    b = np.asarray(emb_b, dtype=np.float32)
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b) + 1e-6))
+
+
+def _link_score(tail, head):
+    """
+    Returns a match score for a track ending one chunk (tail) and a track
+    starting the next (head), or None if they are not the same person.
+    """
+    iou = _iou(tail['last_bbox'], head['first_bbox'])
+    sim = _cosine(tail['embedding'], head['embedding'])
+
+    if sim is not None:
+        if sim >= STITCH_FACE_SIM or (sim >= STITCH_FACE_SIM_WEAK and iou >= STITCH_IOU):
+            return sim + iou
+        return None
+    if iou >= STITCH_IOU:
+        return iou
+    return None
+
+
+def stitch_tracks(chunk_results, chunks, frame_step=FRAME_STEP):
+    """
+    Merges per-chunk track records into persons.
+    Returns a list of persons (each a list of track records), ordered by first appearance.
+    """
+    window = BOUNDARY_WINDOW * frame_step
+    records = []
+    by_chunk = {}
+    for result in chunk_results:
+        for record in result['tracks']:
+            record['_idx'] = len(records)
+            records.append(record)
+            by_chunk.setdefault(result['chunk_index'], []).append(record)
+
+    # Union-Find over track records
+    parent = list(range(len(records)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for k in range(len(chunks) - 1):
+        boundary = chunks[k][1]
+        tails = [r for r in by_chunk.get(k, []) if r['last_frame'] >= boundary - window]
+        heads = [r for r in by_chunk.get(k + 1, []) if r['first_frame'] < boundary + window]
+
+        candidates = []
+        for tail in tails:
+            for head in heads:
+                score = _link_score(tail, head)
+                if score is not None:
+                    candidates.append((score, tail['_idx'], head['_idx']))
+
+        # Greedy one-to-one matching, best links first
+        candidates.sort(reverse=True)
+        used_tails, used_heads = set(), set()
+        for score, t, h in candidates:
+            if t in used_tails or h in used_heads:
+                continue
+            used_tails.add(t)
+            used_heads.add(h)
+            parent[find(h)] = find(t)
+
+    groups = {}
+    for record in records:
+        groups.setdefault(find(record['_idx']), []).append(record)
+
+    persons = [sorted(g, key=lambda r: (r['chunk'], r['first_frame'])) for g in groups.values()]
+    persons.sort(key=lambda g: g[0]['first_frame'])
+    return persons
+
+
+def _merge_person(group):
+    """Collapses a stitched group of track records into one person entry."""
+    name = next((r['name'] for r in group if r['name'] != 'Unknown'), 'Unknown')
+
+    violations = sorted((r['violation'] for r in group if r['violation'] is not None),
+                        key=lambda e: e['frame_number'])
+    violation = violations[0] if violations else None
+
+    # The same person was snapshotted in several chunks; keep only the first image.
+    # Worker snapshots are tagged with chunk and track id, so these files belong
+    # to this group alone and nothing else points at them.
+    for event in violations[1:]:
+        if event['image_path'] == violation['image_path']:
+            continue
+        try:
+            os.remove(event['image_path'])
+        except OSError:
+            pass
+
+    return name, violation
+
+
+# ==========================================
+# Parent Side
+# ==========================================
+def analyze_video_parallel(video_path, num_workers=None, model_path="idcard.onnx", on_event=None,
+                           completed_chunks=None, on_chunk_done=None):
+    """
+    Generator: runs the chunked analysis and yields NDJSON-ready dicts
+    (progress updates followed by one final result).
+
+    on_event(person_name, image_path, track_id, status) is called once per
+    stitched person and event type, so the caller can persist it.
+    on_chunk_done(chunk_index, result) checkpoints a finished chunk; results
+    passed back in completed_chunks ({chunk_index: result}) are not recomputed
+    as long as the chunk plan is unchanged.
+    """
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    num_workers = num_workers or os.cpu_count() or 1
+    chunks = plan_chunks(total_frames, fps, num_workers)
+    start_time = time.time()
+
+    ctx = mp.get_context("spawn")
+    manager = ctx.Manager()
+    progress_queue = manager.Queue()
+    chunk_progress = [0] * len(chunks)
+    chunk_results = []
+
+    # Reuse checkpointed chunks from an interrupted run
+    for i, result in (completed_chunks or {}).items():
+        i = int(i)
+        if i < len(chunks) and (result['start_frame'], result['end_frame']) == chunks[i]:
+            chunk_results.append(result)
+            chunk_progress[i] = chunks[i][1] - chunks[i][0]
+    done_indices = {r['chunk_index'] for r in chunk_results}
+
+    yield {
+        "status": "processing",
+        "progress": 0.0,
+        "time_left": "Calculating...",
+        "mode": "parallel",
+        "chunks": len(chunks),
+    }
+
+    try:
+        with ProcessPoolExecutor(max_workers=len(chunks), mp_context=ctx,
+                                 initializer=_init_worker,
+                                 initargs=(model_path, progress_queue)) as pool:
+            futures = [
+                pool.submit(analyze_chunk, video_path, i, start, end, fps)
+                for i, (start, end) in enumerate(chunks)
+                if i not in done_indices
+            ]
+            pending = set(futures)
+
+            while pending:
+                updated = False
+                try:
+                    chunk_index, frames_done = progress_queue.get(timeout=0.5)
+                    chunk_progress[chunk_index] = max(chunk_progress[chunk_index], frames_done)
+                    updated = True
+                    # Drain whatever else arrived meanwhile
+                    while True:
+                        chunk_index, frames_done = progress_queue.get_nowait()
+                        chunk_progress[chunk_index] = max(chunk_progress[chunk_index], frames_done)
+                except queue.Empty:
+                    pass
+
+                for future in [f for f in pending if f.done()]:
+                    pending.remove(future)
+                    result = future.result()
+                    chunk_results.append(result)
+                    if on_chunk_done:
+                        on_chunk_done(result['chunk_index'], result)
+                    updated = True
+
+                if not updated:
+                    continue
+
+                elapsed = time.time() - start_time
+                progress = sum(chunk_progress) / total_frames if total_frames > 0 else 0
+                if progress > 0.01:
+                    time_left_str = f"{int(elapsed / progress - elapsed)}s"
+                else:
+                    time_left_str = "Calculating..."
+
+                yield {
+                    "status": "processing",
+                    "progress": round(min(progress, 1.0) * 100, 1),
+                    "time_left": time_left_str,
+                    "chunks_done": len(chunks) - len(pending),
+                    "chunks": len(chunks),
+                }
+    finally:
+        manager.shutdown()
+
+    chunk_results.sort(key=lambda r: r['chunk_index'])
+    persons = stitch_tracks(chunk_results, chunks)
+
+    from modules.snapshots import snapshot_writer
+
+    violations_list = []
+    for person_id, group in enumerate(persons):
+        name, violation = _merge_person(group)
+        if violation is not None:
+            # Worker processes only write the files; the kept ones are indexed here
+            snapshot_writer.index(violation["image_path"], "database/violations", name,
+                                  track_id=person_id, status="VIOLATION")
+            violations_list.append({
+                "track_id": person_id,
+                "name": name,
+                "timestamp": violation["timestamp"],
+                "frame_number": violation["frame_number"],
+                "image_path": violation["image_path"],
+                "violation_type": "No ID Card"
+            })
+            if on_event:
+                on_event(name, violation["image_path"], person_id, "VIOLATION")
+
+    yield {
+        "status": "complete",
+        "total_frames_processed": sum(r['frames_processed'] for r in chunk_results),
+        "violations_detected": len(violations_list),
+        "violations": violations_list,
+        "mode": "parallel",
+        "chunks": len(chunks),
+        "persons": len(persons),
+        "elapsed": round(time.time() - start_time, 2),
+    }
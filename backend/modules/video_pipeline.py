@@ -0,0 +1,341 @@
+"""
+Pipelined video analysis.
+
+Decoding, inference and post-processing (tracking, face ID, snapshots, DB)
+run as separate stages connected by bounded queues, so decode and I/O overlap
+with inference instead of running serially in one loop. A full queue blocks
+the stage before it (backpressure), which keeps memory bounded.
+"""
+import time
+import queue
+import threading
+
+import cv2
+
+from modules.model_onnx import inference_lock
+from modules.nms import split_by_class
+from modules.snapshots import snapshot_writer
+from modules.persistence import BACKPRESSURE_TIMEOUT
+from modules.utils import snapshot_parts
+
+FRAME_STEP = 8   # Process every 8th frame
+QUEUE_SIZE = 8   # Frames buffered between two stages
+SEGMENT_SECONDS = 60  # Checkpoint granularity for resumable jobs
+
+_DONE = object()  # End-of-stream marker passed down the queues
+
+
+class StageTimer:
+    """Accumulates busy / blocked time for one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy = 0.0      # Time spent doing the stage's own work
+        self.blocked = 0.0   # Time spent waiting on a full output queue (backpressure)
+        self.starved = 0.0   # Time spent waiting on an empty input queue
+
+    def summary(self):
+        return {
+            "items": self.items,
+            "busy_s": round(self.busy, 3),
+            "blocked_s": round(self.blocked, 3),
+            "starved_s": round(self.starved, 3),
+            "avg_ms": round(self.busy / self.items * 1000, 2) if self.items else 0.0,
+        }
+
+
+class VideoPipeline:
+    def __init__(self, video_path, model, tracker, face_ident, log_event=None,
+                 frame_step=FRAME_STEP, queue_size=QUEUE_SIZE, conf=0.4,
+                 on_checkpoint=None, resume=None, capture=None):
+        """
+        tracker is a ComplianceTracker owned by this job; the model is shared
+        and called under inference_lock.
+
+        log_event(person_name, image_path, track_id, status) is called from the
+        post-processing stage for every new violation; with
+        on_checkpoint set, a segment's events are emitted just before its checkpoint.
+
+        on_checkpoint(segment_index, state) is called each time a segment of
+        SEGMENT_SECONDS has been fully processed; passing that state back as
+        `resume` continues the job from the end of that segment.
+
+        capture replaces cv2.VideoCapture(video_path), e.g. with a reader over
+        an upload that is still in progress.
+        """
+        self.video_path = video_path
+        self.model = model
+        self.tracker = tracker
+        self.face_ident = face_ident
+        self.log_event = log_event
+        self.frame_step = frame_step
+        self.conf = conf
+        self.on_checkpoint = on_checkpoint
+        self.resume = resume
+        self.capture = capture
+
+        self.decoded_q = queue.Queue(maxsize=queue_size)
+        self.inferred_q = queue.Queue(maxsize=queue_size)
+        self.events_q = queue.Queue()
+
+        self.stop_event = threading.Event()
+        self.errors = []
+        self.timers = {name: StageTimer(name) for name in ("decode", "infer", "post")}
+
+        self.fps = 0
+        self.total_frames = 0
+        self.analyzed_frames = 0
+        self.segment_frames = 0
+        self.start_frame = 0
+        self.violations_data = {}
+        if resume:
+            # JSON turned the track id keys into strings
+            self.start_frame = resume["next_frame"]
+            self.violations_data = {int(k): v for k, v in resume["violations"].items()}
+
+    # ------------------------------------------
+    # Queue helpers (stop-aware, timed)
+    # ------------------------------------------
+    def _put(self, q, item, timer):
+        start = time.perf_counter()
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.2)
+                break
+            except queue.Full:
+                continue
+        timer.blocked += time.perf_counter() - start
+
+    def _get(self, q, timer):
+        start = time.perf_counter()
+        while not self.stop_event.is_set():
+            try:
+                item = q.get(timeout=0.2)
+                timer.starved += time.perf_counter() - start
+                return item
+            except queue.Empty:
+                continue
+        timer.starved += time.perf_counter() - start
+        return _DONE
+
+    def _run_stage(self, target):
+        try:
+            target()
+        except Exception as e:
+            print(f"[ERROR] Video pipeline stage failed: {e}")
+            self.errors.append(e)
+            self.stop_event.set()
+
+    # ------------------------------------------
+    # Stages
+    # ------------------------------------------
+    def _decode_stage(self, cap):
+        timer = self.timers["decode"]
+        frame_idx = self.start_frame
+        if frame_idx:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+        try:
+            while not self.stop_event.is_set():
+                start = time.perf_counter()
+                # Skipped frames are only grabbed, not converted to BGR
+                if (frame_idx + 1) % self.frame_step != 0:
+                    ok = cap.grab()
+                    timer.busy += time.perf_counter() - start
+                    if not ok:
+                        break
+                    frame_idx += 1
+                    continue
+
+                ret, frame = cap.read()
+                timer.busy += time.perf_counter() - start
+                if not ret:
+                    break
+                timer.items += 1
+                self._put(self.decoded_q, (frame_idx, frame), timer)
+                frame_idx += 1
+        finally:
+            self.analyzed_frames = frame_idx
+            self._put(self.decoded_q, _DONE, timer)
+
+    def _infer_stage(self):
+        timer = self.timers["infer"]
+        while True:
+            item = self._get(self.decoded_q, timer)
+            if item is _DONE:
+                break
+            frame_idx, frame = item
+
+            start = time.perf_counter()
+            with inference_lock:
+                results = self.model.predict(frame, conf=self.conf, verbose=False, task='detect')
+
+            person_tracks_raw, id_card_boxes = split_by_class(results[0] if results else None)
+            timer.busy += time.perf_counter() - start
+            timer.items += 1
+
+            self._put(self.inferred_q, (frame_idx, frame, person_tracks_raw, id_card_boxes), timer)
+        self._put(self.inferred_q, _DONE, timer)
+
+    def _flush_events(self, pending):
+        """Queues the snapshots and DB rows held back for the current segment."""
+        for parts, output_dir, track_id, status, record in pending:
+            # Offline job: wait for queue space rather than lose the image
+            record["image_path"] = snapshot_writer.submit_parts(parts, record["name"], output_dir,
+                                                                timeout=BACKPRESSURE_TIMEOUT,
+                                                                track_id=track_id, status=status)
+            if self.log_event:
+                self.log_event(record["name"], record["image_path"], track_id, status)
+        pending.clear()
+
+    def _post_stage(self):
+        from modules.tracker_simple import SimpleTracker
+
+        timer = self.timers["post"]
+        person_tracker = SimpleTracker()
+        start_time = time.time()
+        current_segment = None
+        if self.resume:
+            # Keep new track ids clear of the ones already in the results
+            person_tracker.next_id = self.resume["next_track_id"]
+
+        # Resumable jobs hold a segment's snapshots and DB rows back until its
+        # checkpoint, so a segment redone after a crash is not logged twice.
+        # Only the snapshot parts are kept, not whole frames.
+        pending = []
+
+        while True:
+            entry = self._get(self.inferred_q, timer)
+            if entry is _DONE:
+                # Stopped early: the open segment is redone on resume
+                if not self.stop_event.is_set():
+                    self._flush_events(pending)
+                break
+            frame_idx, frame, person_tracks_raw, id_card_boxes = entry
+
+            if self.segment_frames:
+                segment = frame_idx // self.segment_frames
+                if current_segment is not None and segment > current_segment and self.on_checkpoint:
+                    # Everything before this frame is done
+                    self._flush_events(pending)
+                    self.on_checkpoint(segment - 1, {
+                        "next_frame": segment * self.segment_frames,
+                        "next_track_id": person_tracker.next_id,
+                        "violations": self.violations_data,
+                    })
+                current_segment = segment
+
+            start = time.perf_counter()
+            seconds = frame_idx / self.fps if self.fps > 0 else 0
+
+            if person_tracks_raw or id_card_boxes:
+                person_tracks = person_tracker.update(person_tracks_raw)
+                display_data = self.tracker.update(frame, person_tracks, id_card_boxes)
+
+                for item in display_data:
+                    track_id = item['id']
+                    bbox = item['bbox']
+                    if "VIOLATION" in item['status']:
+                        if track_id in self.violations_data:
+                            continue
+                        person_name = item.get('name', 'Unknown')
+                        if person_name == 'Unknown' or person_name == '':
+                            person_name = self.face_ident.identify(frame, bbox)
+
+                        record = self.violations_data[track_id] = {
+                            "name": person_name,
+                            "bbox": bbox,
+                            "frame_number": frame_idx + 1,
+                            "timestamp": round(seconds, 2),
+                            "image_path": None,
+                            "violation_type": "No ID Card"
+                        }
+                        pending.append((snapshot_parts(frame, bbox), "database/violations", track_id, "VIOLATION", record))
+
+                if not self.on_checkpoint:
+                    self._flush_events(pending)
+
+            timer.busy += time.perf_counter() - start
+            timer.items += 1
+
+            # Progress Calculation
+            elapsed = time.time() - start_time
+            progress = (frame_idx + 1) / self.total_frames if self.total_frames > 0 else 0
+            # ETA only over the part processed in this run (resumed jobs skip ahead)
+            remaining = self.total_frames - self.start_frame
+            run_progress = (frame_idx + 1 - self.start_frame) / remaining if remaining > 0 else 0
+            if run_progress > 0.01:
+                time_left_str = f"{int(elapsed / run_progress - elapsed)}s"
+            else:
+                time_left_str = "Calculating..."
+
+            self.events_q.put({
+                "status": "processing",
+                "progress": round(min(progress, 1.0) * 100, 1),
+                "time_left": time_left_str
+            })
+
+    # ------------------------------------------
+    # Driver
+    # ------------------------------------------
+    def run(self):
+        """
+        Generator: starts the stages and yields progress dicts, then the final result.
+        Closing the generator early stops all stages.
+        """
+        cap = self.capture or cv2.VideoCapture(self.video_path)
+        self.fps = cap.get(cv2.CAP_PROP_FPS)
+        self.total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        # Segment boundaries fall on sampled frames
+        segment = int(self.fps * SEGMENT_SECONDS) if self.fps > 0 else 0
+        self.segment_frames = max(self.frame_step, segment - segment % self.frame_step)
+        start_time = time.time()
+
+        threads = [
+            threading.Thread(target=self._run_stage, args=(lambda: self._decode_stage(cap),), daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._infer_stage,), daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._post_stage,), daemon=True),
+        ]
+        for t in threads:
+            t.start()
+        post_thread = threads[-1]
+
+        try:
+            while True:
+                try:
+                    yield self.events_q.get(timeout=0.2)
+                except queue.Empty:
+                    if not post_thread.is_alive():
+                        break
+            # Flush events emitted right before the post stage exited
+            while not self.events_q.empty():
+                yield self.events_q.get_nowait()
+        finally:
+            self.stop_event.set()
+            for t in threads:
+                t.join()
+            cap.release()
+
+        if self.errors:
+            raise self.errors[0]
+
+        violations_list = [
+            {
+                "track_id": track_id,
+                "name": data["name"],
+                "timestamp": data["timestamp"],
+                "frame_number": data["frame_number"],
+                "image_path": data["image_path"],
+                "violation_type": data["violation_type"]
+            }
+            for track_id, data in self.violations_data.items()
+        ]
+
+        yield {
+            "status": "complete",
+            "total_frames_processed": self.analyzed_frames,
+            "violations_detected": len(violations_list),
+            "violations": violations_list,
+            "elapsed": round(time.time() - start_time, 2),
+            "stage_timings": {name: timer.summary() for name, timer in self.timers.items()},
+        }
@@ -1,34 +1,58 @@
 
-from fastapi import FastAPI, BackgroundTasks, UploadFile, File, WebSocket, Depends, HTTPException, status
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, BackgroundTasks, UploadFile, File, WebSocket, WebSocketDisconnect, Depends, HTTPException, status, Request, Header, Query
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 import cv2
 import numpy as np
-import shutil
 import os
 import io
 import time
 import json
-from datetime import datetime, timedelta
+import asyncio
+import threading
+import base64
+import hashlib
+from datetime import date, datetime, timedelta
+from typing import Optional
+from pydantic import BaseModel
 
 # Import Modules
 from modules.face_ident import FaceIdentifier
 from modules.tracker import ComplianceTracker
-from modules.live_feed import generate_frames
-from ultralytics import YOLO
+from modules.camera_hub import CameraHub, CAMERA_CONFIG, DEFAULT_TARGET_FPS, FAIRNESS_MODES, read_config, scheduler_settings
+from modules.model_onnx import load_detector
+from modules.ingest import decode_reduced, decode_frames, split_length_prefixed, PayloadError, MAX_BATCH_FRAMES
+from modules.inference_scheduler import InferenceScheduler
+from modules.encoding import (
+    negotiate, parse_fields, select_fields, encoded_response, encode_stream, stream_media_type,
+    JSON, DETECTION_FIELDS
+)
+from modules.video_parallel import analyze_video_parallel
+from modules.video_pipeline import VideoPipeline, FRAME_STEP
+from modules.result_cache import store_upload, make_cache_key, open_job, wait_for_job
+from modules.uploads import UploadStore, ChunkError, GrowingVideoCapture
+from modules.persistence import persistence, BACKPRESSURE_TIMEOUT
+from modules.utils import thumbnail_path
+from modules.snapshots import snapshot_writer, backfill_index, VIOLATIONS_DIR, VERIFIED_DIR
+from modules.metrics import metrics
+from modules.retention import retention, read_archive, list_archives, enable_incremental_vacuum
+from modules.stats import StatsCache, read_totals, read_rollups, backfill_counters, backfill_rollups
+from modules.load_shedding import LatencyBudget, DEFAULT_BUDGET_MS, SHED_FACE_ID, SHED_RESOLUTION, REDUCED_DETECT_WIDTH
 
 # Import DB & Auth
-from database_config import create_db_and_tables, get_session, Session, User, ViolationLog
+from database_config import create_db_and_tables, get_session, get_read_session, read_engine, Session, User, ViolationLog, SnapshotImage, EventRollup
 from auth import (
     ACCESS_TOKEN_EXPIRE_MINUTES, 
     create_access_token, 
     get_current_user, 
     verify_password, 
-    get_password_hash
+    get_password_hash,
+    invalidate_user
 )
-from sqlmodel import select
+from sqlmodel import select, func, or_, and_
 
 app = FastAPI(title="ID Card Compliance API V3")
 
@@ -62,34 +86,64 @@ app.mount("/verified", StaticFiles(directory=verified_dir), name="verified")
 face_ident = None
 tracker = None
 model = None
-TOTAL_DETECTIONS = 0  # Simple in-memory counter for demo
+camera_hub = None
+stats_cache = StatsCache()
+upload_store = UploadStore()
+detect_budget = LatencyBudget("detect")
+detect_streams = None  # Created with the models
+inference_scheduler = None
+tracker_lock = threading.Lock()  # Guards the stateless /detect tracker
 
 @app.on_event("startup")
 async def startup_event():
-    global face_ident, tracker, model
+    global face_ident, tracker, model, camera_hub, detect_streams, inference_scheduler
     print("[INFO] Creating Database Tables...")
     create_db_and_tables()
+    backfill_index([(VIOLATIONS_DIR, "VIOLATION"), (VERIFIED_DIR, "VERIFIED")])
+    backfill_counters()
+    backfill_rollups()
+    enable_incremental_vacuum()  # Before the writers open their connections
+    persistence.start()
+    snapshot_writer.start()
+    retention.start()
     
     print("[INFO] Loading Models (ONNX)...")
     face_ident = FaceIdentifier()
     print("[INFO] InsightFace initialized")
     tracker = ComplianceTracker(face_ident) 
+    detect_streams = DetectStreams()
     
-    # Try standard YOLOv8
-    try:
-        model = YOLO("idcard.onnx", task="detect")
-        # Test it
-        _ = model(np.zeros((640,640,3), dtype=np.uint8))
-        print("[INFO] Standard YOLOv8 ONNX loaded.")
-    except Exception:
-        print("[WARNING] Standard YOLOv8 failed. Using fallback ONNX wrapper.")
-        from modules.model_onnx import YOLOv8ONNX
-        model = YOLOv8ONNX("idcard.onnx")
+    # Try standard YOLOv8, fall back to the raw ONNX wrapper
+    model = load_detector("idcard.onnx")
+    inference_scheduler = InferenceScheduler(model)
+    inference_scheduler.start()
+    # Scheduler fairness / max_batch: cameras.json, then CAMERA_FAIRNESS / CAMERA_MAX_BATCH, then defaults
+    if os.path.exists(CAMERA_CONFIG):
+        settings, cameras = read_config(CAMERA_CONFIG)
+    else:
+        settings, cameras = scheduler_settings(), None
+    camera_hub = CameraHub(model, face_ident, persistence.log_event, persistence.count_detections, **settings)
+    if cameras is not None:
+        camera_hub.add_cameras(cameras)
+    else:
+        camera_hub.add("0", 0)  # Default webcam
 
     print("[INFO] ONNX model loaded successfully")
     print("[INFO] YOLO task set to detect")
     print("[INFO] Application ready")
 
+@app.on_event("shutdown")
+def shutdown_event():
+    # Write out everything still queued before the process exits
+    if camera_hub:
+        camera_hub.stop_all()
+    if inference_scheduler:
+        inference_scheduler.stop()
+    retention.stop()
+    print("[INFO] Flushing pending snapshots and DB writes...")
+    snapshot_writer.stop()
+    persistence.stop()
+
 # --- Authentication Endpoints ---
 
 @app.post("/token")
@@ -97,7 +151,8 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     statement = select(User).where(User.username == form_data.username)
     user = session.exec(statement).first()
     
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    # bcrypt is deliberately slow; keep it off the event loop
+    if not user or not await run_in_threadpool(verify_password, form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -115,10 +170,11 @@ async def register_user(user_data: User, session: Session = Depends(get_session)
         raise HTTPException(status_code=400, detail="Username already registered")
     
     # Hash password
-    user_data.hashed_password = get_password_hash(user_data.hashed_password)
+    user_data.hashed_password = await run_in_threadpool(get_password_hash, user_data.hashed_password)
     session.add(user_data)
     session.commit()
     session.refresh(user_data)
+    invalidate_user(user_data.username)
     return {"message": "User registered successfully"}
 
 # --- Protected Endpoints ---
@@ -131,63 +187,187 @@ async def read_users_me(current_user: User = Depends(get_current_user)):
 def read_root():
     return {"status": "Online", "service": "ID Card Compliance v3.0", "port": 8081}
 
-@app.get("/stats")
-async def get_stats(session: Session = Depends(get_session)):
-    """
-    Returns dashboard statistics.
-    """
-    global TOTAL_DETECTIONS
-    
-    # Count violations in DB
-    statement = select(ViolationLog)
-    results = session.exec(statement).all()
-    violation_count = len(results)
-    
+def compute_stats():
+    with Session(read_engine) as session:
+        totals = read_totals(session)
+    detections = totals["detections"]
+    violation_count = totals["violations"]
+
     # Compliance Rate calculation
-    if TOTAL_DETECTIONS > 0:
-        rate = ((TOTAL_DETECTIONS - violation_count) / TOTAL_DETECTIONS) * 100
+    if detections > 0:
+        rate = ((detections - violation_count) / detections) * 100
         rate = max(0, min(100, rate))
     else:
         rate = 100.0
 
     return {
-        "total_detections": TOTAL_DETECTIONS,
+        "total_detections": detections,
         "compliance_rate": f"{rate:.1f}%",
         "violations": violation_count,
-        "active_cameras": 1
+        "verified": totals["verified"],
+        "frames_with_people": totals["frames"],
     }
 
+@app.get("/stats")
+async def get_stats():
+    """
+    Returns dashboard statistics, from the persistent counters (see modules/stats.py).
+    """
+    stats = stats_cache.get("totals", compute_stats)
+    return dict(stats, active_cameras=camera_hub.active_count() if camera_hub else 0)
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Internal pipeline metrics (queue depths, batch sizes, timings).
+    """
+    return metrics.snapshot()
+
+def public_image_path(path):
+    """database/violations/... -> violations/..., the URL path of the static mounts."""
+    path = path.replace("\\", "/")
+    return path[len("database/"):] if path.startswith("database/") else path
+
 @app.get("/all_violation_images")
-async def get_all_violation_images():
-    """
-    Returns a list of all image files in the violations directory.
-    """
-    files = []
-    if os.path.exists(violations_dir):
-        # Sort by creation time (newest first)
-        all_files = [f for f in os.listdir(violations_dir) if f.endswith(('.jpg', '.jpeg', '.png'))]
-        all_files.sort(key=lambda x: os.path.getmtime(os.path.join(violations_dir, x)), reverse=True)
-        
-        for filename in all_files:
-            file_path = os.path.join(violations_dir, filename)
-            mtime = os.path.getmtime(file_path)
-            files.append({
-                "filename": filename,
-                "image_path": f"violations/{filename}",
-                "timestamp": datetime.fromtimestamp(mtime).isoformat(),
-                "status": "VIOLATION" if "Unknown" in filename else "IDENTIFIED"
-            })
-    return files
+async def get_all_violation_images(session: Session = Depends(get_read_session)):
+    """
+    Returns all violation snapshots, newest first, from the snapshot index.
+    """
+    statement = (
+        select(SnapshotImage)
+        .where(SnapshotImage.directory == VIOLATIONS_DIR)
+        .order_by(SnapshotImage.timestamp.desc())
+    )
+    return [
+        {
+            "filename": os.path.basename(image.path),
+            "image_path": public_image_path(image.path),
+            "timestamp": image.timestamp.isoformat(),
+            "status": "VIOLATION" if image.person_name == "Unknown" else "IDENTIFIED"
+        }
+        for image in session.exec(statement).all()
+    ]
+
+GALLERY_PAGE_SIZE = 50
+GALLERY_MAX_PAGE_SIZE = 200
+
+def encode_cursor(log):
+    """Opaque keyset cursor: the (timestamp, id) of the last row of a page."""
+    return base64.urlsafe_b64encode(f"{log.timestamp.isoformat()}|{log.id}".encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        timestamp, log_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(timestamp), int(log_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/gallery")
+async def get_gallery(
+    status_filter: Optional[str] = Query(None, alias="status"),
+    name: Optional[str] = None,
+    camera_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(GALLERY_PAGE_SIZE, ge=1, le=GALLERY_MAX_PAGE_SIZE),
+    if_none_match: Optional[str] = Header(None),
+    session: Session = Depends(get_read_session)
+):
+    """
+    One page of logged events (newest first) with their images.
+    Pass next_cursor back as cursor for the following page. Pages carry an ETag;
+    a request with a matching If-None-Match gets 304 and no body.
+    """
+    statement = select(ViolationLog)
+    if status_filter:
+        statement = statement.where(ViolationLog.status == status_filter)
+    if name:
+        statement = statement.where(ViolationLog.person_name == name)
+    if camera_id:
+        statement = statement.where(ViolationLog.camera_id == camera_id)
+    if since:
+        statement = statement.where(ViolationLog.timestamp >= since)
+    if until:
+        statement = statement.where(ViolationLog.timestamp < until)
+    if cursor:
+        # Keyset: continue strictly after the last row of the previous page
+        timestamp, log_id = decode_cursor(cursor)
+        statement = statement.where(or_(
+            ViolationLog.timestamp < timestamp,
+            and_(ViolationLog.timestamp == timestamp, ViolationLog.id < log_id)
+        ))
+    statement = statement.order_by(ViolationLog.timestamp.desc(), ViolationLog.id.desc()).limit(limit + 1)
+    logs = session.exec(statement).all()
+
+    next_cursor = encode_cursor(logs[limit - 1]) if len(logs) > limit else None
+    logs = logs[:limit]
+    page = {
+        "items": [
+            {
+                "id": v.id,
+                "person_name": v.person_name,
+                "timestamp": v.timestamp.isoformat(),
+                "image_path": public_image_path(v.image_path) if v.image_path else None,
+                "thumbnail_path": public_image_path(thumbnail_path(v.image_path)) if v.image_path else None,
+                "track_id": v.track_id,
+                "status": v.status,
+                "camera_id": v.camera_id
+            }
+            for v in logs
+        ],
+        "next_cursor": next_cursor
+    }
+
+    # Rows are never edited (only added or expired), so the ids and cursor identify the page contents
+    etag = '"' + hashlib.sha1(json.dumps([[v.id for v in logs], next_cursor]).encode()).hexdigest() + '"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse(page, headers={"ETag": etag})
+
+@app.get("/archive")
+async def get_archives():
+    """
+    Months of violation logs moved out of the database by the retention service.
+    """
+    return await run_in_threadpool(list_archives)
+
+@app.get("/archive/{month}")
+async def get_archive(month: str, status_filter: Optional[str] = Query(None, alias="status"), name: Optional[str] = None):
+    """
+    Archived rows of one month (YYYY-MM) as NDJSON, optionally filtered by status / name.
+    """
+    try:
+        datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="month must be YYYY-MM")
+    rows = (json.dumps(row) + "\n" for row in read_archive(month, status_filter, name))
+    return StreamingResponse(rows, media_type="application/x-ndjson")
+
+VERIFIED_FIELDS = ("id", "person_name", "timestamp", "image_path", "track_id", "status")
+
+def fields_or_400(fields, allowed):
+    """Parsed ?fields= value (see modules.encoding), as a 400 error if it names unknown fields."""
+    try:
+        return parse_fields(fields, allowed)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
 @app.get("/verified_list")
-async def get_verified_list(session: Session = Depends(get_session)):
+async def get_verified_list(
+    fields: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    session: Session = Depends(get_read_session)
+):
     """
     Returns list of all verified logs with details.
+    fields=a,b limits each row to those keys; Accept: application/msgpack selects MessagePack.
     """
+    selected = fields_or_400(fields, VERIFIED_FIELDS)
     statement = select(ViolationLog).where(ViolationLog.status == "VERIFIED").order_by(ViolationLog.timestamp.desc())
     logs = session.exec(statement).all()
     
-    return [
+    rows = [
         {
             "id": v.id,
             "person_name": v.person_name,
@@ -198,362 +378,569 @@ async def get_verified_list(session: Session = Depends(get_session)):
         }
         for v in logs
     ]
+    return encoded_response(select_fields(rows, selected), negotiate(accept))
 
 @app.post("/detect")
 async def detect_frame(
     file: UploadFile = File(...),
+    fields: Optional[str] = None,
+    accept: Optional[str] = Header(None),
     # current_user: User = Depends(get_current_user) # Uncomment to enforce auth strictly
 ):
     """
     Receives an image file, runs detection, and returns bounding boxes.
+    fields=bbox,name limits each detection to those keys; Accept: application/msgpack
+    returns MessagePack with the boxes packed as float32 (see modules.encoding).
     """
-    global model, tracker, TOTAL_DETECTIONS
+    global model, tracker
     
+    selected = fields_or_400(fields, DETECTION_FIELDS)
+    media_type = negotiate(accept)
+    start = time.perf_counter()
+    if detect_budget.should_drop():
+        raise HTTPException(status_code=503, detail="Overloaded, frame dropped", headers={"Retry-After": "1"})
+
     contents = await file.read()
-    nparr = np.frombuffer(contents, np.uint8)
-    frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+    # Decoded only as large as the detector needs; the full frame only for snapshots
+    detect_w = REDUCED_DETECT_WIDTH if detect_budget.sheds(SHED_RESOLUTION) else 640
+    frame = await run_in_threadpool(decode_reduced, contents, detect_w)
 
     if frame is None:
-        return {"error": "Invalid image"}
+        return encoded_response({"error": "Invalid image"}, media_type)
 
     # --- Detection Logic ---
-    # Use stricter parameters to reduce duplicate detections
-    results = model.predict(
-        frame, 
-        conf=0.5,  # Increased confidence threshold
-        iou=0.4,   # Lower IoU = more aggressive NMS
-        agnostic_nms=True, 
-        verbose=False, 
-        task='detect',
-        max_det=10  # Limit max detections
-    )
-    
-    person_tracks = []
-    id_card_boxes = []
-
-    if results and results[0].boxes:
-        for i, box in enumerate(results[0].boxes):
-            cls = int(box.cls[0])
-            coords = box.xyxy[0].cpu().numpy().tolist()
-            
-            if cls == 1: 
-                # Use enumeration index as mock track ID for stateless call
-                person_tracks.append(coords + [i]) 
-            elif cls == 0: 
-                id_card_boxes.append(coords)
-
-    # Clean up overlapping person boxes
-    from modules.utils import perform_nms
-    # Extract just the coords for NMS
-    if person_tracks:
-        p_coords = [p[:4] for p in person_tracks]
-        # p_indices = [p[4] for p in person_tracks] 
-        # NMS
-        clean_coords = perform_nms(p_coords, scores=None, iou_threshold=0.3)
-        # Reconstruct tracks with mock IDs (just use index)
-        person_tracks = [c + [idx] for idx, c in enumerate(clean_coords)]
-
-    if person_tracks:
-        TOTAL_DETECTIONS += 1
-
-    # Note: If we count persons, we get huge numbers fast. 
-    # Let's count "Frames Processed with People"? 
-    # Or just increment by 1 per request if persons found.
-    # User calls it "Total Detections", I'll count Persons.
+    # Batched with concurrent requests by the inference scheduler
+    detections = await inference_scheduler.detect(frame.image, detect_w)
 
     # --- Tracker Update ---
-    # This might add to ViolationLog DB if violation persists.
-    # Tracker needs session to modify DB? 
-    # Currently tracker.py seems isolated. 
-    # For MVP, we'll assume tracker updates DB or we do it here.
-    # Checking tracker.py source would be good, but I'll trust it returns status.
-    
-    display_data = tracker.update(frame, person_tracks, id_card_boxes)
+    result = (await run_in_threadpool(track_batch, [frame], [detections], None,
+                                      not detect_budget.sheds(SHED_FACE_ID)))[0]
+
+    result["detections"] = select_fields(result["detections"], selected)
 
-    # DB Logging Hack (if tracker doesn't do it)
-    # We should probably pass 'session' to tracker, but let's do a quick check here:
-    # Actually, let's leave DB logging to the tracker if it does it, or add it if missing.
-    # Since I didn't verify tracker.py DB logic, I will assume it's missing or I should fix it later.
-    # For now, let's just make sure stats endpoint works.
+    detect_budget.observe((time.perf_counter() - start) * 1000)
+    return encoded_response(result, media_type)
 
-    # Serialize & Normalize
-    height, width = frame.shape[:2]
+def format_detections(display_data, frame_shape):
+    """Tracker output as JSON detections with boxes normalized to 0..1."""
+    height, width = frame_shape[:2]
     formatted_results = []
-    
     for item in display_data:
         x1, y1, x2, y2 = item['bbox']
-        nx1, ny1 = x1 / width, y1 / height
-        nx2, ny2 = x2 / width, y2 / height
-
         formatted_results.append({
-            "bbox": [nx1, ny1, nx2, ny2], 
+            "bbox": [x1 / width, y1 / height, x2 / width, y2 / height], 
             "status": item['status'],
             "color": item['color'],
             "name": item.get('name', 'Unknown')
         })
+    return formatted_results
+
+DETECT_STREAM_TTL = 120   # Seconds without a call before a stream's tracks are dropped
+MAX_DETECT_STREAMS = 64
+
+class DetectStream:
+    """Tracking state of one client stream on /detect/batch, so track ids carry over between calls."""
+
+    def __init__(self):
+        from modules.tracker_simple import SimpleTracker
+        self.person_tracker = SimpleTracker(max_disappeared=30, distance_threshold=100)
+        self.tracker = ComplianceTracker(face_ident)
+        self.lock = threading.Lock()  # Calls of one stream are tracked one at a time, in arrival order
+        self.last_used = time.time()
+
+class DetectStreams:
+    """Registry of DetectStreams; idle ones are dropped after DETECT_STREAM_TTL."""
+
+    def __init__(self, ttl=DETECT_STREAM_TTL, max_streams=MAX_DETECT_STREAMS):
+        self.ttl = ttl
+        self.max_streams = max_streams
+        self.streams = {}
+        self._lock = threading.Lock()
+
+    def get(self, stream_id):
+        now = time.time()
+        with self._lock:
+            for key in [k for k, s in self.streams.items() if now - s.last_used > self.ttl]:
+                del self.streams[key]
+            stream = self.streams.get(stream_id)
+            if stream is None:
+                if len(self.streams) >= self.max_streams:
+                    del self.streams[min(self.streams, key=lambda k: self.streams[k].last_used)]
+                stream = self.streams[stream_id] = DetectStream()
+            stream.last_used = now
+            return stream
+
+def track_batch(frames, detections, stream, identify_faces):
+    """
+    Runs the compliance tracker over a batch of DecodedFrames, in order. Without a stream
+    every frame is stateless (as on /detect); with one, tracks continue across calls.
+    Boxes are normalized by the decoded size, so they hold for the original frame too.
+    """
+    results = []
+    for source, (person_boxes, id_card_boxes) in zip(frames, detections):
+        frame = source.image
+        if stream is None:
+            # Use enumeration index as mock track ID for stateless call
+            person_tracks = [coords + [i] for i, coords in enumerate(person_boxes)]
+            if person_tracks:
+                persistence.count_frames()  # No tracks to count people by
+            with tracker_lock:  # Shared by all stateless calls, which now run in parallel
+                display_data = tracker.update(frame, person_tracks, id_card_boxes, identify_faces=identify_faces, source=source)
+        else:
+            person_tracks = stream.person_tracker.update(person_boxes)
+            new_people = sum(1 for t in person_tracks if int(t[4]) not in stream.tracker.people_state)
+            if new_people:
+                persistence.count_detections(new_people)
+            display_data = stream.tracker.update(frame, person_tracks, id_card_boxes, identify_faces=identify_faces, source=source)
+        results.append({
+            "detections": format_detections(display_data, frame.shape),
+            "person_count": len(person_tracks),
+            "id_card_count": len(id_card_boxes)
+        })
+    return results
+
+async def read_batch_payloads(request):
+    """Encoded frames of a /detect/batch request: multipart 'files' or a length-prefixed binary body."""
+    if request.headers.get("content-type", "").startswith("multipart/form-data"):
+        form = await request.form()
+        uploads = form.getlist("files")
+        if not uploads:
+            raise HTTPException(status_code=400, detail="No files in batch")
+        if len(uploads) > MAX_BATCH_FRAMES:
+            raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_FRAMES} frames per batch")
+        return [await upload.read() for upload in uploads]
+    try:
+        return split_length_prefixed(await request.body())
+    except PayloadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    return {
-        "detections": formatted_results,
-        "person_count": len(person_tracks),
-        "id_card_count": len(id_card_boxes)
-    }
+@app.post("/detect/batch")
+async def detect_batch_frames(request: Request, stream_id: Optional[str] = None, fields: Optional[str] = None):
+    """
+    Runs detection on several frames in one request and returns one result per frame, in order.
+    The body is either multipart with several 'files' parts, or application/octet-stream
+    holding each JPEG prefixed by its length (4-byte big-endian).
+    With stream_id, tracks (and violation timing) carry over between calls of that stream;
+    without it every frame is handled like a stateless /detect call.
+    fields and the Accept header select the response encoding as on /detect.
+    """
+    selected = fields_or_400(fields, DETECTION_FIELDS)
+    media_type = negotiate(request.headers.get("accept"))
+    start = time.perf_counter()
+    if detect_budget.should_drop():
+        raise HTTPException(status_code=503, detail="Overloaded, batch dropped", headers={"Retry-After": "1"})
+
+    payloads = await read_batch_payloads(request)
+    detect_w = REDUCED_DETECT_WIDTH if detect_budget.sheds(SHED_RESOLUTION) else 640
+    frames = await run_in_threadpool(decode_frames, payloads, detect_w)
+    valid = [i for i, frame in enumerate(frames) if frame is not None]
+    valid_frames = [frames[i] for i in valid]
+
+    detections = await asyncio.gather(*[inference_scheduler.detect(frame.image, detect_w) for frame in valid_frames])
+
+    stream = detect_streams.get(stream_id) if stream_id else None
+    identify_faces = not detect_budget.sheds(SHED_FACE_ID)
+    if stream is None:
+        tracked = await run_in_threadpool(track_batch, valid_frames, detections, None, identify_faces)
+    else:
+        def track_stream():
+            with stream.lock:
+                return track_batch(valid_frames, detections, stream, identify_faces)
+        tracked = await run_in_threadpool(track_stream)
+
+    results = [{"index": i, "error": "Invalid image"} for i in range(len(frames))]
+    for i, result in zip(valid, tracked):
+        results[i] = dict(result, index=i, detections=select_fields(result["detections"], selected))
+
+    # The budget is per frame
+    detect_budget.observe((time.perf_counter() - start) * 1000 / len(frames))
+    return encoded_response({"stream_id": stream_id, "frames": results}, media_type)
+
+def log_video_event(person_name, image_path, track_id, status_type):
+    """
+    Queues a video-analysis event; written in batches by the persistence thread.
+    Waits for queue space (offline jobs can afford to slow down); returns False if the row was dropped.
+    """
+    return persistence.log_event(person_name, image_path, track_id, status_type, timeout=BACKPRESSURE_TIMEOUT)
+
+class VideoEventLog:
+    """Per-job log_event callback that remembers whether any row was dropped."""
+
+    def __init__(self):
+        self.dropped = 0
+
+    def __call__(self, person_name, image_path, track_id, status_type):
+        if not log_video_event(person_name, image_path, track_id, status_type):
+            self.dropped += 1
+
+def finish_job(job, result, event_log):
+    """Stores the result, unless rows went missing; such a result must not be served from cache."""
+    if event_log.dropped:
+        print(f"[WARNING] {event_log.dropped} events dropped, analysis result not cached")
+        job.abandon()
+    else:
+        job.complete(result)
+
+DUPLICATE_WAIT_HEARTBEAT = 5  # Seconds between "queued" updates while the same video runs elsewhere
+
+def analysis_cache_key(content_hash, parallel):
+    mode = "parallel" if parallel else "pipeline"
+    return make_cache_key(content_hash, {"mode": mode, "frame_step": FRAME_STEP, "conf": 0.4})
+
+def stream_video_analysis(video_path, filename, content_hash, parallel=False, workers=None, cleanup=None,
+                          media_type=JSON):
+    """
+    Runs (or fetches from cache) the analysis of a video already on disk and
+    returns the NDJSON (or MessagePack, see modules.encoding) StreamingResponse.
+    cleanup() is called once the file is no longer needed.
+    """
+    cache_key = analysis_cache_key(content_hash, parallel)
+    job = open_job(cache_key, filename, content_hash)  # None if the same video is running right now
+
+    if job is not None and job.hit:
+        if cleanup:
+            cleanup()
+        cached_result = dict(job.result, filename=filename, cached=True)
+        return StreamingResponse(encode_stream([cached_result], media_type), media_type=stream_media_type(media_type))
+
+    def wait_for_running_job():
+        """
+        The same video is being analyzed by another request: waits for its result
+        instead of analyzing (and logging every event) a second time.
+        """
+        nonlocal job
+        try:
+            while job is None:
+                yield {"status": "queued", "detail": "The same video is already being analyzed"}
+                job = wait_for_job(cache_key, filename, content_hash, timeout=DUPLICATE_WAIT_HEARTBEAT)
+        except GeneratorExit:
+            if cleanup:
+                cleanup()
+            raise
+        if job.hit:
+            if cleanup:
+                cleanup()
+            yield dict(job.result, filename=filename, cached=True)
+        else:
+            # The other run failed (or was abandoned); this request does the work
+            yield from video_processor()
+
+    def video_processor():
+        global model, face_ident
+
+        event_log = VideoEventLog()
+        if parallel:
+            updates = analyze_video_parallel(
+                video_path, workers,
+                on_event=event_log,
+                completed_chunks=job.segments,
+                on_chunk_done=job.save_segment
+            )
+        else:
+            # Decode -> inference -> post-processing run as overlapping stages
+            resume = None
+            if job.segments:
+                resume = job.segments[max(job.segments)]
+            pipeline = VideoPipeline(
+                video_path, model, ComplianceTracker(face_ident, save_snapshots=False), face_ident,
+                log_event=event_log,
+                on_checkpoint=job.save_segment,
+                resume=resume
+            )
+            updates = pipeline.run()
+
+        try:
+            for update in updates:
+                if update["status"] == "complete":
+                    finish_job(job, update, event_log)
+                    update["filename"] = filename
+                yield update
+        finally:
+            job.release()
+            if cleanup:
+                cleanup()
+
+    updates = wait_for_running_job() if job is None else video_processor()
+    return StreamingResponse(encode_stream(updates, media_type), media_type=stream_media_type(media_type))
 
 @app.post("/analyze_video")
 async def analyze_video(
     file: UploadFile = File(...),
-    session: Session = Depends(get_session)
+    parallel: bool = False,
+    workers: Optional[int] = None,
+    accept: Optional[str] = Header(None)
 ):
     """
     Streaming endpoint: Upload video, process, yield progress updates, and return final result.
-    Format: Newline Delimited JSON (NDJSON).
-    """
-    # Save Temp File
-    temp_filename = f"temp_{file.filename}"
-    with open(temp_filename, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-
-    async def video_processor():
-        global model, tracker, face_ident
-        
-        cap = cv2.VideoCapture(temp_filename)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        
-        violations_data = {}
-        verified_data = {} # Track verified persons
-        analyzed_frames = 0
-        frame_step = 8 # Process every 8th frame
-        
-        start_time = time.time()
-        
-        try:
-            while cap.isOpened():
-                ret, frame = cap.read()
-                if not ret:
-                    break
-                    
-                analyzed_frames += 1
-                if analyzed_frames % frame_step != 0:
-                    continue
-                    
-                # Progress Calculation
-                current_time = time.time()
-                elapsed = current_time - start_time
-                progress = analyzed_frames / total_frames if total_frames > 0 else 0
-                
-                # Estimate Time Left
-                if progress > 0.01:
-                    total_estimated_time = elapsed / progress
-                    time_left = total_estimated_time - elapsed
-                    time_left_str = f"{int(time_left)}s"
-                else:
-                    time_left_str = "Calculating..."
-
-                # Yield Progress
-                yield json.dumps({
-                    "status": "processing",
-                    "progress": round(progress * 100, 1),
-                    "time_left": time_left_str
-                }) + "\n"
-                
-                # --- Detection Logic ---
-                from modules.tracker_simple import SimpleTracker
-                if not hasattr(video_processor, 'person_tracker'):
-                    video_processor.person_tracker = SimpleTracker()
-
-                # results = model.track(frame, persist=True, verbose=False, conf=0.4)
-                results = model.predict(frame, conf=0.4, verbose=False, task='detect')
-                
-                if results and results[0].boxes:
-                    person_tracks_raw = []
-                    id_card_boxes = []
-                    for box in results[0].boxes:
-                        cls = int(box.cls[0])
-                        coords = box.xyxy[0].cpu().numpy().tolist()
-                        if cls == 1:
-                             person_tracks_raw.append(coords)
-                        elif cls == 0:
-                             id_card_boxes.append(coords)
-                    
-                    person_tracks = video_processor.person_tracker.update(person_tracks_raw)
-                    
-                    display_data = tracker.update(frame, person_tracks, id_card_boxes)
-                    
-                    for item in display_data:
-                        if "VIOLATION" in item['status']:
-                            track_id = item['id']
-                            if track_id not in violations_data:
-                                person_name = item.get('name', 'Unknown')
-                                bbox = item['bbox']
-                                if person_name == 'Unknown' or person_name == '':
-                                    person_name = face_ident.identify(frame, bbox)
-                                from modules.utils import save_violation
-                                image_path = save_violation(frame, person_name, bbox)
-                                
-                                seconds = (analyzed_frames * frame_step) / fps if fps > 0 else 0
-                                violations_data[track_id] = {
-                                    "name": person_name,
-                                    "bbox": bbox,
-                                    "frame_number": analyzed_frames,
-                                    "timestamp": round(seconds, 2),
-                                    "image_path": image_path,
-                                    "violation_type": "No ID Card"
-                                }
-                                violation_log = ViolationLog(
-                                    person_name=person_name,
-                                    image_path=image_path,
-                                    track_id=track_id, 
-                                    status="VIOLATION"
-                                )
-                                session.add(violation_log)
-                                session.commit()
-                        elif item['status'] == "VERIFIED":
-                            # Logic for VERIFIED
-                            track_id = item['id']
-                            # Only save connection valid persons whom we haven't logged yet in this session
-                            # Optimization: Maybe we only want to save if they were NEVER a violation?
-                            # For now, let's save them if we haven't seen them as verified yet.
-                            if track_id not in verified_data:
-                                person_name = item.get('name', 'Unknown')
-                                bbox = item['bbox']
-                                if person_name == 'Unknown' or person_name == '':
-                                    continue # Skip unknown verified for now if needed, or identify? 
-                                    # If they are verified, tracker usually knows the name or ID.
-                                
-                                from modules.utils import save_snapshot
-                                image_path = save_snapshot(frame, person_name, bbox, "database/verified")
-                                
-                                seconds = (analyzed_frames * frame_step) / fps if fps > 0 else 0
-                                verified_data[track_id] = {
-                                    "name": person_name,
-                                    "bbox": bbox,
-                                    "frame_number": analyzed_frames,
-                                    "timestamp": round(seconds, 2),
-                                    "image_path": image_path,
-                                    "status": "VERIFIED"
-                                }
-                                
-                                log_entry = ViolationLog(
-                                    person_name=person_name,
-                                    image_path=image_path,
-                                    track_id=track_id, 
-                                    status="VERIFIED"
-                                )
-                                session.add(log_entry)
-                                session.commit()
-                
-                # Small sleep to yield control back to event loop if needed
-                # await asyncio.sleep(0) # Not strictly detecting async here but good practice
+    Format: Newline Delimited JSON (NDJSON), or MessagePack objects with Accept: application/msgpack.
+    With parallel=true the video is split into time ranges analyzed by separate worker processes.
+    Results are cached by content hash, so re-uploading the same recording returns immediately.
+    """
+    # Save under a unique temp name, hashing the bytes on the way (off the event loop)
+    temp_filename, content_hash = await run_in_threadpool(store_upload, file.file, file.filename)
+    return stream_video_analysis(
+        temp_filename, file.filename, content_hash, parallel, workers,
+        cleanup=lambda: os.remove(temp_filename),
+        media_type=negotiate(accept)
+    )
+
+# --- Chunked / Resumable Uploads ---
 
+class UploadInit(BaseModel):
+    filename: str
+    total_size: Optional[int] = None
+    chunk_size: Optional[int] = None
+
+def get_upload_or_404(upload_id):
+    upload = upload_store.get(upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return upload
+
+@app.post("/uploads")
+async def init_upload(body: UploadInit):
+    """
+    Starts a chunked upload. Send chunks with PUT /uploads/{id}/chunks/{index}
+    (raw body, X-Chunk-SHA256 header), then POST /uploads/{id}/finalize.
+    """
+    upload = await run_in_threadpool(upload_store.create, body.filename, body.total_size, body.chunk_size)
+    return upload.status()
+
+@app.get("/uploads/{upload_id}")
+async def get_upload_status(upload_id: str):
+    """Lists received / missing chunks so an interrupted client can resume."""
+    return get_upload_or_404(upload_id).status()
+
+@app.put("/uploads/{upload_id}/chunks/{index}")
+async def put_upload_chunk(
+    upload_id: str,
+    index: int,
+    request: Request,
+    x_chunk_sha256: Optional[str] = Header(None)
+):
+    upload = get_upload_or_404(upload_id)
+    if not x_chunk_sha256:
+        raise HTTPException(status_code=400, detail="X-Chunk-SHA256 header is required")
+    data = await request.body()
+    try:
+        await run_in_threadpool(upload.write_chunk, index, data, x_chunk_sha256)
+    except ChunkError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "index": index,
+        "received_chunks": len(upload.received),
+        "contiguous_bytes": upload.contiguous_bytes
+    }
+
+def release_upload(upload):
+    """Drops one reader of an upload; its files are deleted once it is finalized and nobody reads it."""
+    upload.remove_reader()
+    if upload.finalized and not upload.has_readers():
+        upload_store.discard(upload.upload_id)
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, analyze: bool = True, parallel: bool = False, workers: Optional[int] = None,
+                          accept: Optional[str] = Header(None)):
+    """
+    Verifies the upload is complete and fixes its content hash.
+    With analyze=true (default) streams the analysis as NDJSON, like /analyze_video.
+    """
+    upload = get_upload_or_404(upload_id)
+    if analyze and upload.has_readers():
+        raise HTTPException(status_code=409, detail="A live analysis is still reading this upload")
+    try:
+        content_hash = await run_in_threadpool(upload.finalize)
+    except ChunkError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if not analyze:
+        status_info = upload.status()
+        if upload.analyzed_live and not upload.has_readers():
+            # Analyzed (and cached) while arriving; nothing will read the file again
+            await run_in_threadpool(upload_store.discard, upload_id)
+        return status_info
+
+    upload.add_reader()
+    return stream_video_analysis(
+        upload.data_path, upload.filename, content_hash, parallel, workers,
+        cleanup=lambda: release_upload(upload),
+        media_type=negotiate(accept)
+    )
+
+@app.post("/uploads/{upload_id}/analyze")
+async def analyze_upload_live(upload_id: str, accept: Optional[str] = Header(None)):
+    """
+    Starts analyzing while chunks are still arriving; frames are read as the file grows.
+    If the upload is finalized by the time the analysis ends, the result is cached.
+    """
+    upload = get_upload_or_404(upload_id)
+
+    def live_processor():
+        global model, face_ident
+
+        event_log = VideoEventLog()
+        upload.add_reader()
+        try:
+            capture = GrowingVideoCapture(upload)
+            pipeline = VideoPipeline(
+                upload.data_path, model, ComplianceTracker(face_ident, save_snapshots=False), face_ident,
+                log_event=event_log,
+                capture=capture
+            )
+            for update in pipeline.run():
+                if update["status"] == "complete":
+                    upload.analyzed_live = True
+                    if upload.finalized:
+                        job = open_job(analysis_cache_key(upload.content_hash, False), upload.filename, upload.content_hash)
+                        if job is not None:
+                            if not job.hit:
+                                finish_job(job, update, event_log)
+                            job.release()
+                    update["filename"] = upload.filename
+                yield update
         finally:
-            cap.release()
-            os.remove(temp_filename)
-        
-        # Final Result
-        violations_list = []
-        for track_id, data in violations_data.items():
-            violations_list.append({
-                "track_id": track_id,
-                "name": data["name"],
-                "timestamp": data["timestamp"],
-                "frame_number": data["frame_number"],
-                "image_path": data["image_path"],
-                "violation_type": data["violation_type"]
-            })
-            
-        final_response = {
-            "status": "complete",
-            "filename": file.filename,
-            "total_frames_processed": analyzed_frames,
-            "violations_detected": len(violations_list),
-            "violations": violations_list
-        }
-        yield json.dumps(final_response) + "\n"
+            release_upload(upload)
+
+    media_type = negotiate(accept)
+    return StreamingResponse(encode_stream(live_processor(), media_type), media_type=stream_media_type(media_type))
 
-    return StreamingResponse(video_processor(), media_type="application/x-ndjson")
+@app.delete("/uploads/{upload_id}")
+async def delete_upload(upload_id: str):
+    get_upload_or_404(upload_id)
+    await run_in_threadpool(upload_store.discard, upload_id)
+    return {"message": "Upload deleted"}
 
 @app.get("/video_feed")
-async def video_feed():
+async def video_feed(camera_id: str = "0"):
     """
     Video streaming route. Put this in the src attribute of an img tag.
+    All viewers share one capture / inference loop per camera.
     """
+    stream = camera_hub.get(camera_id)
+    if stream is None:
+        raise HTTPException(status_code=404, detail="Camera not found")
     return StreamingResponse(
-        generate_frames(model, face_ident, get_session),
+        stream.mjpeg_frames(),
         media_type="multipart/x-mixed-replace; boundary=frame"
     )
 
+@app.websocket("/ws/detections")
+async def detections_ws(websocket: WebSocket, camera_id: str = "0", thumbnails: bool = False):
+    """
+    Streams per-frame detections (normalized bboxes, track ids, status, name)
+    as JSON text messages, for clients that overlay boxes on their own video.
+    With thumbnails=true a small JPEG of the raw frame follows as a binary message about once a second.
+    """
+    stream = camera_hub.get(camera_id)
+    if stream is None:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    messages = stream.detection_messages(thumbnails)
+    try:
+        async for message, thumbnail in messages:
+            await websocket.send_text(message)
+            if thumbnail is not None:
+                await websocket.send_bytes(thumbnail)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        await messages.aclose()  # Unregisters the client right away
+
+class CameraConfig(BaseModel):
+    camera_id: str
+    source: str # Device index ("0"), file path or stream URL
+    target_fps: float = DEFAULT_TARGET_FPS
+    always_on: bool = False
+    display_mode: str = "inference" # "smooth": native-rate video, overlay extrapolated between inferences
+    latency_budget_ms: float = DEFAULT_BUDGET_MS
+
+class SchedulerConfig(BaseModel):
+    fairness: Optional[str] = None # One of FAIRNESS_MODES
+    max_batch: Optional[int] = None # Frames per detector call
+
+@app.get("/cameras")
+async def list_cameras():
+    return [stream.status() for stream in camera_hub.list()]
+
+@app.get("/cameras/scheduler")
+async def get_camera_scheduler():
+    return dict(camera_hub.scheduler_config(), fairness_modes=FAIRNESS_MODES)
+
+@app.put("/cameras/scheduler")
+async def update_camera_scheduler(config: SchedulerConfig):
+    """
+    Changes how cameras share the detector: fairness (round_robin / deadline) and max_batch.
+    Not persisted; cameras.json ("scheduler" object) sets them at startup.
+    """
+    try:
+        return camera_hub.configure(config.fairness, config.max_batch)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/cameras")
+async def add_camera(config: CameraConfig):
+    try:
+        stream = camera_hub.add(config.camera_id, config.source, config.target_fps,
+                                config.always_on, config.display_mode, config.latency_budget_ms)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return stream.status()
+
+@app.delete("/cameras/{camera_id}")
+async def remove_camera(camera_id: str):
+    if not await run_in_threadpool(camera_hub.remove, camera_id):
+        raise HTTPException(status_code=404, detail="Camera not found")
+    return {"status": "removed", "camera_id": camera_id}
+
 @app.get("/analytics/data")
-async def get_analytics_data():
+async def get_analytics_data(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    camera_id: Optional[str] = None,
+    session: Session = Depends(get_read_session)
+):
     """
-    Aggregates data from the database/violations folder for the dashboard charts.
+    Dashboard charts from the hourly / daily rollups (UTC), for days start..end inclusive.
+    Without a range the trend covers the last 7 days and the hourly / pie charts all time.
     """
     data = {
         "trend": [],
         "hourly": [],
         "pie": []
     }
-    
-    # Path to violations
-    violations_path = "database/violations"
-    violation_dates = {}
-    violation_hours = {h: 0 for h in range(24)}
-    violation_names = {"Identified": 0, "Unknown": 0}
-
-    if os.path.exists(violations_path):
-        for filename in os.listdir(violations_path):
-            if not filename.endswith(('.jpg', '.jpeg', '.png')):
-                continue
-            
-            # Format: Name_YYYYMMDD_HHMMSS.jpg
-            # Robust parsing
-            try:
-                parts = filename.split('_')
-                if len(parts) >= 3:
-                    date_str = parts[-2]
-                    time_str = parts[-1].split('.')[0]
-                    name_part = "_".join(parts[:-2])
-                    
-                    # Trend Count (Day)
-                    dt = datetime.strptime(date_str, "%Y%m%d")
-                    d_key = dt.strftime("%Y-%m-%d")
-                    violation_dates[d_key] = violation_dates.get(d_key, 0) + 1
-                    
-                    # Hourly Count
-                    hour = int(time_str[:2])
-                    if 0 <= hour < 24:
-                        violation_hours[hour] += 1
-                        
-                    # Name/Type Count
-                    if "Unknown" in name_part:
-                        violation_names["Unknown"] += 1
-                    else:
-                        violation_names["Identified"] += 1
-            except Exception:
-                continue
-
-    # --- Trend Data (Last 7 Days) ---
-    today = datetime.now()
-    for i in range(6, -1, -1):
-        d = today - timedelta(days=i)
-        d_key = d.strftime("%Y-%m-%d")
-        day_name = d.strftime("%a") # Mon, Tue
-        v_count = violation_dates.get(d_key, 0)
-        
-        # Mock Verified Data relative to Violations for demo visual
-        # Or ideally read from verified folder if it had files.
-        # Since verified folder is empty, we mock:
-        verified_mock = v_count * 2 + 5 if v_count > 0 else 15
-        
+
+    today = datetime.utcnow().date()
+    trend_end = end or today
+    trend_start = start or (trend_end - timedelta(days=6))
+    if trend_start > trend_end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    # Bucket strings compare like the dates they start with
+    range_start = start.isoformat() if start else None
+    range_end = (end + timedelta(days=1)).isoformat() if end else None
+
+    # --- Trend Data (one point per day) ---
+    daily = dict(read_rollups(session, "day", trend_start.isoformat(),
+                              (trend_end + timedelta(days=1)).isoformat(), camera_id))
+    d = trend_start
+    while d <= trend_end:
+        counts = daily.get(d.isoformat(), {})
         data["trend"].append({
-            "name": day_name,
-            "violations": v_count,
-            "verified": verified_mock
+            "name": d.strftime("%a"), # Mon, Tue
+            "date": d.isoformat(),
+            "violations": counts.get("violations", 0),
+            "verified": counts.get("verified", 0)
         })
+        d += timedelta(days=1)
 
     # --- Hourly Data ---
+    hour_of_day = func.substr(EventRollup.bucket, 12, 2)
+    violation_hours = {int(h): counts["violations"]
+                       for h, counts in read_rollups(session, "hour", range_start, range_end, camera_id, group=hour_of_day)}
+
     # Aggregate into 2-hour blocks
     for h in range(0, 24, 2):
-        count = violation_hours[h] + violation_hours.get(h+1, 0)
+        count = violation_hours.get(h, 0) + violation_hours.get(h+1, 0)
         time_label = f"{h:02d}:00"
         data["hourly"].append({
             "name": time_label,
@@ -561,9 +948,12 @@ async def get_analytics_data():
         })
 
     # --- Pie Data ---
+    # Grouped by period, which is the same for every row: one total over the range
+    totals = read_rollups(session, "day", range_start, range_end, camera_id, group=EventRollup.period)
+    totals = totals[0][1] if totals else {"identified": 0, "unknown": 0}
     data["pie"] = [
-        {"name": "Identified", "value": violation_names["Identified"], "color": "#00C49F"},
-        {"name": "Unknown", "value": violation_names["Unknown"], "color": "#FF4848"}
+        {"name": "Identified", "value": totals["identified"], "color": "#00C49F"},
+        {"name": "Unknown", "value": totals["unknown"], "color": "#FF4848"}
     ]
 
     return data
@@ -0,0 +1,28 @@
+"""
+Unit tests for the vectorized NMS.
+Run with: python -m pytest test_nms.py
+"""
+import numpy as np
+
+from modules.nms import nms, soft_nms, suppress
+
+
+def test_class_aware_keeps_overlapping_boxes_of_other_classes():
+    boxes = [[0, 0, 100, 100], [2, 2, 100, 100], [0, 0, 100, 100]]
+    keep = nms(boxes, [0.9, 0.8, 0.7], 0.5, classes=[0, 0, 1])
+    assert sorted(keep.tolist()) == [0, 2]
+
+
+def test_class_aware_with_negative_coordinates():
+    # Boxes at the frame edge decode with x1 / y1 below 0
+    boxes = [[-50, -50, 10, 10], [-50, -50, 10, 10]]
+    assert sorted(nms(boxes, [0.9, 0.8], 0.5, classes=[0, 1]).tolist()) == [0, 1]
+    keep, _ = soft_nms(boxes, [0.9, 0.8], 0.5, classes=[0, 1])
+    assert sorted(keep.tolist()) == [0, 1]
+
+
+def test_agnostic_suppresses_across_classes():
+    boxes = [[-50, -50, 10, 10], [-50, -50, 10, 10]]
+    keep, scores = suppress(boxes, [0.9, 0.8], classes=[0, 1], iou_threshold=0.5, mode="agnostic")
+    assert keep.tolist() == [0]
+    assert np.allclose(scores, [0.9])
@@ -0,0 +1,156 @@
+"""
+Unit tests for chunked uploads and reading frames from a growing upload.
+Run with: python -m pytest test_uploads.py
+"""
+import os
+import hashlib
+import threading
+
+import pytest
+
+import modules.uploads as uploads
+from modules.uploads import ChunkedUpload, ChunkError, UploadStore, GrowingVideoCapture
+
+
+def sha(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class FakeCapture:
+    """Stands in for cv2.VideoCapture: every byte of the file is one frame."""
+
+    def __init__(self, path):
+        self.frames = os.path.getsize(path)
+        self.pos = 0
+
+    def grab(self):
+        if self.pos < self.frames:
+            self.pos += 1
+            return True
+        return False
+
+    def read(self):
+        ok = self.grab()
+        return ok, (self.pos - 1 if ok else None)
+
+    def get(self, prop):
+        return 0
+
+    def set(self, prop, value):
+        self.pos = int(value)
+        return True
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
+
+
+@pytest.fixture
+def store(tmp_path):
+    return UploadStore(upload_root=str(tmp_path))
+
+
+def test_out_of_order_chunks_are_appended_once_contiguous(store):
+    upload = store.create("clip.mp4", total_size=10, chunk_size=4)
+    chunks = [b"abcd", b"efgh", b"ij"]
+
+    upload.write_chunk(2, chunks[2], sha(chunks[2]))
+    upload.write_chunk(1, chunks[1], sha(chunks[1]))
+    assert upload.contiguous_bytes == 0
+    assert upload.missing_chunks() == [0]
+
+    upload.write_chunk(0, chunks[0], sha(chunks[0]))
+    assert upload.contiguous_bytes == 10
+    assert upload.complete
+
+    # A retried chunk is a no-op
+    upload.write_chunk(1, chunks[1], sha(chunks[1]))
+    with open(upload.data_path, "rb") as f:
+        assert f.read() == b"abcdefghij"
+    assert upload.finalize() == sha(b"abcdefghij")
+
+
+def test_chunk_validation(store):
+    upload = store.create("clip.mp4", total_size=8, chunk_size=4)
+
+    with pytest.raises(ChunkError):
+        upload.write_chunk(0, b"abcd", None)
+    with pytest.raises(ChunkError):
+        upload.write_chunk(0, b"abcd", sha(b"dcba"))
+    with pytest.raises(ChunkError):
+        upload.write_chunk(2, b"abcd", sha(b"abcd"))
+    with pytest.raises(ChunkError):
+        upload.write_chunk(0, b"ab", sha(b"ab"))
+    with pytest.raises(ChunkError):
+        upload.finalize()
+    assert upload.received == {}
+
+
+def test_resume_from_manifest(store):
+    upload = store.create("clip.mp4", total_size=8, chunk_size=4)
+    upload.write_chunk(0, b"abcd", sha(b"abcd"))
+
+    # Server restart: the upload is reloaded from its manifest
+    reloaded = UploadStore(upload_root=store.upload_root).get(upload.upload_id)
+    assert reloaded.missing_chunks() == [1]
+    reloaded.write_chunk(1, b"efgh", sha(b"efgh"))
+    assert reloaded.finalize() == sha(b"abcdefgh")
+
+
+def test_chunks_after_finalize_are_rejected(store):
+    upload = store.create("clip.mp4", chunk_size=4)
+    upload.write_chunk(0, b"abcd", sha(b"abcd"))
+    content_hash = upload.finalize()
+
+    with pytest.raises(ChunkError):
+        upload.write_chunk(1, b"efgh", sha(b"efgh"))
+    with open(upload.data_path, "rb") as f:
+        assert f.read() == b"abcd"
+    assert upload.finalize() == content_hash
+
+
+def test_readers_counter(store):
+    upload = store.create("clip.mp4")
+    upload.add_reader()
+    assert upload.has_readers()
+    upload.remove_reader()
+    assert not upload.has_readers()
+
+
+def test_growing_capture_reads_chunks_arriving_later(store, monkeypatch):
+    monkeypatch.setattr(uploads.cv2, "VideoCapture", FakeCapture)
+    monkeypatch.setattr(uploads, "MIN_START_BYTES", 1)
+
+    upload = store.create("clip.mp4", total_size=12, chunk_size=4)
+    upload.write_chunk(0, b"aaaa", sha(b"aaaa"))
+
+    capture = GrowingVideoCapture(upload, stall_timeout=5)
+    frames = []
+    started = threading.Event()
+
+    def reader():
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frames.append(frame)
+            if len(frames) == 4:
+                # The decoder is now at the end of what has arrived
+                started.set()
+
+    t = threading.Thread(target=reader)
+    t.start()
+    assert started.wait(5)
+
+    upload.write_chunk(1, b"bbbb", sha(b"bbbb"))
+    upload.write_chunk(2, b"cccc", sha(b"cccc"))
+    upload.finalize()
+    t.join(10)
+
+    assert not t.is_alive()
+    # Reopened after each growth and continued where it stopped
+    assert frames == list(range(12))
+    assert capture.position == 12
+    capture.release()